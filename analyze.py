@@ -3,18 +3,51 @@
 Traffic Data Analysis Utilities
 
 Example queries and analysis functions for the collected traffic data.
+Speed queries take storage= ("rows", "packed", "delta" or "matrix") to
+read the mode the collector wrote; packed and delta data are read through
+snapshots.get_sensor_range_history.
+
+    python analyze.py
+    python analyze.py --storage packed
 """
 
-import sqlite3
 import json
-from datetime import datetime, timedelta
+import sys
+import time
+from datetime import datetime, timezone
 from pathlib import Path
 
+from snapshots import get_sensor_history, get_sensor_range_history
+from shards import open_router, iter_routers
+from speed_matrix import open_matrix
+
 DB_PATH = Path(__file__).parent / "traffic.db"
 
 
-def get_connection():
-    return sqlite3.connect(DB_PATH)
+def get_connection(since: int = None, until: int = None):
+    """Open the database with any time shards overlapping epoch range (since, until] attached."""
+    return open_router(since, until, db_path=DB_PATH)
+
+
+def count_readings(storage: str = "rows") -> int:
+    """
+    Sensor readings stored in the main database and every shard (in batches
+    past SQLite's attach limit), or in the speed matrix.
+    """
+    if storage == "matrix":
+        matrix = open_matrix()
+        return len(matrix) * matrix.width
+    query = ("""
+        SELECT (SELECT COALESCE(SUM(length(speeds)), 0) FROM speed_snapshots)
+             + (SELECT COALESCE(SUM(s.sensor_count), 0)
+                FROM speed_deltas d JOIN speed_snapshots s ON s.scrape_id = d.keyframe_id)
+    """ if storage in ("packed", "delta") else "SELECT COUNT(*) FROM speed_readings")
+    return sum(conn.execute(query).fetchone()[0] for conn in iter_routers(db_path=DB_PATH))
+
+
+def hours_ago(hours: float) -> int:
+    """Epoch seconds for N hours before now."""
+    return int(time.time() - hours * 3600)
 
 
 def list_routes(conn):
@@ -32,40 +65,77 @@ def list_routes(conn):
         print(f"  Route {route} {direction}: {count} sensors")
 
 
-def get_sensor_speeds(conn, sensor_idx: int, hours: int = 24):
-    """Get speed history for a specific sensor."""
-    cutoff = (datetime.utcnow() - timedelta(hours=hours)).isoformat() + "Z"
+def get_sensor_speeds(conn, sensor_idx: int, hours: int = 24, storage: str = "rows"):
+    """Get speed history for a specific sensor: [(epoch_s, speed_mph, has_incident), ...]."""
+    cutoff = hours_ago(hours)
+    if storage in ("packed", "delta"):
+        return get_sensor_history(conn, sensor_idx, since=cutoff)
     cursor = conn.execute("""
-        SELECT timestamp, speed_mph, has_incident
-        FROM speed_readings
-        WHERE sensor_idx = ? AND timestamp > ?
-        ORDER BY timestamp
+        SELECT sc.epoch_s, r.speed_mph, r.has_incident
+        FROM speed_readings r
+        JOIN scrapes sc ON sc.id = r.scrape_id
+        WHERE r.sensor_idx = ? AND sc.epoch_s > ?
+        ORDER BY sc.epoch_s
     """, (sensor_idx, cutoff))
     return cursor.fetchall()
 
 
-def get_route_average_speeds(conn, route: str, direction: str, hours: int = 1):
-    """Get average speeds for all sensors on a route."""
-    cutoff = (datetime.utcnow() - timedelta(hours=hours)).isoformat() + "Z"
+def _average_speeds(conn, start_idx: int, end_idx: int, since: int, storage: str) -> list:
+    """
+    [(sensor_idx, avg_speed, readings), ...] for sensors start_idx..end_idx
+    with a speed since epoch since, from packed/delta snapshots or the speed matrix.
+    """
+    if storage == "matrix":
+        return open_matrix().average_speeds(start_idx, end_idx, since=since)
+    totals, counts = {}, {}
+    for _, speeds in get_sensor_range_history(conn, start_idx, end_idx, since=since):
+        for idx, speed in enumerate(speeds, start_idx):
+            if speed is not None:
+                totals[idx] = totals.get(idx, 0) + speed
+                counts[idx] = counts.get(idx, 0) + 1
+    return [(idx, totals[idx] / counts[idx], counts[idx]) for idx in sorted(totals)]
+
+
+def get_route_average_speeds(conn, route: str, direction: str, hours: int = 1, storage: str = "rows"):
+    """Get average speeds for all sensors on a route: [(idx, name, avg_speed, readings), ...]."""
+    cutoff = hours_ago(hours)
+    if storage != "rows":
+        names = dict(conn.execute("SELECT idx, name FROM sensors WHERE route = ? AND direction = ?",
+                                  (route, direction)))
+        if not names:
+            return []
+        averages = _average_speeds(conn, min(names), max(names), cutoff, storage)
+        return [(idx, names[idx], avg_speed, readings) for idx, avg_speed, readings in averages if idx in names]
     cursor = conn.execute("""
         SELECT s.idx, s.name, AVG(r.speed_mph) as avg_speed, COUNT(*) as readings
         FROM sensors s
         JOIN speed_readings r ON s.idx = r.sensor_idx
-        WHERE s.route = ? AND s.direction = ? AND r.timestamp > ?
+        JOIN scrapes sc ON sc.id = r.scrape_id
+        WHERE s.route = ? AND s.direction = ? AND sc.epoch_s > ?
         GROUP BY s.idx
         ORDER BY s.idx
     """, (route, direction, cutoff))
     return cursor.fetchall()
 
 
-def find_slowdowns(conn, threshold: int = 25, hours: int = 1):
+def find_slowdowns(conn, threshold: int = 25, hours: int = 1, storage: str = "rows"):
     """Find sensors with speeds below threshold in recent readings."""
-    cutoff = (datetime.utcnow() - timedelta(hours=hours)).isoformat() + "Z"
+    cutoff = hours_ago(hours)
+    if storage != "rows":
+        sensors = {idx: (name, route, direction) for idx, name, route, direction in
+                   conn.execute("SELECT idx, name, route, direction FROM sensors")}
+        if not sensors:
+            return []
+        slow = [sensors[idx] + (avg_speed,)
+                for idx, avg_speed, _ in _average_speeds(conn, 0, max(sensors), cutoff, storage)
+                if idx in sensors and avg_speed < threshold]
+        return sorted(slow, key=lambda row: row[3])
     cursor = conn.execute("""
         SELECT s.name, s.route, s.direction, AVG(r.speed_mph) as avg_speed
         FROM sensors s
         JOIN speed_readings r ON s.idx = r.sensor_idx
-        WHERE r.timestamp > ? AND r.speed_mph IS NOT NULL
+        JOIN scrapes sc ON sc.id = r.scrape_id
+        WHERE sc.epoch_s > ? AND r.speed_mph IS NOT NULL
         GROUP BY s.idx
         HAVING AVG(r.speed_mph) < ?
         ORDER BY avg_speed
@@ -75,26 +145,24 @@ def find_slowdowns(conn, threshold: int = 25, hours: int = 1):
 
 def get_recent_incidents(conn, hours: int = 24):
     """Get incidents from the last N hours."""
-    cutoff = (datetime.utcnow() - timedelta(hours=hours)).isoformat() + "Z"
     cursor = conn.execute("""
         SELECT id, location, description, start_time, update_time
         FROM incidents
         WHERE first_seen > ?
         ORDER BY start_time DESC
-    """, (cutoff,))
+    """, (hours_ago(hours),))
     return cursor.fetchall()
 
 
-def get_data_stats(conn):
+def get_data_stats(conn, storage: str = "rows"):
     """Get overall statistics about collected data."""
     stats = {}
 
-    # Total readings
-    cursor = conn.execute("SELECT COUNT(*) FROM speed_readings")
-    stats["total_readings"] = cursor.fetchone()[0]
+    # Total readings (conn may only have recent shards attached)
+    stats["total_readings"] = count_readings(storage)
 
-    # Date range
-    cursor = conn.execute("SELECT MIN(timestamp), MAX(timestamp) FROM speed_readings")
+    # Date range (epoch seconds)
+    cursor = conn.execute("SELECT MIN(epoch_s), MAX(epoch_s) FROM scrapes")
     row = cursor.fetchone()
     stats["first_reading"] = row[0]
     stats["last_reading"] = row[1]
@@ -109,23 +177,40 @@ def get_data_stats(conn):
 
     # Readings per hour (estimate)
     if stats["first_reading"] and stats["last_reading"]:
-        first = datetime.fromisoformat(stats["first_reading"].replace("Z", ""))
-        last = datetime.fromisoformat(stats["last_reading"].replace("Z", ""))
-        hours = max((last - first).total_seconds() / 3600, 1)
+        hours = max((stats["last_reading"] - stats["first_reading"]) / 3600, 1)
         stats["readings_per_hour"] = int(stats["total_readings"] / hours)
 
     return stats
 
 
-def export_route_csv(conn, route: str, direction: str, output_path: str, hours: int = 24):
-    """Export route data to CSV for external analysis."""
-    cutoff = (datetime.utcnow() - timedelta(hours=hours)).isoformat() + "Z"
-    cursor = conn.execute("""
-        SELECT r.timestamp, s.idx, s.name, r.speed_mph, r.has_incident
+def _packed_route_rows(conn, route: str, direction: str, since: int):
+    """export_route_csv rows from packed or delta snapshots, ordered by time then sensor."""
+    names = dict(conn.execute("SELECT idx, name FROM sensors WHERE route = ? AND direction = ?", (route, direction)))
+    if not names:
+        return
+    start_idx, end_idx = min(names), max(names)
+    incidents = set(conn.execute("""
+        SELECT sc.epoch_s, r.sensor_idx FROM snapshot_incident_refs r JOIN scrapes sc ON sc.id = r.scrape_id
+        WHERE r.sensor_idx BETWEEN ? AND ? AND sc.epoch_s > ?
+    """, (start_idx, end_idx, since)))
+    for epoch_s, speeds in get_sensor_range_history(conn, start_idx, end_idx, since=since):
+        timestamp = datetime.fromtimestamp(epoch_s, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        for idx, speed in enumerate(speeds, start_idx):
+            if idx in names:
+                yield timestamp, idx, names[idx], speed, int((epoch_s, idx) in incidents)
+
+
+def export_route_csv(conn, route: str, direction: str, output_path: str, hours: int = 24, storage: str = "rows"):
+    """Export route data to CSV for external analysis (storage "rows", "packed" or "delta")."""
+    cutoff = hours_ago(hours)
+    packed = storage in ("packed", "delta")
+    cursor = _packed_route_rows(conn, route, direction, cutoff) if packed else conn.execute("""
+        SELECT strftime('%Y-%m-%dT%H:%M:%SZ', sc.epoch_s, 'unixepoch'), s.idx, s.name, r.speed_mph, r.has_incident
         FROM speed_readings r
         JOIN sensors s ON r.sensor_idx = s.idx
-        WHERE s.route = ? AND s.direction = ? AND r.timestamp > ?
-        ORDER BY r.timestamp, s.idx
+        JOIN scrapes sc ON sc.id = r.scrape_id
+        WHERE s.route = ? AND s.direction = ? AND sc.epoch_s > ?
+        ORDER BY sc.epoch_s, s.idx
     """, (route, direction, cutoff))
 
     with open(output_path, "w") as f:
@@ -137,18 +222,21 @@ def export_route_csv(conn, route: str, direction: str, output_path: str, hours:
 
 def main():
     """Interactive analysis CLI."""
-    conn = get_connection()
+    storage = sys.argv[sys.argv.index("--storage") + 1] if "--storage" in sys.argv else "rows"
+    conn = get_connection(hours_ago(24))
 
     print("Traffic Data Analyzer")
     print("=" * 40)
 
-    stats = get_data_stats(conn)
+    stats = get_data_stats(conn, storage)
     print(f"\nDatabase Stats:")
     print(f"  Total readings: {stats['total_readings']:,}")
     print(f"  Sensors: {stats['sensor_count']:,}")
     print(f"  Incidents: {stats['incident_count']:,}")
     if stats.get("first_reading"):
-        print(f"  Date range: {stats['first_reading'][:19]} to {stats['last_reading'][:19]}")
+        first = datetime.fromtimestamp(stats["first_reading"], timezone.utc)
+        last = datetime.fromtimestamp(stats["last_reading"], timezone.utc)
+        print(f"  Date range: {first:%Y-%m-%dT%H:%M:%S} to {last:%Y-%m-%dT%H:%M:%S}")
         print(f"  ~{stats.get('readings_per_hour', 0):,} readings/hour")
 
     print("\n" + "=" * 40)
@@ -156,7 +244,7 @@ def main():
 
     print("\n" + "=" * 40)
     print("\nRecent Slowdowns (<25 mph avg):")
-    slowdowns = find_slowdowns(conn, threshold=25, hours=1)
+    slowdowns = find_slowdowns(conn, threshold=25, hours=1, storage=storage)
     for name, route, direction, avg_speed in slowdowns[:10]:
         print(f"  {name} ({route} {direction}): {avg_speed:.0f} mph")
 
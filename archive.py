@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Columnar Parquet Archive
+
+Exports speed data (from speed_readings, packed snapshots or deltas, in the
+main database and shards) to Parquet files partitioned by UTC date and road
+section:
+
+    archive/date=2026-01-12/section=100011/part-0.parquet
+
+Columns: epoch_s, sensor_idx, speed_mph (null = no data), has_incident,
+incident_ids. Rows are sorted by (sensor_idx, epoch_s) so row-group
+statistics let readers skip sensors they don't need.
+
+The reader prunes date/section partitions and pushes time and sensor
+predicates down into Parquet row groups, reading only requested columns:
+
+    from archive import read_archive
+    table = read_archive(["epoch_s", "speed_mph"], since=..., sensors=(5789, 5816))
+
+Requires pyarrow (pip install pyarrow).
+
+    python archive.py --days 30
+"""
+
+import argparse
+import calendar
+import shutil
+import time
+from pathlib import Path
+
+from rollups import iter_stored_scrapes
+from shards import open_router
+
+DB_PATH = Path(__file__).parent / "traffic.db"
+ARCHIVE_DIR = Path(__file__).parent / "archive"
+
+ROW_GROUP_SIZE = 131072
+COMPRESSION = "zstd"
+UNASSIGNED_SECTION = 0  # Partition for sensors outside every road section
+
+
+def _schemas():
+    import pyarrow as pa
+
+    schema = pa.schema([
+        ("epoch_s", pa.int64()),
+        ("sensor_idx", pa.int32()),
+        ("speed_mph", pa.uint8()),
+        ("has_incident", pa.bool_()),
+        ("incident_ids", pa.string()),
+    ])
+    partitioning = pa.schema([("date", pa.string()), ("section", pa.int64())])
+    return schema, partitioning
+
+
+def sensor_sections(conn) -> list:
+    """Road section id per sensor index (UNASSIGNED_SECTION if none)."""
+    max_idx = conn.execute("SELECT MAX(idx) FROM sensors").fetchone()[0] or 0
+    sections = [UNASSIGNED_SECTION] * (max_idx + 1)
+    for section_id, start_idx, end_idx in conn.execute(
+            "SELECT id, start_idx, end_idx FROM road_sections ORDER BY id"):
+        for idx in range(start_idx, min(end_idx, max_idx) + 1):
+            sections[idx] = section_id
+    return sections
+
+
+def _incident_refs(conn, since: int, until: int) -> dict:
+    """{(scrape_id, sensor_idx): incident_ids_json} for scrapes in [since, until)."""
+    refs = {}
+    for table in ("speed_readings", "snapshot_incident_refs"):
+        refs.update(((scrape_id, idx), ids) for scrape_id, idx, ids in conn.execute(f"""
+            SELECT t.scrape_id, t.sensor_idx, t.incident_ids
+            FROM {table} t JOIN scrapes sc ON sc.id = t.scrape_id
+            WHERE sc.epoch_s >= ? AND sc.epoch_s < ? AND t.incident_ids IS NOT NULL
+        """, (since, until)))
+    return refs
+
+
+def export_day(conn, day_start: int, sections: list, archive_dir: Path = ARCHIVE_DIR) -> int:
+    """
+    Write one UTC day [day_start, day_start + 86400) to its partitions,
+    replacing any previous export of that day (a day with nothing stored
+    keeps it). The day is written to a hidden directory, which dataset
+    discovery skips, and swapped in by rename. Returns rows written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema, _ = _schemas()
+    day_end = day_start + 86400
+    date = time.strftime("%Y-%m-%d", time.gmtime(day_start))
+    day_dir = Path(archive_dir) / f"date={date}"
+    staging, replaced = day_dir.with_name(f".{day_dir.name}.new"), day_dir.with_name(f".{day_dir.name}.old")
+    if replaced.exists() and not day_dir.exists():
+        replaced.rename(day_dir)  # Swap interrupted: the previous export is still current
+    shutil.rmtree(staging, ignore_errors=True)
+    shutil.rmtree(replaced, ignore_errors=True)
+    refs = _incident_refs(conn, day_start, day_end)
+
+    # Column lists per section, filled scrape by scrape
+    columns = {}
+    for scrape_id, epoch_s, speeds in iter_stored_scrapes(conn, since=day_start, until=day_end):
+        for idx, speed in enumerate(speeds):
+            section = sections[idx] if idx < len(sections) else UNASSIGNED_SECTION
+            cols = columns.get(section)
+            if cols is None:
+                cols = columns[section] = ([], [], [], [], [])
+            ids = refs.get((scrape_id, idx))
+            cols[0].append(epoch_s)
+            cols[1].append(idx)
+            cols[2].append(None if speed is None else min(max(int(speed), 0), 255))
+            cols[3].append(ids is not None)
+            cols[4].append(ids)
+
+    rows = 0
+    for section, cols in columns.items():
+        table = pa.Table.from_arrays([pa.array(c, type=f.type) for c, f in zip(cols, schema)], schema=schema)
+        table = table.sort_by([("sensor_idx", "ascending"), ("epoch_s", "ascending")])
+        path = staging / f"section={section}"
+        path.mkdir(parents=True, exist_ok=True)
+        pq.write_table(table, path / "part-0.parquet", row_group_size=ROW_GROUP_SIZE,
+                       compression=COMPRESSION)
+        rows += table.num_rows
+
+    # The whole day is swapped, so sections with no data this time are dropped
+    if columns:
+        if day_dir.exists():
+            day_dir.rename(replaced)
+        staging.rename(day_dir)
+        shutil.rmtree(replaced, ignore_errors=True)
+    return rows
+
+
+def export_archive(since: int, until: int, db_path: Path = DB_PATH, archive_dir: Path = ARCHIVE_DIR) -> int:
+    """
+    Export every UTC day overlapping epoch range [since, until). Returns rows written.
+    Each day is read through its own router, so any number of shards can be exported.
+    """
+    total = 0
+    day = since - since % 86400
+    while day < until:
+        conn = open_router(day, day + 86400, db_path)
+        try:
+            rows = export_day(conn, day, sensor_sections(conn), archive_dir)
+        finally:
+            conn.close()
+        print(f"  {time.strftime('%Y-%m-%d', time.gmtime(day))}: {rows:,} rows")
+        total += rows
+        day += 86400
+    return total
+
+
+def read_archive(columns: list = None, since: int = None, until: int = None,
+                 sensors: tuple = None, sections: list = None, archive_dir: Path = ARCHIVE_DIR):
+    """
+    Read archived speeds as a pyarrow Table.
+    columns: column names to read (default all, plus "date" and "section")
+    since/until: epoch range (since, until]
+    sensors: (start_idx, end_idx) inclusive
+    sections: road section ids
+    Date and section filters prune whole partitions; time and sensor filters
+    skip Parquet row groups using their statistics.
+    """
+    import pyarrow.dataset as ds
+
+    _, partitioning = _schemas()
+    dataset = ds.dataset(archive_dir, format="parquet",
+                         partitioning=ds.partitioning(partitioning, flavor="hive"))
+
+    conditions = []
+    if since is not None:
+        conditions += [ds.field("date") >= time.strftime("%Y-%m-%d", time.gmtime(since)),
+                       ds.field("epoch_s") > since]
+    if until is not None:
+        conditions += [ds.field("date") <= time.strftime("%Y-%m-%d", time.gmtime(until)),
+                       ds.field("epoch_s") <= until]
+    if sensors is not None:
+        conditions += [ds.field("sensor_idx") >= sensors[0], ds.field("sensor_idx") <= sensors[1]]
+    if sections is not None:
+        conditions.append(ds.field("section").isin(list(sections)))
+
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return dataset.to_table(columns=columns, filter=expression)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export speed data to a partitioned Parquet archive")
+    parser.add_argument("--days", type=int, default=7, help="Export the last N days (default: 7)")
+    parser.add_argument("--date", type=str, help="Export one UTC day (YYYY-MM-DD)")
+    parser.add_argument("--output", type=Path, default=ARCHIVE_DIR, help="Archive directory")
+    args = parser.parse_args()
+
+    if args.date:
+        since = calendar.timegm(time.strptime(args.date, "%Y-%m-%d"))
+        until = since + 86400
+    else:
+        until = int(time.time())
+        since = until - args.days * 86400
+
+    print(f"Database: {DB_PATH}")
+    print(f"Archive: {args.output}")
+    rows = export_archive(since, until, archive_dir=args.output)
+    size = sum(f.stat().st_size for f in Path(args.output).rglob("*.parquet"))
+    print(f"Exported {rows:,} rows; archive is {size:,} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Ingest Benchmarks
+
+Repeatable timings of the ingest path on SyntheticFeed payloads, so storage
+and schema changes can be measured before they reach production:
+- record_speeds[storage]: one scrape of speeds per cycle, with rollups
+  buffered per hour as the collectors do (p95 includes the hourly flush)
+- record_incidents: incident upsert and close-out per cycle
+- scrape_once[storage]: scrape_once's fetch + parse + store end to end,
+  against an in-process replay server (bench/replay_server.py) with
+  --latency ms; each cycle is stored at the next feed refresh time
+- lambda_compact[format]: cloud/scraper_lambda.py's parse, compaction and
+  serialization of a live payload and Waze alerts, as JSON or as a binary
+  snapshot (cloud/snapshot_codec.py)
+- decode_snapshot[format]: download_data's decoding of one such snapshot
+  into columns
+
+Each benchmark runs in its own process on a fresh database, after
+--warmup untimed cycles, and reports rows/s, ms per cycle (median and
+p95), the process's peak RSS and, for the snapshot benchmarks, the
+payload size. Each cycle's payload is generated
+before its timer starts, and the same seed gives the same payloads.
+
+    python bench/ingest.py
+    python bench/ingest.py --only record_speeds --storage rows,delta --cycles 200 --layout clustered
+    python bench/ingest.py --json > before.jsonl
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import resource
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).parent.parent / "cloud"))
+sys.path.insert(0, str(Path(__file__).parent))
+from synthetic import SyntheticFeed, SEED
+
+BENCHMARKS = ("record_speeds", "record_incidents", "scrape_once", "lambda_compact", "decode_snapshot")
+BENCH_STORAGE = ("rows", "packed", "delta")  # matrix writes to the fixed matrix/ directory
+SNAPSHOT_FORMATS = ("json", "snap")
+DEFAULT_CYCLES = 50
+DEFAULT_WARMUP = 3
+START_EPOCH = 1768226400  # Mon 2026-01-12 06:00 Pacific: cycles run into the morning peak
+CYCLE_SECONDS = 120
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KB on Linux
+
+
+def _payloads(feed: SyntheticFeed, count: int):
+    """Yield (epoch_s, raw body) of count consecutive live feed refreshes."""
+    for i in range(count):
+        epoch_s = START_EPOCH + i * CYCLE_SECONDS
+        yield epoch_s, json.dumps(feed.live(epoch_s), separators=(",", ":")).encode("utf-8")
+
+
+def _open_db(work_dir: str, feed: SyntheticFeed, layout: str) -> sqlite3.Connection:
+    import scraper
+
+    conn = sqlite3.connect(Path(work_dir) / "bench.db")
+    scraper.init_db(conn, layout)
+    scraper.populate_sensors(conn, feed.static())
+    return conn
+
+
+def _bench_record_speeds(feed, cycles, work_dir, storage, layout, latency):
+    import scraper
+    from feed_parser import parse_live_feed
+    from rollups import RollupBuffer
+
+    conn = _open_db(work_dir, feed, layout)
+    buffer = RollupBuffer()
+    for epoch_s, body in _payloads(feed, cycles):
+        data, _ = parse_live_feed(body)
+        start = time.perf_counter()
+        scrape_id = scraper.register_scrape(conn, epoch_s, "bench")
+        total, _ = scraper.record_speeds(conn, data, scrape_id, storage, epoch_s, rollup_buffer=buffer)
+        yield time.perf_counter() - start, total
+    conn.close()
+
+
+def _bench_record_incidents(feed, cycles, work_dir, storage, layout, latency):
+    import scraper
+    from feed_parser import parse_live_feed
+
+    conn = _open_db(work_dir, feed, layout)
+    for epoch_s, body in _payloads(feed, cycles):
+        data, _ = parse_live_feed(body)
+        start = time.perf_counter()
+        count = scraper.record_incidents(conn, data, epoch_s)
+        yield time.perf_counter() - start, count
+    conn.close()
+
+
+def _bench_scrape_once(feed, cycles, work_dir, storage, layout, latency):
+    import http_client
+    import replay_server
+    import scraper
+
+    upstream = replay_server.Upstream(feed, period=0, latency={"*": latency})
+    server = replay_server.start_server(upstream, port=0)
+    http_client.UPSTREAM = f"http://127.0.0.1:{server.server_address[1]}"
+    conn = _open_db(work_dir, feed, layout)
+    for i in range(cycles):
+        start = time.perf_counter()
+        # scrape_once, stored at the replay clock: cycles are closer together than scrapes' 1 s resolution
+        data = scraper.fetch_live_data(skip_unchanged=True)
+        result = scraper.store_snapshot(conn, data, START_EPOCH + i * CYCLE_SECONDS, "bench", storage)
+        yield time.perf_counter() - start, result.get("total_sensors", 0)
+    conn.close()
+    server.shutdown()
+
+
+def _waze_alerts(feed: SyntheticFeed, epoch_s: int) -> list:
+    from scraper_lambda import WAZE_TILES
+
+    return [feed.waze(tile, epoch_s)["alerts"] for tile in WAZE_TILES]
+
+
+def _serialize(snapshot: dict, storage: str) -> bytes:
+    from snapshot_codec import encode_snapshot
+
+    if storage == "snap":
+        return encode_snapshot(snapshot)
+    return json.dumps(snapshot, separators=(",", ":")).encode("utf-8")
+
+
+def _bench_lambda_compact(feed, cycles, work_dir, storage, layout, latency):
+    from feed_parser import parse_live_feed
+    from scraper_lambda import compact_sigalert, compact_waze_alert, dedupe_alerts
+
+    for epoch_s, body in _payloads(feed, cycles):
+        tile_alerts = _waze_alerts(feed, epoch_s)
+        start = time.perf_counter()
+        data, _ = parse_live_feed(body)
+        snapshot = {"t": epoch_s, "chp": {}, "waze": [compact_waze_alert(a) for a in dedupe_alerts(tile_alerts)],
+                    **compact_sigalert(data)}
+        payload = _serialize(snapshot, storage)
+        yield time.perf_counter() - start, len(snapshot["s"]), len(payload)
+
+
+def _bench_decode_snapshot(feed, cycles, work_dir, storage, layout, latency):
+    from feed_parser import parse_live_feed
+    from scraper_lambda import compact_sigalert, compact_waze_alert, dedupe_alerts
+    from snapshot_codec import decode_snapshot
+
+    for epoch_s, body in _payloads(feed, cycles):
+        data, _ = parse_live_feed(body)
+        waze = [compact_waze_alert(a) for a in dedupe_alerts(_waze_alerts(feed, epoch_s))]
+        payload = _serialize({"t": epoch_s, "chp": {}, "waze": waze, **compact_sigalert(data)}, storage)
+        start = time.perf_counter()
+        snapshot = decode_snapshot(payload, columns=True)
+        yield time.perf_counter() - start, len(snapshot["speeds"]), len(payload)
+
+
+def run_benchmark(name: str, storage: str, cycles: int, warmup: int, seed: int,
+                  layout: str = None, latency: float = 0) -> dict:
+    """Run one benchmark in this process and summarize it."""
+    feed = SyntheticFeed(seed)
+    bench = globals()[f"_bench_{name}"]
+    with tempfile.TemporaryDirectory() as work_dir, contextlib.redirect_stdout(io.StringIO()):
+        timings = list(bench(feed, warmup + cycles, work_dir, storage, layout, latency))[warmup:]
+    seconds = [timing[0] for timing in timings]
+    rows = sum(timing[1] for timing in timings)
+    ordered = sorted(seconds)
+    result = {
+        "benchmark": f"{name}[{storage}]" if name != "record_incidents" else name,
+        "cycles": cycles,
+        "rows": rows,
+        "rows_per_s": rows / sum(seconds) if sum(seconds) else 0,
+        "ms_median": statistics.median(seconds) * 1000,
+        "ms_p95": ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)] * 1000,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if len(timings[0]) > 2:
+        result["payload_bytes"] = statistics.mean(timing[2] for timing in timings)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest benchmarks on synthetic feed payloads")
+    parser.add_argument("--only", help=f"Comma-separated benchmarks (default: all of {', '.join(BENCHMARKS)})")
+    parser.add_argument("--storage", default=",".join(BENCH_STORAGE),
+                        help="Comma-separated storage modes for record_speeds and scrape_once")
+    parser.add_argument("--format", default=",".join(SNAPSHOT_FORMATS),
+                        help="Comma-separated snapshot formats for lambda_compact and decode_snapshot")
+    parser.add_argument("--layout", help="speed_readings layout of the benchmark databases")
+    parser.add_argument("--cycles", type=int, default=DEFAULT_CYCLES)
+    parser.add_argument("--warmup", type=int, default=DEFAULT_WARMUP)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--latency", type=float, default=0, help="Replay server latency in ms for scrape_once")
+    parser.add_argument("--json", action="store_true", help="Print one JSON object per benchmark")
+    args = parser.parse_args()
+
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmark: {', '.join(sorted(unknown))}")
+    runs = []
+    for name in names:
+        if name in ("record_speeds", "scrape_once"):
+            variants = args.storage.split(",")
+        elif name in ("lambda_compact", "decode_snapshot"):
+            variants = args.format.split(",")
+        else:
+            variants = ["rows"]
+        runs.extend((name, variant) for variant in variants)
+
+    if not args.json:
+        print(f"{'benchmark':<24} {'cycles':>6} {'rows/s':>12} {'ms p50':>8} {'ms p95':>8} {'peak RSS':>10} "
+              f"{'payload':>10}")
+    context = multiprocessing.get_context("spawn")  # Fresh process per benchmark for a meaningful peak RSS
+    for name, storage in runs:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            result = pool.submit(run_benchmark, name, storage, args.cycles, args.warmup, args.seed,
+                                 args.layout, args.latency).result()
+        if args.json:
+            print(json.dumps(result))
+        else:
+            payload = f"{result['payload_bytes'] / 1024:>7.1f} KB" if "payload_bytes" in result else ""
+            print(f"{result['benchmark']:<24} {result['cycles']:>6} {result['rows_per_s']:>12,.0f} "
+                  f"{result['ms_median']:>8.1f} {result['ms_p95']:>8.1f} {result['peak_rss_mb']:>8.1f} MB {payload}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Migration Check
+
+Builds a traffic.db with the original schema (speed_readings keyed by ISO
+timestamp text, no scrapes table) and the duplicates older scrapers and
+backfills left behind, then opens it with scraper.init_db and checks the
+result:
+- a backfill run twice (every reading of a scrape stored twice)
+- one second stored as both ...Z and ...+00:00
+Each scrape second must come out as one scrape with one reading per
+sensor (the first one written), and init_db must open the migrated
+database again.
+
+    python bench/migration.py
+    python bench/migration.py --sensors 6308 --scrapes 50
+"""
+
+import argparse
+import contextlib
+import io
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from scraper import init_db, format_epoch
+
+START_EPOCH = 1768226400
+
+# speed_readings and its indexes as created before scrape ids existed
+BASELINE_SCHEMA = """
+    CREATE TABLE speed_readings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT NOT NULL,
+        sensor_idx INTEGER NOT NULL,
+        speed_mph INTEGER,
+        has_incident INTEGER DEFAULT 0,
+        incident_ids TEXT
+    );
+
+    CREATE INDEX idx_readings_timestamp ON speed_readings(timestamp);
+    CREATE INDEX idx_readings_sensor ON speed_readings(sensor_idx);
+    CREATE INDEX idx_readings_ts_sensor ON speed_readings(timestamp, sensor_idx);
+"""
+
+
+def build_baseline(path: Path, sensors: int, scrapes: int) -> dict:
+    """Write a baseline database with duplicates; returns {epoch_s: expected speed sum}."""
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    expected = {}
+    for n in range(scrapes):
+        epoch_s = START_EPOCH + 300 * n
+        timestamp = format_epoch(epoch_s)
+        speeds = [(n + idx) % 70 for idx in range(sensors)]
+        copies = [(timestamp, speeds)]
+        if n % 3 == 1:
+            copies.append((timestamp, speeds))  # Backfill run twice
+        if n % 3 == 2:
+            copies.append((timestamp.replace("Z", "+00:00"), [s + 1 for s in speeds]))  # Later writer, other suffix
+        for stamp, values in copies:
+            conn.executemany("INSERT INTO speed_readings (timestamp, sensor_idx, speed_mph) VALUES (?, ?, ?)",
+                             [(stamp, idx, speed) for idx, speed in enumerate(values)])
+        expected[epoch_s] = sum(speeds)
+    conn.commit()
+    conn.close()
+    return expected
+
+
+def check(sensors: int, scrapes: int) -> list:
+    """Problems found migrating a baseline database (empty if none)."""
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = Path(work_dir) / "traffic.db"
+        expected = build_baseline(path, sensors, scrapes)
+        conn = sqlite3.connect(path)
+        with contextlib.redirect_stdout(io.StringIO()):
+            init_db(conn, shard_dir=Path(work_dir) / "shards")
+            init_db(conn, shard_dir=Path(work_dir) / "shards")  # A migrated database opens again
+        got = {epoch_s: (count, total) for epoch_s, count, total in conn.execute("""
+            SELECT s.epoch_s, COUNT(*), SUM(r.speed_mph)
+            FROM speed_readings r JOIN scrapes s ON s.id = r.scrape_id GROUP BY s.id
+        """)}
+        scrape_rows = conn.execute("SELECT COUNT(*) FROM scrapes").fetchone()[0]
+        conn.close()
+
+    problems = []
+    if scrape_rows != len(expected):
+        problems.append(f"{scrape_rows} scrapes, expected {len(expected)}")
+    for epoch_s, total in expected.items():
+        if got.get(epoch_s) != (sensors, total):
+            problems.append(f"{format_epoch(epoch_s)}: {got.get(epoch_s)} (readings, speed sum), "
+                            f"expected {(sensors, total)}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check init_db's migration of a baseline database")
+    parser.add_argument("--sensors", type=int, default=200, help="Sensors per scrape")
+    parser.add_argument("--scrapes", type=int, default=12, help="Scrape seconds in the baseline database")
+    args = parser.parse_args()
+
+    problems = check(args.sensors, args.scrapes)
+    for problem in problems:
+        print(problem)
+    print("Migration FAILED" if problems else f"Migrated {args.scrapes} scrapes x {args.sensors} sensors OK")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
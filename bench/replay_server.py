@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Local Replay Server
+
+Stands in for Sigalert, CHP CAD, Waze and CalTrans so the collectors can be
+load-tested without touching the real services. Requests arrive as
+/{original host}/{path}, which is how http_client rewrites every URL when
+TRAFFIC_UPSTREAM is set:
+
+    python bench/replay_server.py --port 8800 --latency 80 --jitter 40 --error-rate waze=0.2
+    TRAFFIC_UPSTREAM=http://127.0.0.1:8800 python scraper.py
+
+Payloads come from --recorded DIR when DIR/{host}/{path} exists (see
+bench/synthetic.py --out), otherwise from SyntheticFeed. The live feed
+changes every --period seconds (0: on every request) and answers
+conditional requests with 304 like the real one.
+
+Faults are set per source (sigalert, chp, waze, caltrans) or for all:
+--latency/--jitter in ms (jitter is exponential, for a long tail),
+--error-rate (HTTP 503) and --stall-rate (no answer for --stall seconds,
+longer than any collector timeout). Each flag takes VALUE or SOURCE=VALUE
+and can be repeated.
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+import urllib.parse
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+from synthetic import SyntheticFeed, CAMERA_COUNT, SENSOR_COUNT, SEED
+
+SOURCES = ("sigalert", "chp", "waze", "caltrans")
+DEFAULT_PORT = 8800
+FEED_PERIOD = 120  # Seconds between live feed refreshes, like the real feed
+STALL_SECONDS = 120
+
+
+def source_of(host: str, path: str) -> str:
+    """Upstream source a rewritten request belongs to, or None."""
+    if host.endswith("sigalert.com"):
+        return "sigalert"
+    if host == "cad.chp.ca.gov":
+        return "chp"
+    if host.endswith("waze.com"):
+        return "waze"
+    if host.endswith("dot.ca.gov"):
+        return "caltrans"
+    return None
+
+
+def parse_faults(values: list, cast=float) -> dict:
+    """["80", "waze=2000"] -> {"*": 80.0, "waze": 2000.0}"""
+    faults = {}
+    for value in values or ():
+        source, _, number = value.rpartition("=")
+        if source and source not in SOURCES:
+            raise ValueError(f"Unknown source {source!r} (expected one of {', '.join(SOURCES)})")
+        faults[source or "*"] = cast(number)
+    return faults
+
+
+class Upstream:
+    """Payloads, live feed versions and fault settings shared by the handler threads."""
+
+    def __init__(self, feed: SyntheticFeed, recorded: Path = None, period: float = FEED_PERIOD,
+                 latency: dict = None, jitter: dict = None, error_rate: dict = None,
+                 stall_rate: dict = None, stall: float = STALL_SECONDS):
+        self.feed = feed
+        self.recorded = recorded
+        self.period = period
+        self.faults = {"latency": latency or {}, "jitter": jitter or {},
+                       "error_rate": error_rate or {}, "stall_rate": stall_rate or {}}
+        self.stall = stall
+        self.lock = threading.Lock()
+        self.live = {}  # region -> (version, body, etag, last_modified)
+        self.static = {}
+        self.counts = {}
+        self.rng = random.Random()
+        self.start = time.time()
+        self.requests = 0
+
+    def fault(self, name: str, source: str) -> float:
+        settings = self.faults[name]
+        return settings.get(source, settings.get("*", 0))
+
+    def live_feed(self, region: str) -> tuple:
+        """(body, etag, last_modified) of the current live feed version."""
+        with self.lock:
+            self.requests += 1
+            if self.period:
+                version = int(time.time() // self.period)
+                epoch_s = version * self.period
+            else:
+                version = self.requests  # New content on every request, clock advancing by a refresh
+                epoch_s = int(self.start) + version * FEED_PERIOD
+            cached = self.live.get(region)
+            if cached and cached[0] == version:
+                return cached[1:]
+        body = json.dumps(self.feed.live(int(epoch_s)), separators=(",", ":")).encode("utf-8")
+        entry = (version, body, f'"{hashlib.md5(body).hexdigest()}"', formatdate(epoch_s, usegmt=True))
+        with self.lock:
+            self.live[region] = entry
+        return entry[1:]
+
+    def static_feed(self) -> bytes:
+        with self.lock:
+            if "body" not in self.static:
+                self.static["body"] = json.dumps(self.feed.static(), separators=(",", ":")).encode("utf-8")
+            return self.static["body"]
+
+    def count(self, source: str, outcome: str):
+        with self.lock:
+            key = (source, outcome)
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real upstreams
+    upstream = None
+
+    def do_GET(self):
+        self._serve()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self._serve(urllib.parse.parse_qs(self.rfile.read(length).decode("utf-8")))
+
+    def _serve(self, form: dict = None):
+        upstream = self.upstream
+        url = urllib.parse.urlsplit(self.path)
+        host, _, path = url.path.lstrip("/").partition("/")
+        source = source_of(host, path)
+        if source is None:
+            self._send(404, b"Unknown upstream host", "text/plain")
+            return
+
+        # Simulated network and upstream behavior
+        delay = upstream.fault("latency", source) / 1000
+        jitter = upstream.fault("jitter", source) / 1000
+        if jitter:
+            delay += upstream.rng.expovariate(1 / jitter)
+        time.sleep(delay)
+        if upstream.rng.random() < upstream.fault("stall_rate", source):
+            upstream.count(source, "stalled")
+            time.sleep(upstream.stall)
+            self.close_connection = True
+            return
+        if upstream.rng.random() < upstream.fault("error_rate", source):
+            upstream.count(source, "503")
+            self._send(503, b"Service Unavailable", "text/plain")
+            return
+
+        recorded = upstream.recorded / host / path if upstream.recorded else None
+        headers = {}
+        if recorded and recorded.is_file():
+            body = recorded.read_bytes()
+            content_type = "text/html" if path.endswith(".aspx") else "application/json"
+        elif source == "sigalert" and path.endswith("Static.json"):
+            body, content_type = upstream.static_feed(), "application/json"
+        elif source == "sigalert":
+            region = path.split("/")[1] if path.startswith("Data/") else "SoCal"
+            body, etag, last_modified = upstream.live_feed(region)
+            headers = {"ETag": etag, "Last-Modified": last_modified}
+            if self.headers.get("If-None-Match") == etag or (
+                    not self.headers.get("If-None-Match") and self.headers.get("If-Modified-Since") == last_modified):
+                upstream.count(source, "304")
+                self._send(304, b"", None, headers)
+                return
+            content_type = "application/json"
+        elif source == "chp":
+            center = (form or {}).get("ddlComCenter", ["LACC"])[0]
+            body, content_type = upstream.feed.chp_page(center, int(time.time())).encode("utf-8"), "text/html"
+        elif source == "waze":
+            query = {k: float(v[0]) for k, v in urllib.parse.parse_qs(url.query).items()
+                     if k in ("top", "bottom", "left", "right")}
+            if len(query) < 4:
+                self._send(400, b"Missing bounds", "text/plain")
+                return
+            body = json.dumps(upstream.feed.waze(query, int(time.time()))).encode("utf-8")
+            content_type = "application/json"
+        elif path.endswith(".m3u8"):
+            body, content_type = b"#EXTM3U\n#EXT-X-VERSION:3\n", "application/vnd.apple.mpegurl"
+        else:
+            body, content_type = json.dumps(upstream.feed.caltrans()).encode("utf-8"), "application/json"
+        upstream.count(source, "200")
+        self._send(200, body, content_type, headers)
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: dict = None):
+        self.send_response(status)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Thousands of requests per load test; see the summary on exit
+
+
+def start_server(upstream: Upstream, port: int = DEFAULT_PORT, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve upstream on host:port (0: any free port) from a daemon thread."""
+    handler = type("Handler", (_Handler,), {"upstream": upstream})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="replay-server", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay server standing in for the traffic upstreams")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--recorded", type=Path, help="Serve DIR/{host}/{path} where it exists")
+    parser.add_argument("--period", type=float, default=FEED_PERIOD,
+                        help=f"Seconds between live feed refreshes, 0 = every request (default: {FEED_PERIOD})")
+    parser.add_argument("--seed", type=int, default=SEED, help="Synthetic feed seed")
+    parser.add_argument("--sensors", type=int, default=SENSOR_COUNT)
+    parser.add_argument("--cameras", type=int, default=CAMERA_COUNT, help="Cameras in the live feed (payload size)")
+    parser.add_argument("--latency", action="append", help="Added latency in ms ([SOURCE=]MS)")
+    parser.add_argument("--jitter", action="append", help="Mean exponential extra latency in ms ([SOURCE=]MS)")
+    parser.add_argument("--error-rate", action="append", help="Share of requests answered 503 ([SOURCE=]RATE)")
+    parser.add_argument("--stall-rate", action="append", help="Share of requests never answered ([SOURCE=]RATE)")
+    parser.add_argument("--stall", type=float, default=STALL_SECONDS, help="Seconds a stalled request hangs")
+    args = parser.parse_args()
+
+    try:
+        faults = {name: parse_faults(getattr(args, name))
+                  for name in ("latency", "jitter", "error_rate", "stall_rate")}
+    except ValueError as e:
+        parser.error(str(e))
+    feed = SyntheticFeed(args.seed, args.sensors, cameras=args.cameras)
+    upstream = Upstream(feed, args.recorded, args.period, stall=args.stall, **faults)
+    server = start_server(upstream, args.port)
+
+    print(f"Replay server on http://127.0.0.1:{server.server_address[1]}")
+    print(f"Point collectors at it: TRAFFIC_UPSTREAM=http://127.0.0.1:{server.server_address[1]}")
+    for name, values in faults.items():
+        if values:
+            print(f"  {name}: {', '.join(f'{k}={v:g}' for k, v in values.items())}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print("\nRequests:")
+        for (source, outcome), n in sorted(upstream.counts.items()):
+            print(f"  {source:<9} {outcome:<8} {n:,}")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
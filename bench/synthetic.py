@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Synthetic Upstream Payloads
+
+Deterministic stand-ins for every upstream the collectors read, shaped like
+the real feeds (see DATA_FORMAT.md):
+- SoCalStatic.json: SENSOR_COUNT sensors in SECTION_COUNT road sections,
+  positions, speed limits
+- SoCalData.json at any epoch: speeds that follow weekday morning/evening
+  congestion (heavier in the peak direction, worst at per-section
+  bottlenecks, with stop-and-go waves moving upstream), sensor dropouts,
+  incidents that start at a time-of-day dependent rate with occasional
+  bursts, last 10-90 minutes and slow the sensors behind them, and the
+  cameras array
+- CHP CAD Traffic.aspx pages, Waze georss tiles and the CalTrans D7
+  cctvStatusD07.json camera list
+
+The same seed and epoch always give the same payload.
+
+    feed = SyntheticFeed()
+    static, live = feed.static(), feed.live(1768230000)
+
+    # Write one payload per source, laid out like bench/replay_server.py --recorded
+    python bench/synthetic.py --out /tmp/replay --epoch 1768230000
+"""
+
+import argparse
+import json
+import math
+import random
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from rollups import LOCAL_TZ
+
+SEED = 2026
+SENSOR_COUNT = 6308
+SECTION_COUNT = 116
+CAMERA_COUNT = 1800
+INCIDENT_RATE = 2.0      # Mean incidents starting per 2-minute slot at peak
+INCIDENT_SLOT = 120      # Incidents start on upstream refresh boundaries
+MAX_INCIDENT_SLOTS = 45  # Longest incident (90 minutes)
+BURST_CHANCE = 0.02      # Chance per slot of a pile-up / storm burst
+DROPOUT_RATE = 0.03      # Sensors that never report a speed
+WAVE_PERIOD = 900        # Seconds for a stop-and-go wave to pass a sensor
+WAVE_SENSORS = 40        # Wavelength of stop-and-go waves, in sensors
+
+ROUTES = ["1", "2", "5", "10", "14", "15", "22", "55", "57", "60", "71", "73", "91", "101",
+          "105", "110", "118", "133", "134", "170", "210", "241", "405", "605", "710"]
+STREETS = ["Main", "Broadway", "Olympic", "Pico", "Venice", "Washington", "Jefferson", "Slauson",
+           "Florence", "Manchester", "Century", "Imperial", "Rosecrans", "Artesia", "Del Amo",
+           "Carson", "Sepulveda", "La Cienega", "La Brea", "Western", "Vermont", "Figueroa",
+           "Alameda", "Atlantic", "Lakewood", "Bellflower", "Harbor", "Beach", "Brookhurst", "Magnolia"]
+SUFFIXES = ["St", "Blvd", "Ave", "Rd", "Dr", "Pkwy"]
+DESCRIPTIONS = ["2 vehicle crash", "Vehicle fire", "Debris in lane", "Disabled vehicle",
+                "Multi-vehicle crash", "Lane closure", "Police activity", "Spinout"]
+CHP_TYPES = ["1182-Trfc Collision-No Inj", "1183-Trfc Collision-Unkn Inj", "1125-Traffic Hazard",
+             "1179-Trfc Collision-1141 Enrt", "FIRE-Car Fire", "SIG ALERT"]
+WAZE_TYPES = [("ACCIDENT", "ACCIDENT_MINOR"), ("HAZARD", "HAZARD_ON_ROAD_OBJECT"),
+              ("HAZARD", "HAZARD_ON_SHOULDER_CAR_STOPPED"), ("POLICE", "POLICE_VISIBLE"),
+              ("JAM", "JAM_HEAVY_TRAFFIC"), ("ROAD_CLOSED", "ROAD_CLOSED_CONSTRUCTION")]
+# Map coordinates of the sensor grid, mapped onto lat/lon for Waze and CalTrans
+GRID = (0, 0, 20000, 12000)
+LATLON = (33.60, 34.40, -118.70, -117.60)  # bottom, top, left, right
+
+
+def _weights(rng: random.Random, n: int, total: int, low: float = 0.3) -> list:
+    """Split total into n positive integer parts with random sizes."""
+    raw = [low + rng.random() for _ in range(n)]
+    scale = (total - n) / sum(raw)
+    parts = [1 + int(w * scale) for w in raw]
+    for i in range(total - sum(parts)):
+        parts[i % n] += 1
+    return parts
+
+
+def _local_time(epoch_s: int) -> str:
+    local = datetime.fromtimestamp(epoch_s, LOCAL_TZ)
+    return f"{local.hour % 12 or 12}:{local.minute:02d} {'AM' if local.hour < 12 else 'PM'}"
+
+
+def _iso(epoch_s: int) -> str:
+    return datetime.fromtimestamp(epoch_s, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def diurnal(epoch_s: float) -> tuple:
+    """(morning, evening) congestion levels in [0, 1] at epoch_s, Pacific time."""
+    local = datetime.fromtimestamp(epoch_s, LOCAL_TZ)
+    hour = local.hour + local.minute / 60
+    if local.weekday() >= 5:
+        return 0.0, 0.4 * math.exp(-((hour - 14) / 3) ** 2)  # Weekend midday traffic
+    return math.exp(-((hour - 7.75) / 1.2) ** 2), math.exp(-((hour - 17.25) / 1.6) ** 2)
+
+
+class SyntheticFeed:
+    """Deterministic generator for static, live and side-source payloads."""
+
+    def __init__(self, seed: int = SEED, sensors: int = SENSOR_COUNT, sections: int = SECTION_COUNT,
+                 cameras: int = CAMERA_COUNT, incident_rate: float = INCIDENT_RATE):
+        self.seed = seed
+        self.incident_rate = incident_rate
+        rng = random.Random(seed)
+
+        # Road sections come in direction pairs of a route, each a run of sensors
+        self.sections = []
+        start = 0
+        for i, count in enumerate(_weights(rng, sections, sensors)):
+            route = ROUTES[(i // 2) % len(ROUTES)]
+            axis = ("North", "South") if int(route) % 2 else ("East", "West")
+            self.sections.append([100011 + 10 * i, axis[i % 2], route, start, start + count - 1])
+            start += count
+
+        self.names = []
+        self.positions = []
+        self.free_flow = []
+        self.hotspot = []
+        self.peak = []  # (morning, evening) weight of the sensor's direction
+        self.section_of = []
+        for s, (section_id, direction, route, first, last) in enumerate(self.sections):
+            x, y = rng.uniform(GRID[0], GRID[2]), rng.uniform(GRID[1], GRID[3])
+            heading = rng.uniform(0, 2 * math.pi)
+            bottlenecks = [rng.uniform(first, last) for _ in range(rng.randint(1, 4))]
+            inbound = s % 2 == 0
+            for idx in range(first, last + 1):
+                if idx == first:
+                    self.names.append(f"{'I' if int(route) < 200 else 'CA'}-{route} {direction}")
+                else:
+                    name = f"{rng.choice(STREETS)} {rng.choice(SUFFIXES)}"
+                    if rng.random() < 0.3:
+                        name += f" ({rng.randint(1, 19) / 10} miles before)"
+                    self.names.append(name)
+                heading += rng.gauss(0, 0.15)
+                nx, ny = x + 60 * math.cos(heading), y + 60 * math.sin(heading)
+                self.positions.append([int(x), int(y), int(nx), int(ny)])
+                x, y = min(max(nx, GRID[0]), GRID[2]), min(max(ny, GRID[1]), GRID[3])
+                self.free_flow.append(rng.uniform(58, 72))
+                self.hotspot.append(min(1.0, 0.15 + max(
+                    math.exp(-((idx - b) / rng.uniform(8, 30)) ** 2) for b in bottlenecks)))
+                self.peak.append((1.0, 0.6) if inbound else (0.5, 1.0))
+                self.section_of.append(s)
+        self.dropout = {idx for idx in range(sensors) if rng.random() < DROPOUT_RATE}
+        self.camera_of = {}
+        for cam in range(cameras):
+            self.camera_of[rng.randrange(sensors)] = 9000 + cam
+        self.cameras = sorted(self.camera_of.values())
+
+    def static(self) -> dict:
+        """SoCalStatic.json payload."""
+        roads = {}
+        for section_id, direction, route, first, last in self.sections[:102]:
+            limits, idx = [], first
+            while idx <= last:
+                end = min(idx + 3 + (idx * 7) % 11, last)
+                limits.append([idx - first, end - first, 65 if (idx // 13) % 4 else 55])
+                idx = end + 1
+            roads[str(section_id)] = [route, 0, 0, limits]
+        return {
+            "sensorNames": self.names,
+            "sensorPositions": self.positions,
+            "roadSections": self.sections,
+            "roads": roads,
+        }
+
+    def incidents(self, epoch_s: int) -> list:
+        """Incidents active at epoch_s as (row, first_sensor, affected_sensors) tuples."""
+        active = []
+        now_slot = epoch_s // INCIDENT_SLOT
+        for slot in range(now_slot - MAX_INCIDENT_SLOTS, now_slot + 1):
+            rng = random.Random(f"{self.seed}:incidents:{slot}")
+            start = slot * INCIDENT_SLOT
+            morning, evening = diurnal(start)
+            chance = self.incident_rate * (0.3 + 0.7 * max(morning, evening)) / 8
+            count = sum(1 for _ in range(8) if rng.random() < chance)
+            burst = rng.random() < BURST_CHANCE
+            if burst:
+                count += rng.randint(3, 8)
+            burst_sensor = rng.randrange(len(self.names))
+            for j in range(count):
+                duration = min(int(rng.expovariate(1 / 15)) + 5, MAX_INCIDENT_SLOTS)
+                sensor = (burst_sensor + rng.randint(-20, 20)) % len(self.names) if burst else rng.randrange(len(self.names))
+                description = rng.choice(DESCRIPTIONS)
+                severity = rng.choice((10, 30, 50, 70))
+                length = rng.randint(2, 12)
+                if slot + duration <= now_slot:
+                    continue  # Cleared
+                section_id, direction, route = self.sections[self.section_of[sensor]][:3]
+                x, y = self.positions[sensor][:2]
+                incident_id = 47600000 + slot * 16 + j
+                updated = start + INCIDENT_SLOT * ((now_slot - slot) // 5 * 5)
+                row = [section_id, incident_id, _local_time(start), f"{route} {direction} at {self.names[sensor]}",
+                       f"{description}.", severity, x, y, _iso(start), _iso(updated)]
+                active.append((row, sensor, length))
+        return active
+
+    def live(self, epoch_s: int) -> dict:
+        """SoCalData.json payload at epoch_s."""
+        rng = random.Random(f"{self.seed}:live:{epoch_s}")
+        morning, evening = diurnal(epoch_s)
+        refs = {}
+        slow = {}
+        incident_rows = []
+        for row, sensor, length in self.incidents(epoch_s):
+            incident_rows.append(row)
+            first = self.sections[self.section_of[sensor]][3]
+            for idx in range(max(sensor - length, first), sensor + 1):  # Backs up behind the incident
+                refs.setdefault(idx, []).append([1, row[1]])
+                slow[idx] = max(slow.get(idx, 0), 0.3 + 0.5 * (idx - sensor + length) / length)
+
+        speeds = []
+        wave_t = epoch_s / WAVE_PERIOD
+        for idx, free_flow in enumerate(self.free_flow):
+            am, pm = self.peak[idx]
+            level = max(morning * am, evening * pm) * self.hotspot[idx]
+            wave = 0.5 + 0.5 * math.sin(2 * math.pi * (idx / WAVE_SENSORS + wave_t) + self.section_of[idx])
+            congestion = min(level * (0.55 + 0.45 * wave) + slow.get(idx, 0), 0.95)
+            if idx in self.dropout or rng.random() < 0.005:
+                speed = None
+            else:
+                speed = max(3, min(85, round(free_flow * (1 - congestion) + rng.gauss(0, 1.5))))
+            entry = [speed, None, refs.get(idx, [])]
+            if idx in self.camera_of:
+                entry.append(self.camera_of[idx])
+            speeds.append(entry)
+
+        cameras = []
+        for cam in self.cameras:
+            x, y = self.positions[(cam * 37) % len(self.positions)][:2]
+            cameras.append([cam, x, y, 0, f"Camera {cam}", f"{self.names[(cam * 37) % len(self.names)]}",
+                            f"https://cdn-cameras.sigalert.com/Cameras/{cam}.jpg?t={epoch_s}",
+                            "Caltrans", 60000, 1])
+        return {"speeds": speeds, "incidents": incident_rows, "cameras": cameras}
+
+    def _latlon(self, x: float, y: float) -> tuple:
+        bottom, top, left, right = LATLON
+        return (bottom + (top - bottom) * y / GRID[3], left + (right - left) * x / GRID[2])
+
+    def chp_page(self, center: str, epoch_s: int) -> str:
+        """CHP CAD Traffic.aspx HTML with the incident table for a center."""
+        rng = random.Random(f"{self.seed}:chp:{center}:{epoch_s // INCIDENT_SLOT}")
+        rows = ["<tr><th></th><th>Time</th><th>Type</th><th>Location</th><th>Location Desc.</th><th>Area</th></tr>"]
+        for row, sensor, _ in self.incidents(epoch_s):
+            if rng.random() < 0.5:
+                continue
+            rows.append(f"<tr><td><a>Details</a> {row[1] % 100000}</td><td>{row[2]}</td>"
+                        f"<td>{rng.choice(CHP_TYPES)}</td><td>{row[3]}</td><td>{self.names[sensor]}</td>"
+                        f"<td>{center[:2]}</td></tr>")
+        return ('<html><body><form>'
+                f'<input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="vs{epoch_s}" />'
+                '<input type="hidden" name="__VIEWSTATEGENERATOR" id="__VIEWSTATEGENERATOR" value="A1B2C3D4" />'
+                f'<table id="gvIncidents">{"".join(rows)}</table></form></body></html>')
+
+    def waze(self, bounds: dict, epoch_s: int) -> dict:
+        """Waze georss response for a bounding box (alerts only)."""
+        rng = random.Random(f"{self.seed}:waze:{epoch_s // INCIDENT_SLOT}")
+        morning, evening = diurnal(epoch_s)
+        alerts = []
+        for n in range(int(600 * (0.4 + max(morning, evening)))):
+            lat, lon = self._latlon(rng.uniform(GRID[0], GRID[2]), rng.uniform(GRID[1], GRID[3]))
+            kind, subtype = rng.choice(WAZE_TYPES)
+            reliability = rng.randint(5, 10)
+            if not (bounds["bottom"] <= lat <= bounds["top"] and bounds["left"] <= lon <= bounds["right"]):
+                continue
+            alerts.append({
+                "uuid": f"{self.seed:x}-{epoch_s // 3600:x}-{n:04x}",
+                "type": kind, "subtype": subtype,
+                "location": {"x": lon, "y": lat},
+                "street": f"{rng.choice(STREETS)} {rng.choice(SUFFIXES)}", "city": "Los Angeles",
+                "reliability": reliability, "nThumbsUp": rng.randint(0, 5),
+                "pubMillis": (epoch_s - rng.randint(0, 3600)) * 1000, "roadType": rng.choice((1, 2, 3, 6)),
+            })
+        return {"alerts": alerts[:200], "jams": []}
+
+    def caltrans(self) -> dict:
+        """CalTrans D7 cctvStatusD07.json camera list."""
+        data = []
+        for cam in self.cameras:
+            idx = (cam * 37) % len(self.positions)
+            lat, lon = self._latlon(*self.positions[idx][:2])
+            route = self.sections[self.section_of[idx]][2]
+            data.append({"cctv": {
+                "index": str(cam),
+                "location": {"route": f"{'I' if int(route) < 200 else 'SR'}-{route}",
+                             "latitude": f"{lat:.6f}", "longitude": f"{lon:.6f}",
+                             "locationName": self.names[idx]},
+                "imageData": {"streamingVideoURL": f"https://wzmedia.dot.ca.gov/D7/CCTV{cam}.stream/playlist.m3u8"},
+            }})
+        return {"data": data}
+
+
+def write_payloads(feed: SyntheticFeed, out_dir: Path, epoch_s: int, region: str = "SoCal"):
+    """Write one payload per source under out_dir/<host>/<path>."""
+    files = {
+        f"cdn-static.sigalert.com/240/Zip/RegionInfo/{region}Static.json": json.dumps(feed.static()),
+        f"www.sigalert.com/Data/{region}/4~j/{region}Data.json": json.dumps(feed.live(epoch_s)),
+        "cad.chp.ca.gov/Traffic.aspx": feed.chp_page("LACC", epoch_s),
+        "www.waze.com/live-map/api/georss": json.dumps(feed.waze(
+            {"top": LATLON[1], "bottom": LATLON[0], "left": LATLON[2], "right": LATLON[3]}, epoch_s)),
+        "cwwp2.dot.ca.gov/data/d7/cctv/cctvStatusD07.json": json.dumps(feed.caltrans()),
+    }
+    for name, body in files.items():
+        path = Path(out_dir) / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(body)
+        print(f"{path}: {path.stat().st_size:,} bytes")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic upstream payloads")
+    parser.add_argument("--out", type=Path, required=True, help="Output directory")
+    parser.add_argument("--epoch", type=int, default=int(datetime.now(timezone.utc).timestamp()),
+                        help="Epoch seconds of the live payloads (default: now)")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--sensors", type=int, default=SENSOR_COUNT)
+    parser.add_argument("--cameras", type=int, default=CAMERA_COUNT)
+    args = parser.parse_args()
+
+    feed = SyntheticFeed(args.seed, args.sensors, cameras=args.cameras)
+    write_payloads(feed, args.out, args.epoch)
+
+
+if __name__ == "__main__":
+    main()
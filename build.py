@@ -1,15 +1,13 @@
 #!/usr/bin/env python3
 """Build commute camera dashboard with only working cameras."""
 
-import urllib.request
-import ssl
-import json
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
-ssl_ctx = ssl.create_default_context()
+import http_client
 
 ROUTES = ['405', '710', '110', '10', '105']
+STREAM_CHECKS = 20  # Streams tested at once (all on one CalTrans host)
 BOUNDS = {
     'minLat': 33.70,
     'maxLat': 34.05,
@@ -18,18 +16,13 @@ BOUNDS = {
 }
 
 def fetch_json(url):
-    headers = {'User-Agent': 'Mozilla/5.0'}
-    req = urllib.request.Request(url, headers=headers)
-    with urllib.request.urlopen(req, timeout=30, context=ssl_ctx) as response:
-        return json.loads(response.read().decode('utf-8'))
+    return http_client.get_json(url, {'User-Agent': 'Mozilla/5.0'}, timeout=30)
 
 def test_stream(url):
     """Test if HLS stream is working."""
     try:
-        req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
-        with urllib.request.urlopen(req, timeout=8, context=ssl_ctx) as response:
-            content = response.read().decode('utf-8', errors='ignore')
-            return '#EXTM3U' in content
+        content = http_client.get_text(url, {'User-Agent': 'Mozilla/5.0'}, timeout=8)
+        return '#EXTM3U' in content
     except:
         return False
 
@@ -74,7 +67,8 @@ def test_cameras(cameras):
     print(f"Testing {len(cameras)} cameras...")
 
     working = []
-    with ThreadPoolExecutor(max_workers=20) as executor:
+    http_client.set_pool_maxsize(STREAM_CHECKS)
+    with ThreadPoolExecutor(max_workers=STREAM_CHECKS) as executor:
         futures = {executor.submit(test_stream, c['stream']): c for c in cameras}
         for future in as_completed(futures):
             cam = futures[future]
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Compact finished days of R2 snapshots into one archive per day.
+
+Usage:
+    python cloud/compact_days.py                     # Finished days of the last 7 days
+    python cloud/compact_days.py --days 60
+    python cloud/compact_days.py --date 2026-01-15 --force
+    python cloud/compact_days.py --delete-sources    # Also delete compacted snapshots
+
+A day is finished COMPACT_AFTER seconds after its UTC midnight. Each day's
+data/YYYY-MM-DD/ snapshots are downloaded, encoded into days/YYYY-MM-DD.bin
+(see day_archive.py) and decoded again; a day is only uploaded if the
+archive round-trips to the same snapshots. The manifest is updated after
+the new archive is in place, and replaced archives and source files are
+only deleted after the manifest, so a reader always finds every snapshot
+in one or the other.
+
+Snapshots that arrive after their day was compacted are merged into the
+archive on the next run. Run one compaction at a time (the workflow uses a
+concurrency group): the manifest is rewritten, not merged.
+
+Environment variables:
+    R2_ACCOUNT_ID, R2_ACCESS_KEY_ID, R2_SECRET_ACCESS_KEY, R2_BUCKET_NAME
+"""
+
+import argparse
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from day_archive import (
+    day_key, encode_day, fetch_day, iter_day, load_manifest, read_header, save_manifest
+)
+from download_data import get_s3_client, list_objects, fetch_snapshot, DOWNLOAD_WORKERS, SNAPSHOT_KEY_RE
+
+COMPACT_AFTER = 3600  # Seconds after UTC midnight before a day counts as finished
+DELETE_BATCH = 1000   # Keys per DeleteObjects request (the S3 maximum)
+
+
+def finished_dates(days: int, now: float = None) -> list:
+    """The last days UTC dates that are finished, oldest first."""
+    now = time.time() if now is None else now
+    last = datetime.fromtimestamp(now - COMPACT_AFTER, timezone.utc).date() - timedelta(days=1)
+    return [(last - timedelta(days=i)).strftime("%Y-%m-%d") for i in reversed(range(days))]
+
+
+def compact_day(s3, bucket: str, date_str: str, manifest: dict, workers: int = DOWNLOAD_WORKERS,
+                force: bool = False) -> dict:
+    """
+    Compact one date if it has snapshots that aren't in its archive yet (or
+    always, with force). Updates manifest in place and returns its new
+    entry, or None if nothing changed.
+    """
+    sources = sorted(key for key in list_objects(s3, bucket, f"data/{date_str}/") if SNAPSHOT_KEY_RE.match(key))
+    entry = manifest["days"].get(date_str)
+    snapshots = {}
+    if entry:
+        snapshots = dict(iter_day(fetch_day(s3, bucket, entry["key"], entry["sha256"])))
+    new = [key for key in sources if key not in snapshots]
+    if not new and not (force and snapshots):
+        return None
+
+    source_bytes = (entry or {}).get("source_bytes", 0)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for key, (data, size) in zip(new, pool.map(lambda key: fetch_snapshot(s3, bucket, key), new)):
+            snapshots[key] = data
+            source_bytes += size
+    ordered = sorted(snapshots.items())
+    blob = encode_day(date_str, ordered)
+    if list(iter_day(blob)) != ordered:
+        raise ValueError(f"{date_str}: archive doesn't round-trip, not uploaded")
+
+    sha256 = hashlib.sha256(blob).hexdigest()
+    key = day_key(date_str, sha256)
+    s3.put_object(Bucket=bucket, Key=key, Body=blob, ContentType="application/octet-stream")
+    entry = {
+        "key": key,
+        "size": len(blob),
+        "sha256": sha256,
+        "snapshots": len(ordered),
+        "source_bytes": source_bytes,
+        "compacted_at": int(time.time()),
+    }
+    manifest["days"][date_str] = entry
+    return entry
+
+
+def delete_sources(s3, bucket: str, date_str: str, entry: dict) -> int:
+    """Delete a compacted date's snapshot files that are in its archive; returns the number deleted."""
+    header = read_header(s3, bucket, entry["key"])
+    archived = {key for key, _, _ in header["snapshots"]}
+    keys = [key for key in list_objects(s3, bucket, f"data/{date_str}/") if key in archived]
+    for i in range(0, len(keys), DELETE_BATCH):
+        s3.delete_objects(Bucket=bucket, Delete={
+            "Objects": [{"Key": key} for key in keys[i:i + DELETE_BATCH]], "Quiet": True})
+    return len(keys)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact finished days of R2 snapshots into daily archives")
+    parser.add_argument("--days", type=int, default=7, help="Compact the last N finished days")
+    parser.add_argument("--date", type=str, help="Compact a specific date (YYYY-MM-DD)")
+    parser.add_argument("--force", action="store_true", help="Rebuild archives that are up to date")
+    parser.add_argument("--delete-sources", action="store_true",
+                        help="Delete snapshot files once their archive is in the manifest")
+    parser.add_argument("--workers", type=int, default=DOWNLOAD_WORKERS,
+                        help=f"Concurrent downloads (default: {DOWNLOAD_WORKERS})")
+    args = parser.parse_args()
+
+    if args.date and args.date > finished_dates(1)[0]:
+        parser.error(f"{args.date} is not finished yet")
+    dates = [args.date] if args.date else finished_dates(args.days)
+
+    s3 = get_s3_client(args.workers)
+    bucket = os.environ.get("R2_BUCKET_NAME", "traffic-data")
+    manifest = load_manifest(s3, bucket)
+
+    compacted = []
+    for date_str in dates:
+        start = time.monotonic()
+        previous = manifest["days"].get(date_str)
+        try:
+            entry = compact_day(s3, bucket, date_str, manifest, args.workers, args.force)
+        except Exception as e:
+            print(f"{date_str}: {type(e).__name__}: {e}")
+            continue
+        if entry is None:
+            print(f"{date_str}: up to date" if date_str in manifest["days"] else f"{date_str}: no snapshots")
+            continue
+        compacted.append(date_str)
+        # Save after every day, so a failure later in the run keeps the days already uploaded
+        save_manifest(s3, bucket, manifest)
+        if previous and previous["key"] != entry["key"]:
+            s3.delete_object(Bucket=bucket, Key=previous["key"])
+        print(f"{date_str}: {entry['snapshots']:,} snapshots ({entry['source_bytes'] / 1e6:.1f} MB) -> "
+              f"{entry['key']} ({entry['size'] / 1e6:.2f} MB) in {time.monotonic() - start:.1f}s")
+
+    if args.delete_sources:
+        for date_str in dates:
+            if date_str in manifest["days"]:
+                deleted = delete_sources(s3, bucket, date_str, manifest["days"][date_str])
+                if deleted:
+                    print(f"{date_str}: deleted {deleted:,} compacted snapshot files")
+    print(f"Compacted {len(compacted)} of {len(dates)} days")
+
+
+if __name__ == "__main__":
+    main()
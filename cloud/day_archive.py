@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Daily Snapshot Archives
+
+compact_days.py rolls each finished UTC day of R2 snapshots into a single
+object, which download_data.py prefers over the day's small files:
+
+    days/2026-01-15-3f2a9c0d1e7b.bin   # every snapshot of data/2026-01-15/
+    days/manifest.json                 # {"version": 1, "days": {"2026-01-15": {"key", "sha256", ...}}}
+
+Archive keys carry a prefix of their SHA-256, so rebuilding a day never
+overwrites the archive the manifest points to.
+
+An archive is MAGIC, a 4-byte big-endian header length, a JSON header and
+xz-compressed blocks. The header is the index: the source key, "t" and
+sensor count of every snapshot (null when it has no "s"), and the offset
+(after the header), length and SHA-256 of each block:
+- speeds: uint8 matrix, sensor-major (each sensor's speed in every
+  scrape), NULL_SPEED = no data
+- incidents: JSON, per snapshot with "s", [[sensor_idx, incident list], ...]
+- extras: JSON, per snapshot, every member but "s" ("t", "i", "chp", ...)
+
+A sensor's speed rarely changes between scrapes, so the sensor-major
+matrix compresses far better than the snapshots one by one. Readers can
+fetch the header alone with a range request (read_header).
+
+Standard library only.
+"""
+
+import hashlib
+import json
+import lzma
+import struct
+
+from snapshot_codec import NULL_SPEED, speed_values
+
+DAY_PREFIX = "days/"
+MANIFEST_KEY = "days/manifest.json"
+MAGIC = b"TRDAY\x01"
+VERSION = 1
+HEADER_PROBE = 65536  # Bytes requested for the header (a day's index is ~40 KB)
+
+_LENGTH = struct.Struct(">I")
+
+
+def day_key(date_str: str, sha256: str) -> str:
+    """Archive key of a UTC date (YYYY-MM-DD) with the archive's SHA-256."""
+    return f"{DAY_PREFIX}{date_str}-{sha256[:12]}.bin"
+
+
+def encode_day(date_str: str, snapshots: list) -> bytes:
+    """
+    Archive of snapshots, a list of (key, decoded snapshot) in key order.
+    Raises ValueError for a speed that doesn't fit the matrix (not an
+    integer in 0..254 or None).
+    """
+    rows = [data["s"] for _, data in snapshots if "s" in data]
+    sensors = max((len(s) for s in rows), default=0)
+    matrix = bytearray([NULL_SPEED]) * (sensors * len(rows))
+    incidents = []
+    for r, speeds in enumerate(rows):
+        row = bytearray([NULL_SPEED]) * sensors
+        refs = []
+        for idx, entry in enumerate(speeds):
+            speed = entry[0]
+            if speed is not None:
+                if type(speed) is not int or not 0 <= speed < NULL_SPEED:
+                    raise ValueError(f"Speed {speed!r} of sensor {idx} doesn't fit in a byte")
+                row[idx] = speed
+            if len(entry) > 1 and entry[1]:
+                refs.append([idx, entry[1]])
+        matrix[r::len(rows)] = row
+        incidents.append(refs)
+    extras = [{k: v for k, v in data.items() if k != "s"} for _, data in snapshots]
+
+    blocks, body = {}, bytearray()
+    for name, raw in (("speeds", bytes(matrix)),
+                      ("incidents", json.dumps(incidents, separators=(",", ":")).encode("utf-8")),
+                      ("extras", json.dumps(extras, separators=(",", ":")).encode("utf-8"))):
+        packed = lzma.compress(raw)
+        blocks[name] = [len(body), len(packed), hashlib.sha256(packed).hexdigest()]
+        body += packed
+
+    header = json.dumps({
+        "version": VERSION,
+        "date": date_str,
+        "sensors": sensors,
+        "snapshots": [[key, data.get("t"), len(data["s"]) if "s" in data else None] for key, data in snapshots],
+        "blocks": blocks,
+    }, separators=(",", ":")).encode("utf-8")
+    return MAGIC + _LENGTH.pack(len(header)) + header + bytes(body)
+
+
+def header_length(prefix: bytes) -> int:
+    """Bytes taken by MAGIC, the length and the header, from the first 10 bytes of an archive."""
+    if prefix[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a day archive (bad magic)")
+    return len(MAGIC) + _LENGTH.size + _LENGTH.unpack_from(prefix, len(MAGIC))[0]
+
+
+def decode_header(blob: bytes) -> dict:
+    """Header of an archive (blob may be just its first header_length bytes)."""
+    end = header_length(blob)
+    if len(blob) < end:
+        raise ValueError("Day archive truncated inside its header")
+    header = json.loads(blob[len(MAGIC) + _LENGTH.size:end].decode("utf-8"))
+    if header.get("version") != VERSION:
+        raise ValueError(f"Unsupported day archive version {header.get('version')}")
+    return header
+
+
+def iter_day(blob: bytes, wanted: set = None, columns: bool = False):
+    """
+    Iterator of (key, snapshot) from an archive in key order, only keys in
+    wanted if given, with "speeds" and "refs" in place of "s" if columns
+    (see snapshot_codec.decode_snapshot). Blocks are checked and
+    decompressed by this call; speeds are rebuilt one snapshot at a time as
+    the iterator is consumed, so a day's speeds are never all decoded at
+    once. Raises ValueError if a block fails its checksum.
+    """
+    header = decode_header(blob)
+    start = header_length(blob)
+    blocks = {}
+    for name, (offset, length, sha256) in header["blocks"].items():
+        packed = blob[start + offset:start + offset + length]
+        if hashlib.sha256(packed).hexdigest() != sha256:
+            raise ValueError(f"Day archive {header['date']}: {name} block fails its checksum")
+        blocks[name] = lzma.decompress(packed)
+    extras = json.loads(blocks["extras"].decode("utf-8"))
+    incidents = json.loads(blocks["incidents"].decode("utf-8"))
+    return _rebuild(header["snapshots"], blocks["speeds"], incidents, extras, wanted, columns)
+
+
+def _rebuild(snapshots: list, matrix: bytes, incidents: list, extras: list, wanted: set, columns: bool):
+    row_count = len(incidents)
+    r = 0
+    for (key, _, count), extra in zip(snapshots, extras):
+        if count is None:
+            if wanted is None or key in wanted:
+                yield key, extra
+            continue
+        if wanted is None or key in wanted:
+            refs = dict(incidents[r])
+            speeds = speed_values(matrix[r::row_count][:count])
+            if columns:
+                extra["speeds"], extra["refs"] = speeds, refs
+            else:
+                extra["s"] = [[speed, refs.get(idx) or []] for idx, speed in enumerate(speeds)]
+            yield key, extra
+        r += 1
+
+
+def read_header(s3, bucket: str, key: str) -> dict:
+    """Fetch just the header of an archive in R2 (one range request, two for a very large day)."""
+    blob = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes=0-{HEADER_PROBE - 1}")["Body"].read()
+    end = header_length(blob)
+    if len(blob) < end:
+        blob += s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={len(blob)}-{end - 1}")["Body"].read()
+    return decode_header(blob)
+
+
+def fetch_day(s3, bucket: str, key: str, sha256: str = None) -> bytes:
+    """Download an archive, checked against the manifest's SHA-256 if given."""
+    blob = s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+    if sha256 and hashlib.sha256(blob).hexdigest() != sha256:
+        raise ValueError(f"{key} doesn't match the manifest's SHA-256")
+    return blob
+
+
+def load_manifest(s3, bucket: str) -> dict:
+    """The bucket's archive manifest (empty if nothing has been compacted)."""
+    try:
+        body = s3.get_object(Bucket=bucket, Key=MANIFEST_KEY)["Body"].read()
+    except s3.exceptions.NoSuchKey:
+        return {"version": VERSION, "days": {}}
+    return json.loads(body.decode("utf-8"))
+
+
+def save_manifest(s3, bucket: str, manifest: dict):
+    """Replace the manifest (one PUT, so readers see the old or the new one)."""
+    s3.put_object(Bucket=bucket, Key=MANIFEST_KEY, ContentType="application/json",
+                  Body=json.dumps(manifest, indent=1, sort_keys=True).encode("utf-8"))
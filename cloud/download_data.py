@@ -6,26 +6,55 @@ Usage:
     python cloud/download_data.py                    # Download last 7 days
     python cloud/download_data.py --days 30          # Download last 30 days
     python cloud/download_data.py --date 2026-01-15  # Download specific date
+    python cloud/download_data.py --shards month     # Import into monthly shard files
+    python cloud/download_data.py --days 30 --workers 32
+
+Files are downloaded by a pool of workers and imported in order by one
+writer, IMPORT_BATCH snapshots per commit. Imported keys are recorded in
+the imported_keys table, so an interrupted backfill resumes where it
+stopped and reruns only fetch new files.
+
+Days compacted by compact_days.py are downloaded as one archive (see
+day_archive.py) instead of hundreds of snapshot files; snapshot files not
+in a day's archive yet are downloaded one by one as before.
 
 Environment variables:
     R2_ACCOUNT_ID, R2_ACCESS_KEY_ID, R2_SECRET_ACCESS_KEY, R2_BUCKET_NAME
 """
 
 import os
+import re
 import sys
 import json
+import time
 import sqlite3
 import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
-from scraper import init_db, load_static_data, populate_sensors, DB_PATH
+from scraper import (
+    init_db, load_static_data, populate_sensors, record_heartbeat, register_scrape,
+    open_shard_writer, to_epoch, format_epoch, DB_PATH, READINGS_LAYOUTS
+)
+from shards import ShardWriter, GRANULARITIES, iter_routers, shard_key
+from rollups import RollupBuffer, update_rollups
+from day_archive import fetch_day, iter_day, load_manifest, read_header
+from snapshot_codec import decode_snapshot
+
+DOWNLOAD_WORKERS = 16  # Concurrent GETs (and connections in the client's pool)
+DOWNLOAD_WINDOW = 4    # Downloads in flight or awaiting import, per worker (a day archive counts as 4)
+IMPORT_BATCH = 100     # Snapshots per commit
+
+SNAPSHOT_KEY_RE = re.compile(r"^data/(\d{4}-\d{2}-\d{2})/(\d{2})/(\d{2})(\d{2})\.(json|snap)(\.gz|\.zst)?$")
 
 
-def get_s3_client():
-    """Get boto3 S3 client for R2."""
+def get_s3_client(max_connections: int = DOWNLOAD_WORKERS):
+    """Get boto3 S3 client for R2 (thread-safe, pooling max_connections)."""
     import boto3
+    from botocore.config import Config
 
     return boto3.client(
         "s3",
@@ -33,6 +62,7 @@ def get_s3_client():
         aws_access_key_id=os.environ["R2_ACCESS_KEY_ID"],
         aws_secret_access_key=os.environ["R2_SECRET_ACCESS_KEY"],
         region_name="auto",
+        config=Config(max_pool_connections=max_connections, retries={"max_attempts": 5, "mode": "standard"}),
     )
 
 
@@ -48,65 +78,234 @@ def list_objects(s3, bucket: str, prefix: str) -> list:
     return objects
 
 
-def download_and_import(s3, bucket: str, key: str, conn: sqlite3.Connection) -> int:
-    """Download a single file and import into database."""
-    try:
-        response = s3.get_object(Bucket=bucket, Key=key)
-        data = json.loads(response["Body"].read().decode("utf-8"))
-    except Exception as e:
-        print(f"  Error downloading {key}: {e}")
-        return 0
+def list_date(s3, bucket: str, date_str: str, archive: dict = None) -> tuple:
+    """
+    (snapshot files, archived keys) of a date: the data/YYYY-MM-DD/ snapshot
+    keys, and the snapshot keys in the date's archive (manifest entry) if
+    it has one.
+    """
+    files = [key for key in list_objects(s3, bucket, f"data/{date_str}/") if SNAPSHOT_KEY_RE.match(key)]
+    archived = [key for key, _, _ in read_header(s3, bucket, archive["key"])["snapshots"]] if archive else []
+    return files, archived
+
+
+def init_manifest(conn: sqlite3.Connection):
+    """Create the checkpoint manifest of imported R2 keys."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS imported_keys (
+            key TEXT PRIMARY KEY,
+            imported_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    conn.commit()
+
 
-    timestamp = data["t"]
-    speeds = data["s"]
+def key_epoch(key: str):
+    """Epoch seconds of a snapshot key (data/YYYY-MM-DD/HH/MMSS.snap, .json, .json.gz, ...), or None."""
+    m = SNAPSHOT_KEY_RE.match(key)
+    return to_epoch(f"{m.group(1)}T{m.group(2)}:{m.group(3)}:{m.group(4)}Z") if m else None
+
+
+def imported_keys(conn: sqlite3.Connection, keys: list) -> set:
+    """
+    Keys already imported. The first time the manifest is used, keys whose
+    timestamp matches an r2 scrape or a heartbeat (imports from before the
+    manifest existed) are added to it.
+    """
+    done = {key for (key,) in conn.execute("SELECT key FROM imported_keys")}
+    if done:
+        return done
+    legacy = {epoch_s for (epoch_s,) in conn.execute("SELECT epoch_s FROM scrapes WHERE source = 'r2'")}
+    legacy.update(epoch_s for (epoch_s,) in conn.execute("SELECT epoch_s FROM heartbeats"))
+    done = {key for key in keys if key_epoch(key) in legacy}
+    now = int(time.time())
+    conn.executemany("INSERT INTO imported_keys (key, imported_at) VALUES (?, ?)", [(key, now) for key in done])
+    conn.commit()
+    return done
+
+
+def fetch_snapshot(s3, bucket: str, key: str, columns: bool = False) -> tuple:
+    """
+    Download and decode one snapshot (binary or JSON, either maybe gzip or
+    zstd compressed; see decode_snapshot); returns (data, size in bytes).
+    """
+    body = s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+    return decode_snapshot(body, columns), len(body)
+
+
+def fetch_snapshots(s3, bucket: str, key: str, archive: tuple = None) -> tuple:
+    """
+    Download a snapshot file, or with archive = (sha256, wanted keys) a day
+    archive; returns ((key, snapshot in columns) iterable, size in bytes).
+    """
+    if archive is None:
+        data, size = fetch_snapshot(s3, bucket, key, columns=True)
+        return [(key, data)], size
+    sha256, wanted = archive
+    blob = fetch_day(s3, bucket, key, sha256)
+    return iter_day(blob, wanted, columns=True), len(blob)
+
+
+def import_snapshot(conn: sqlite3.Connection, data: dict, shards: ShardWriter = None,
+                    rollup_buffer: RollupBuffer = None) -> int:
+    """
+    Import one snapshot decoded in columns (decode_snapshot(columns=True);
+    readings into shards if given) and return the number of readings.
+    Rollups go through rollup_buffer if given. Importing a snapshot again
+    adds nothing: the scrape and its readings are unique and it is folded
+    into the rollups once. Nothing is committed: commit conn, then the
+    shard, before the shard rolls over.
+    """
+    epoch_s = to_epoch(data["t"])
+    if "speeds" not in data:
+        # Sigalert unchanged since the previous snapshot, or it failed/was late
+        record_heartbeat(conn, epoch_s, "missing" if "sigalert" in data.get("missing", []) else "unchanged",
+                         commit=False)
+        return 0
+    speeds = data["speeds"]
     incidents = data.get("i", [])
 
-    # Insert speed readings
-    cursor = conn.cursor()
-    batch = []
-    for idx, entry in enumerate(speeds):
-        speed = entry[0]
-        incident_list = entry[1] if len(entry) > 1 else []
-        has_incident = 1 if incident_list else 0
-        incident_ids = json.dumps([i[1] for i in incident_list]) if incident_list else None
-        batch.append((timestamp, idx, speed, has_incident, incident_ids))
-
-    cursor.executemany("""
-        INSERT OR IGNORE INTO speed_readings (timestamp, sensor_idx, speed_mph, has_incident, incident_ids)
+    # Register the scrape (or find it, if this snapshot was imported before) and insert speed readings
+    scrape_id = register_scrape(conn, epoch_s, "r2")
+    readings_conn = shards.connection(epoch_s) if shards else conn
+    batch = [(scrape_id, idx, speed, 0, None) for idx, speed in enumerate(speeds)]
+    for idx, incident_list in data["refs"].items():
+        batch[idx] = (scrape_id, idx, speeds[idx], 1, json.dumps([i[1] for i in incident_list]))
+
+    readings_conn.executemany("""
+        INSERT OR IGNORE INTO speed_readings (scrape_id, sensor_idx, speed_mph, has_incident, incident_ids)
         VALUES (?, ?, ?, ?, ?)
     """, batch)
+    if rollup_buffer is not None:
+        rollup_buffer.add(conn, epoch_s, speeds, scrape_id)
+    else:
+        update_rollups(conn, epoch_s, speeds, scrape_id)
+
+    # Upsert incidents, keeping the earliest first_seen and latest last_seen
+    conn.executemany("""
+        INSERT INTO incidents (id, location, description, start_time, first_seen, last_seen)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (id) DO UPDATE SET
+            location = excluded.location,
+            description = excluded.description,
+            start_time = excluded.start_time,
+            first_seen = MIN(first_seen, excluded.first_seen),
+            last_seen = MAX(last_seen, excluded.last_seen)
+    """, [tuple(inc[:4]) + (epoch_s, epoch_s) for inc in incidents if len(inc) >= 4])
+    return len(batch)
 
-    # Insert/update incidents
-    for inc in incidents:
-        if len(inc) >= 4:
-            inc_id, location, desc, start_time = inc[:4]
-            cursor.execute("""
-                INSERT OR REPLACE INTO incidents
-                (id, location, description, start_time, first_seen, last_seen)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (inc_id, location, desc, start_time, timestamp, timestamp))
 
+def commit_imported(conn: sqlite3.Connection, shards: ShardWriter, keys: list,
+                    rollup_buffer: RollupBuffer = None):
+    """
+    Commit a group of imports (with the rollups still in rollup_buffer) and
+    add their keys to the manifest. Without shards the manifest commits
+    with the data; with shards the keys are recorded after the shard
+    commits, so an interruption can re-import a group but never skips one.
+    """
+    if rollup_buffer is not None:
+        rollup_buffer.flush(conn)
+    if shards and shards.conn:
+        conn.commit()  # Shard rows reference the scrapes, so they must be durable first
+        shards.conn.commit()
+    now = int(time.time())
+    conn.executemany("INSERT OR REPLACE INTO imported_keys (key, imported_at) VALUES (?, ?)",
+                     [(key, now) for key in keys])
     conn.commit()
-    return len(batch)
+
+
+def backfill(s3, bucket: str, keys: list, conn: sqlite3.Connection, shards: ShardWriter = None,
+             workers: int = DOWNLOAD_WORKERS, batch: int = IMPORT_BATCH, archives: dict = None) -> dict:
+    """
+    Download keys on a pool of workers and import them in key order on this
+    thread, committing every batch snapshots. Keys in archives are day
+    archives, mapped to (sha256, snapshot keys to import). At most workers
+    * DOWNLOAD_WINDOW snapshot files (or workers archives) are in flight or
+    waiting to be imported. Failed downloads are skipped (and retried by
+    the next run).
+    """
+    archives = archives or {}
+    total = sum(len(archives[key][1]) if key in archives else 1 for key in keys)
+    stats = {"snapshots": 0, "archives": 0, "readings": 0, "bytes": 0, "failed": 0}
+    start = time.monotonic()
+    pending = deque()
+    remaining = iter(keys)
+    in_flight = 0  # Weight of pending downloads
+    group = []
+    rollup_buffer = RollupBuffer()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        def fill():
+            nonlocal in_flight
+            while in_flight < workers * DOWNLOAD_WINDOW:
+                key = next(remaining, None)
+                if key is None:
+                    return
+                weight = DOWNLOAD_WINDOW if key in archives else 1
+                pending.append((key, weight, pool.submit(fetch_snapshots, s3, bucket, key, archives.get(key))))
+                in_flight += weight
+
+        fill()
+        while pending:
+            key, weight, future = pending.popleft()
+            in_flight -= weight
+            fill()
+            try:
+                snapshots, size = future.result()
+            except Exception as e:
+                print(f"  Error downloading {key}: {e}")
+                stats["failed"] += len(archives[key][1]) if key in archives else 1
+                continue
+
+            for snapshot_key, data in snapshots:
+                if (shards and shards.key is not None and "speeds" in data
+                        and shard_key(to_epoch(data["t"]), shards.granularity) != shards.key):
+                    commit_imported(conn, shards, group, rollup_buffer)  # Before the rollover closes the shard
+                    group = []
+                stats["readings"] += import_snapshot(conn, data, shards, rollup_buffer)
+                stats["snapshots"] += 1
+                group.append(snapshot_key)
+
+                if len(group) >= batch:
+                    commit_imported(conn, shards, group, rollup_buffer)
+                    group = []
+                    elapsed = time.monotonic() - start
+                    print(f"  {stats['snapshots']:,}/{total:,} snapshots, {stats['readings']:,} readings, "
+                          f"{stats['snapshots'] / elapsed:.0f} snapshots/s, {stats['bytes'] / elapsed / 1e6:.1f} MB/s")
+            stats["bytes"] += size
+            stats["archives"] += key in archives
+        commit_imported(conn, shards, group, rollup_buffer)
+    stats["seconds"] = time.monotonic() - start
+    return stats
 
 
 def main():
     parser = argparse.ArgumentParser(description="Download R2 data to local SQLite")
     parser.add_argument("--days", type=int, default=7, help="Download last N days")
     parser.add_argument("--date", type=str, help="Download specific date (YYYY-MM-DD)")
+    parser.add_argument("--shards", choices=GRANULARITIES,
+                        help="Import readings into per-month or per-day shard files")
+    parser.add_argument("--layout", choices=READINGS_LAYOUTS,
+                        help="speed_readings layout; migrates an existing table (default: keep)")
+    parser.add_argument("--workers", type=int, default=DOWNLOAD_WORKERS,
+                        help=f"Concurrent downloads (default: {DOWNLOAD_WORKERS})")
+    parser.add_argument("--batch", type=int, default=IMPORT_BATCH,
+                        help=f"Snapshots imported per commit (default: {IMPORT_BATCH})")
     args = parser.parse_args()
 
     # Initialize database
     print(f"Database: {DB_PATH}")
     conn = sqlite3.connect(DB_PATH)
-    init_db(conn)
+    init_db(conn, args.layout)
+    shards = open_shard_writer(conn, args.shards, args.layout)
 
     # Ensure sensors are populated
     static = load_static_data()
     populate_sensors(conn, static)
 
+    init_manifest(conn)
+
     # Get R2 client
-    s3 = get_s3_client()
+    s3 = get_s3_client(args.workers)
     bucket = os.environ.get("R2_BUCKET_NAME", "traffic-data")
 
     # Determine dates to download
@@ -116,30 +315,56 @@ def main():
         today = datetime.now(timezone.utc).date()
         dates = [(today - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(args.days)]
 
-    total_readings = 0
-
-    for date_str in dates:
-        prefix = f"data/{date_str}/"
-        print(f"\nDownloading {date_str}...")
-
-        keys = list_objects(s3, bucket, prefix)
-        print(f"  Found {len(keys)} files")
-
-        for key in keys:
-            count = download_and_import(s3, bucket, key, conn)
-            total_readings += count
-
-        print(f"  Imported readings for {date_str}")
-
-    print(f"\nTotal readings imported: {total_readings:,}")
-
-    # Show stats
-    cursor = conn.execute("SELECT COUNT(*), MIN(timestamp), MAX(timestamp) FROM speed_readings")
-    count, min_ts, max_ts = cursor.fetchone()
-    print(f"Database now has {count:,} readings from {min_ts} to {max_ts}")
-
+    # List every date (and read its archive's index) concurrently, then import oldest first
+    archived_days = load_manifest(s3, bucket)["days"]
+    dates = sorted(dates)
+    with ThreadPoolExecutor(max_workers=min(args.workers, len(dates))) as pool:
+        listed = list(pool.map(lambda date_str: list_date(s3, bucket, date_str, archived_days.get(date_str)), dates))
+    keys = sorted({key for files, archived in listed for key in files + archived})
+    done = imported_keys(conn, keys)
+
+    # A date's archive for the snapshots in it, files for any that arrived after it was compacted
+    todo, archives = [], {}
+    for date_str, (files, archived) in zip(dates, listed):
+        wanted = set(archived) - done
+        if wanted:
+            archive = archived_days[date_str]
+            todo.append(archive["key"])
+            archives[archive["key"]] = (archive["sha256"], wanted)
+        todo.extend(sorted(set(files) - set(archived) - done))
+    print(f"Found {len(keys):,} snapshots ({sum(len(archived) for _, archived in listed):,} in day archives), "
+          f"{len(done.intersection(keys)):,} already imported")
+
+    stats = backfill(s3, bucket, todo, conn, shards, args.workers, args.batch, archives)
+    print(f"\nImported {stats['snapshots']:,} snapshots ({stats['archives']:,} day archives, "
+          f"{stats['bytes'] / 1e6:.1f} MB) in {stats['seconds']:.1f}s")
+    if stats["failed"]:
+        print(f"{stats['failed']:,} snapshots failed to download; rerun to retry them")
+    print(f"Total readings imported: {stats['readings']:,}")
+
+    if shards:
+        shards.close()
     conn.close()
 
+    # Show stats for the downloaded range (across shards if used)
+    since = to_epoch(min(dates) + "T00:00:00Z") - 1
+    until = to_epoch(max(dates) + "T23:59:59Z")
+    count, min_ts, max_ts = 0, None, None
+    for conn in iter_routers(since, until, db_path=DB_PATH):  # Batches of shards past SQLite's attach limit
+        batch_count, batch_min, batch_max = conn.execute("""
+            SELECT COUNT(*), MIN(sc.epoch_s), MAX(sc.epoch_s)
+            FROM speed_readings r JOIN scrapes sc ON sc.id = r.scrape_id
+            WHERE sc.epoch_s > ? AND sc.epoch_s <= ?
+        """, (since, until)).fetchone()
+        if batch_count:
+            count += batch_count
+            min_ts = batch_min if min_ts is None else min(min_ts, batch_min)
+            max_ts = batch_max if max_ts is None else max(max_ts, batch_max)
+    if count:
+        print(f"Downloaded range now has {count:,} readings from {format_epoch(min_ts)} to {format_epoch(max_ts)}")
+    else:
+        print("Database has no readings in the downloaded range")
+
 
 if __name__ == "__main__":
     main()
@@ -7,22 +7,41 @@ Fetches traffic data from:
 2. CHP CAD - real-time dispatch incidents
 3. Waze Live Map - police, accident, hazard, and road closure alerts
 
-Uploads to R2 as timestamped JSON.
+Sources are fetched concurrently, each with its own deadline; a source that
+fails or misses its deadline is listed under "missing" in the snapshot.
+
+Uploads to R2 as timestamped binary snapshots (snapshot_codec.py), or
+compressed JSON for a snapshot the binary format can't represent.
+Unchanged Sigalert data is left out of the snapshot, and fully unchanged
+snapshots are not uploaded at all.
 
 Environment variables:
   R2_ACCOUNT_ID: Cloudflare account ID
   R2_ACCESS_KEY_ID: R2 access key
   R2_SECRET_ACCESS_KEY: R2 secret key
   R2_BUCKET_NAME: R2 bucket name (default: traffic-data)
+  UPLOAD_COMPRESSION: gzip (default), zstd (needs zstandard) or none, for
+    JSON snapshots (.snap files are compressed already)
+  SCRAPER_STATE_PATH: change-detection state file (default: state/scraper_state.json)
 """
 
+import hashlib
 import json
 import os
 import re
-import urllib.request
+import sys
+import threading
+import time
 import urllib.parse
+from concurrent.futures import Future
 from html.parser import HTMLParser
 from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import http_client
+from feed_parser import parse_live_feed
+from snapshot_codec import decode_snapshot, encode_snapshot, compress, CONTENT_ENCODINGS
 
 # Sigalert URLs
 STATIC_URL = "https://cdn-static.sigalert.com/240/Zip/RegionInfo/SoCalStatic.json"
@@ -50,6 +69,18 @@ HEADERS = {
     "Referer": "https://www.sigalert.com/",
 }
 
+# Seconds after the start of collection by which each source must have answered
+SOURCE_DEADLINES = {"sigalert": 45, "chp": 30, "waze": 20}
+
+# Change-detection state carried between runs (cached by the workflow)
+STATE_PATH = os.environ.get("SCRAPER_STATE_PATH", "state/scraper_state.json")
+
+# Content-Encoding of uploaded JSON snapshots (gzip, zstd or none)
+UPLOAD_COMPRESSION = os.environ.get("UPLOAD_COMPRESSION", "gzip")
+
+_r2_client = None
+_r2_lock = threading.Lock()
+
 
 class CHPTableParser(HTMLParser):
     """Parse CHP incident table from HTML."""
@@ -89,84 +120,91 @@ class CHPTableParser(HTMLParser):
             self.current_data += data
 
 
-def fetch_chp_incidents(center: str) -> list:
-    """Fetch incidents from CHP CAD for a communication center."""
+def fetch_chp_center(center: str) -> list:
+    """Fetch incidents from CHP CAD for a communication center (raises on error)."""
     headers = {"User-Agent": HEADERS["User-Agent"]}
 
+    # GET to get ViewState
+    html = http_client.get_text(CHP_URL, headers, timeout=15)
+
+    vs_match = re.search(r'id="__VIEWSTATE" value="([^"]*)"', html)
+    vsg_match = re.search(r'id="__VIEWSTATEGENERATOR" value="([^"]*)"', html)
+
+    if not vs_match or not vsg_match:
+        return []
+
+    # POST to get data for specific center (same kept-alive connection)
+    html = http_client.post_form(CHP_URL, {
+        "__VIEWSTATE": vs_match.group(1),
+        "__VIEWSTATEGENERATOR": vsg_match.group(1),
+        "__EVENTTARGET": "ddlComCenter",
+        "ddlComCenter": center,
+        "ddlSearches": "Choose One",
+        "ddlResources": "Choose One",
+    }, headers, timeout=15)
+
+    # Parse table
+    parser = CHPTableParser()
+    parser.feed(html)
+
+    # Extract incidents
+    # row: [0]=id_link, [1]=time, [2]=type, [3]=location, [4]=loc_desc, [5]=area, [6]=log_id (optional)
+    incidents = []
+    for row in parser.rows:
+        if len(row) >= 6:
+            incidents.append({
+                "id": row[0].replace("Details", "").strip(),
+                "time": row[1],
+                "type": row[2],
+                "loc": row[3],
+                "desc": row[4],
+                "area": row[5],
+            })
+    return incidents
+
+
+def fetch_chp_incidents(center: str) -> list:
+    """Fetch incidents from CHP CAD for a communication center."""
     try:
-        # GET to get ViewState
-        req = urllib.request.Request(CHP_URL, headers=headers)
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            html = resp.read().decode("utf-8")
-
-        vs_match = re.search(r'id="__VIEWSTATE" value="([^"]*)"', html)
-        vsg_match = re.search(r'id="__VIEWSTATEGENERATOR" value="([^"]*)"', html)
-
-        if not vs_match or not vsg_match:
-            return []
-
-        # POST to get data for specific center
-        data = urllib.parse.urlencode({
-            "__VIEWSTATE": vs_match.group(1),
-            "__VIEWSTATEGENERATOR": vsg_match.group(1),
-            "__EVENTTARGET": "ddlComCenter",
-            "ddlComCenter": center,
-            "ddlSearches": "Choose One",
-            "ddlResources": "Choose One",
-        }).encode()
-
-        req = urllib.request.Request(CHP_URL, data=data, headers=headers)
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            html = resp.read().decode("utf-8")
-
-        # Parse table
-        parser = CHPTableParser()
-        parser.feed(html)
-
-        # Extract incidents
-        # row: [0]=id_link, [1]=time, [2]=type, [3]=location, [4]=loc_desc, [5]=area, [6]=log_id (optional)
-        incidents = []
-        for row in parser.rows:
-            if len(row) >= 6:
-                incidents.append({
-                    "id": row[0].replace("Details", "").strip(),
-                    "time": row[1],
-                    "type": row[2],
-                    "loc": row[3],
-                    "desc": row[4],
-                    "area": row[5],
-                })
-        return incidents
+        return fetch_chp_center(center)
     except Exception as e:
         print(f"  CHP {center} error: {e}")
         return []
 
 
-def fetch_waze_alerts() -> list:
-    """Fetch Waze alerts from all LA tiles, deduplicated by UUID."""
+def fetch_waze_tile(tile: dict) -> list:
+    """Fetch raw Waze alerts for one tile (raises on error)."""
+    params = urllib.parse.urlencode({
+        "top": tile["top"], "bottom": tile["bottom"],
+        "left": tile["left"], "right": tile["right"],
+        "env": "na", "types": "alerts",
+    })
+    headers = {"User-Agent": HEADERS["User-Agent"]}
+    return http_client.get_json(f"{WAZE_URL}?{params}", headers, timeout=15).get("alerts", [])
+
+
+def dedupe_alerts(tile_alerts: list) -> list:
+    """Merge per-tile alert lists, deduplicated by UUID."""
     seen = set()
     all_alerts = []
-    headers = {"User-Agent": HEADERS["User-Agent"]}
+    for alerts in tile_alerts:
+        for a in alerts:
+            uid = a.get("uuid")
+            if uid and uid not in seen:
+                seen.add(uid)
+                all_alerts.append(a)
+    return all_alerts
+
 
+def fetch_waze_alerts() -> list:
+    """Fetch Waze alerts from all LA tiles, deduplicated by UUID."""
+    tile_alerts = []
     for tile in WAZE_TILES:
         try:
-            params = urllib.parse.urlencode({
-                "top": tile["top"], "bottom": tile["bottom"],
-                "left": tile["left"], "right": tile["right"],
-                "env": "na", "types": "alerts",
-            })
-            req = urllib.request.Request(f"{WAZE_URL}?{params}", headers=headers)
-            with urllib.request.urlopen(req, timeout=15) as resp:
-                data = json.loads(resp.read().decode("utf-8"))
-            for a in data.get("alerts", []):
-                uid = a.get("uuid")
-                if uid and uid not in seen:
-                    seen.add(uid)
-                    all_alerts.append(a)
+            tile_alerts.append(fetch_waze_tile(tile))
         except Exception as e:
             print(f"  Waze tile error: {e}")
-
-    return all_alerts
+    return dedupe_alerts(tile_alerts)
 
 
 def compact_waze_alert(a: dict) -> dict:
@@ -194,25 +232,159 @@ def compact_waze_alert(a: dict) -> dict:
 
 def fetch_json(url: str) -> dict:
     """Fetch JSON from URL."""
-    req = urllib.request.Request(url, headers=HEADERS)
-    with urllib.request.urlopen(req, timeout=30) as resp:
-        return json.loads(resp.read().decode("utf-8"))
+    return http_client.get_json(url, HEADERS, timeout=30)
 
 
-def upload_to_r2(data: bytes, key: str):
-    """Upload data to Cloudflare R2 using boto3."""
-    import boto3
+def load_state() -> dict:
+    """Load change-detection state from the previous run."""
+    try:
+        with open(STATE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state: dict):
+    """Persist change-detection state for the next run."""
+    os.makedirs(os.path.dirname(STATE_PATH) or ".", exist_ok=True)
+    with open(STATE_PATH, "w") as f:
+        json.dump(state, f)
+
+
+def digest(obj) -> str:
+    """Content hash of a JSON-serializable object."""
+    return hashlib.sha256(json.dumps(obj, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+def fetch_sigalert_if_changed(url: str, state: dict) -> dict:
+    """
+    Fetch Sigalert live data, or return None if it is unchanged since the
+    last run: a 304 on a conditional request (ETag / Last-Modified), or
+    else an identical digest of the speeds and incidents.
+    """
+    headers = dict(HEADERS)
+    if state.get("etag"):
+        headers["If-None-Match"] = state["etag"]
+    if state.get("last_modified"):
+        headers["If-Modified-Since"] = state["last_modified"]
+
+    resp = http_client.get(url, headers, timeout=30)
+    if resp.status == 304:
+        return None
+    data, sigalert_digest = parse_live_feed(resp.data)  # cameras are never decoded
+    etag = resp.headers.get("ETag")
+    last_modified = resp.headers.get("Last-Modified")
+    unchanged = sigalert_digest == state.get("sigalert_digest")
+    state.update(etag=etag, last_modified=last_modified, sigalert_digest=sigalert_digest)
+    return None if unchanged else data
+
+
+def compact_sigalert(data: dict) -> dict:
+    """Snapshot "s" and "i" members from parsed Sigalert live data."""
+    return {
+        "s": [[s[0], s[2]] for s in data["speeds"]],  # [speed, incidents] only
+        "i": [
+            [i[1], i[3], i[4], i[8]]  # [id, location, description, start_time]
+            for i in data.get("incidents", [])
+            if len(i) >= 9
+        ],
+    }
 
-    s3 = boto3.client(
-        "s3",
-        endpoint_url=f"https://{os.environ['R2_ACCOUNT_ID']}.r2.cloudflarestorage.com",
-        aws_access_key_id=os.environ["R2_ACCESS_KEY_ID"],
-        aws_secret_access_key=os.environ["R2_SECRET_ACCESS_KEY"],
-        region_name="auto",
-    )
 
+def encode_payload(compact_data: dict, compression: str = UPLOAD_COMPRESSION) -> tuple:
+    """
+    (payload, key suffix, object metadata, JSON size) of a snapshot: the
+    binary encoding, or JSON compressed with compression if the snapshot
+    doesn't fit it or doesn't decode to the same data as its JSON.
+    """
+    json_bytes = json.dumps(compact_data, separators=(",", ":")).encode("utf-8")
+    try:
+        payload = encode_snapshot(compact_data)
+        if decode_snapshot(payload) == json.loads(json_bytes):
+            return payload, "snap", {"ContentType": "application/octet-stream"}, len(json_bytes)
+        print("  Binary snapshot doesn't round-trip, uploading JSON")
+    except ValueError as e:
+        print(f"  Binary snapshot not possible ({e}), uploading JSON")
+    metadata = {"ContentType": "application/json"}
+    if compression in CONTENT_ENCODINGS:
+        metadata["ContentEncoding"] = compression
+        return compress(json_bytes, compression), "json" + CONTENT_ENCODINGS[compression][0], metadata, len(json_bytes)
+    return json_bytes, "json", metadata, len(json_bytes)
+
+
+def _fetch_in_background(fetch, *args) -> Future:
+    """
+    Run fetch(*args) on a daemon thread and return a Future for its result.
+    A fetch still running when the script exits is abandoned, not waited for.
+    """
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(fetch(*args))
+        except Exception as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+def collect_sources(sigalert_url: str, state: dict) -> tuple:
+    """
+    Fetch Sigalert, every CHP center and every Waze tile concurrently.
+    Returns (results, missing): results maps source name ("sigalert",
+    "chp:LACC", "waze:0", ...) to its data; missing lists sources that
+    failed or missed their deadline in SOURCE_DEADLINES. Sigalert
+    change-detection state is only updated if Sigalert answered in time.
+    """
+    start = time.monotonic()
+    sigalert_state = dict(state)
+    futures = {"sigalert": _fetch_in_background(fetch_sigalert_if_changed, sigalert_url, sigalert_state)}
+    for center in CHP_CENTERS:
+        futures[f"chp:{center}"] = _fetch_in_background(fetch_chp_center, center)
+    for i, tile in enumerate(WAZE_TILES):
+        futures[f"waze:{i}"] = _fetch_in_background(fetch_waze_tile, tile)
+
+    results, missing = {}, []
+    for name, future in futures.items():
+        deadline = start + SOURCE_DEADLINES[name.split(":")[0]]
+        try:
+            results[name] = future.result(timeout=max(deadline - time.monotonic(), 0))
+        except TimeoutError:
+            print(f"  {name}: missed its {SOURCE_DEADLINES[name.split(':')[0]]}s deadline")
+            missing.append(name)
+        except Exception as e:
+            print(f"  {name} error: {type(e).__name__}: {e}")
+            missing.append(name)
+
+    # Stragglers keep running on their daemon threads; their results are discarded
+    if "sigalert" in results:
+        state.update(sigalert_state)
+    return results, missing
+
+
+def get_r2_client():
+    """boto3 S3 client for R2, created on first use and shared by every upload (thread-safe)."""
+    global _r2_client
+    with _r2_lock:
+        if _r2_client is None:
+            import boto3
+
+            _r2_client = boto3.client(
+                "s3",
+                endpoint_url=f"https://{os.environ['R2_ACCOUNT_ID']}.r2.cloudflarestorage.com",
+                aws_access_key_id=os.environ["R2_ACCESS_KEY_ID"],
+                aws_secret_access_key=os.environ["R2_SECRET_ACCESS_KEY"],
+                region_name="auto",
+            )
+        return _r2_client
+
+
+def upload_to_r2(data: bytes, key: str, metadata: dict = None):
+    """Upload data to Cloudflare R2 (metadata: put_object ContentType/ContentEncoding)."""
     bucket = os.environ.get("R2_BUCKET_NAME", "traffic-data")
-    s3.put_object(Bucket=bucket, Key=key, Body=data, ContentType="application/json")
+    get_r2_client().put_object(Bucket=bucket, Key=key, Body=data,
+                               **(metadata or {"ContentType": "application/json"}))
     print(f"Uploaded to r2://{bucket}/{key}")
 
 
@@ -224,21 +396,26 @@ def scrape_and_upload():
     hour_str = now.strftime("%H")
 
     print(f"Scraping at {timestamp}...")
+    state = load_state()
+    if os.environ.get("R2_ACCOUNT_ID"):
+        # Import boto3 and create the client while the sources are fetched
+        threading.Thread(target=get_r2_client, name="r2-client", daemon=True).start()
 
-    # Fetch Sigalert data
+    # Fetch all sources concurrently (Sigalert is None if unchanged since the last run)
     cb = int(now.timestamp() * 1000) % 100000000
-    data = fetch_json(f"{DATA_URL}?cb={cb}")
+    results, missing = collect_sources(f"{DATA_URL}?cb={cb}", state)
+    data = results.get("sigalert")
 
-    # Fetch CHP CAD data
+    # CHP CAD data
     chp_incidents = {}
     for center in CHP_CENTERS:
-        incidents = fetch_chp_incidents(center)
+        incidents = results.get(f"chp:{center}")
         if incidents:
             chp_incidents[center] = incidents
             print(f"  CHP {center}: {len(incidents)} incidents")
 
-    # Fetch Waze alerts
-    waze_alerts = fetch_waze_alerts()
+    # Waze alerts
+    waze_alerts = dedupe_alerts(results[f"waze:{i}"] for i in range(len(WAZE_TILES)) if f"waze:{i}" in results)
     waze_compact = [compact_waze_alert(a) for a in waze_alerts]
     waze_by_type = {}
     for a in waze_alerts:
@@ -246,41 +423,54 @@ def scrape_and_upload():
         waze_by_type[t] = waze_by_type.get(t, 0) + 1
     print(f"  Waze: {len(waze_alerts)} alerts {dict(waze_by_type)}")
 
-    # Extract just speeds and incidents (cameras are large and rarely needed)
     compact_data = {
         "t": timestamp,
-        "s": [[s[0], s[2]] for s in data["speeds"]],  # [speed, incidents] only
-        "i": [
-            [i[1], i[3], i[4], i[8]]  # [id, location, description, start_time]
-            for i in data.get("incidents", [])
-            if len(i) >= 9
-        ],
         "chp": chp_incidents,  # CHP CAD incidents by center
         "waze": waze_compact,  # Waze alerts as structured objects
     }
+    if missing:
+        compact_data["missing"] = missing  # Sources that failed or were late
+
+    # Just speeds and incidents (cameras are large and rarely needed, and were never parsed).
+    # Unchanged Sigalert data is omitted: no "s"/"i" means same as previous snapshot.
+    if data is not None:
+        compact_data.update(compact_sigalert(data))
+        valid_speeds = sum(1 for s in compact_data["s"] if s[0] is not None)
+        print(f"Sigalert: {valid_speeds}/{len(compact_data['s'])} speeds, {len(compact_data['i'])} incidents")
+    elif "sigalert" in missing:
+        print("Sigalert: missing from this snapshot")
+    else:
+        print("Sigalert: unchanged since last run")
 
-    # Stats
-    valid_speeds = sum(1 for s in compact_data["s"] if s[0] is not None)
-    print(f"Sigalert: {valid_speeds}/{len(compact_data['s'])} speeds, {len(compact_data['i'])} incidents")
+    # Skip the upload entirely if nothing changed; only record a heartbeat
+    extras_digest = digest([chp_incidents, waze_compact])
+    if data is None and not missing and extras_digest == state.get("extras_digest"):
+        state["heartbeat"] = timestamp
+        save_state(state)
+        print(f"Heartbeat: snapshot unchanged since {state.get('last_upload', '?')}, skipping upload")
+        return compact_data
 
-    # Compress and upload
-    json_bytes = json.dumps(compact_data, separators=(",", ":")).encode("utf-8")
-    print(f"Payload size: {len(json_bytes):,} bytes")
+    # Encode and upload
+    payload, suffix, metadata, json_size = encode_payload(compact_data)
+    print(f"Payload size: {json_size:,} bytes as JSON, compressed: {len(payload):,} bytes "
+          f"({suffix}, {json_size / len(payload):.1f}x)")
 
-    # Key format: data/YYYY-MM-DD/HH/MMSS.json
-    key = f"data/{date_str}/{hour_str}/{now.strftime('%M%S')}.json"
+    # Key format: data/YYYY-MM-DD/HH/MMSS.snap (or .json.gz, .json.zst, .json)
+    key = f"data/{date_str}/{hour_str}/{now.strftime('%M%S')}.{suffix}"
 
     if os.environ.get("R2_ACCOUNT_ID"):
-        upload_to_r2(json_bytes, key)
+        upload_to_r2(payload, key, metadata)
     else:
         # Local mode - save to file
         out_dir = f"data/{date_str}/{hour_str}"
         os.makedirs(out_dir, exist_ok=True)
-        out_path = f"{out_dir}/{now.strftime('%M%S')}.json"
+        out_path = f"{out_dir}/{now.strftime('%M%S')}.{suffix}"
         with open(out_path, "wb") as f:
-            f.write(json_bytes)
+            f.write(payload)
         print(f"Saved locally to {out_path}")
 
+    state.update(extras_digest=extras_digest, last_upload=timestamp, heartbeat=timestamp)
+    save_state(state)
     return compact_data
 
 
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Binary Snapshot Format
+
+scraper_lambda.py uploads snapshots as data/YYYY-MM-DD/HH/MMSS.snap, a
+versioned binary encoding of the same members as the JSON snapshots
+(MMSS.json). decode_snapshot reads both, so download_data.py and
+compact_days.py don't care which one a key holds.
+
+A snapshot is MAGIC, a VERSION byte and a zlib stream of sections, each a
+4-byte little-endian length and its bytes, in this order:
+- meta: JSON {"members": the snapshot's keys in order, "chp": CHP centers,
+  plus "t", "missing" and any other member without a section}
+- strings: JSON array; every string below is an index into it, so
+  repeated Waze cities, streets and types are stored once
+- speeds: one byte per sensor ("s"), NULL_SPEED = no data
+- refs: columns sensor, kind, id of each incident ref ([kind, id] in "s")
+- incidents: columns id, location, description, start_time ("i")
+- chp: columns center, then CHP_FIELDS
+- waze: columns WAZE_FIELDS then WAZE_OPTIONAL, lat/lon in 1/COORD_SCALE
+  degrees
+
+Columns are int64 arrays stored one after another, ABSENT for a None
+string or a missing optional member. encode_snapshot raises ValueError for
+a snapshot this version can't represent exactly; the caller uploads JSON
+instead.
+
+Uploads that aren't .snap files may also be compressed as a whole
+(compress: gzip, or zstd with the zstandard package) and are decompressed
+by decode_snapshot, which recognizes them by their magic bytes.
+
+decode_snapshot(blob, columns=True) returns "speeds" (speed or None per
+sensor) and "refs" ({sensor_idx: incident refs}) in place of "s", without
+building a list per sensor; that is what download_data imports.
+
+Standard library only.
+"""
+
+import gzip
+import json
+import struct
+import sys
+import zlib
+from array import array
+
+MAGIC = b"TRSN"
+VERSION = 1
+NULL_SPEED = 255
+ABSENT = -1
+COORD_SCALE = 100000  # Waze coordinates are rounded to 5 decimals
+COMPRESSION_LEVEL = 9
+
+CHP_FIELDS = ("id", "time", "type", "loc", "desc", "area")
+WAZE_FIELDS = ("uuid", "type", "subtype", "lat", "lon", "street", "city",
+               "reliability", "thumbs_up", "pub_utc", "road_type")
+WAZE_OPTIONAL = ("description", "num_comments")
+WAZE_STRINGS = {"uuid", "type", "subtype", "street", "city", "description"}
+WAZE_COORDS = {"lat", "lon"}
+SECTIONS = ("meta", "strings", "speeds", "refs", "incidents", "chp", "waze")
+
+# Content-Encoding -> (key suffix, magic bytes) of whole-file compression
+CONTENT_ENCODINGS = {"gzip": (".gz", b"\x1f\x8b"), "zstd": (".zst", b"\x28\xb5\x2f\xfd")}
+ZSTD_LEVEL = 19
+
+_LENGTH = struct.Struct("<I")
+
+
+def _int(value) -> int:
+    if type(value) is not int or not -2 ** 63 <= value < 2 ** 63:
+        raise ValueError(f"{value!r} doesn't fit an int64 column")
+    return value
+
+
+def _pack(columns: list) -> bytes:
+    packed = array("q")
+    for column in columns:
+        packed.extend(column)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _unpack(section: bytes, count: int) -> list:
+    values = array("q")
+    values.frombytes(section)
+    if sys.byteorder == "big":
+        values.byteswap()
+    rows = len(values) // count
+    return [values[i * rows:(i + 1) * rows] for i in range(count)]
+
+
+def compress(payload: bytes, encoding: str) -> bytes:
+    """payload compressed with a CONTENT_ENCODINGS encoding (zstd needs the zstandard package)."""
+    if encoding == "gzip":
+        return gzip.compress(payload, 9, mtime=0)
+    if encoding == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(payload)
+    raise ValueError(f"Unknown content encoding {encoding!r}")
+
+
+def decompress(blob: bytes) -> bytes:
+    """blob without its gzip or zstd compression, if it has one (already-decoded bodies pass through)."""
+    if blob[:2] == CONTENT_ENCODINGS["gzip"][1]:
+        return gzip.decompress(blob)
+    if blob[:4] == CONTENT_ENCODINGS["zstd"][1]:
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(blob, max_output_size=64 * 1024 ** 2)
+    return blob
+
+
+def speed_values(raw: bytes) -> list:
+    """Speed (or None) per sensor of a byte-per-sensor speed string."""
+    speeds = list(raw)
+    null = raw.find(NULL_SPEED)
+    while null != -1:
+        speeds[null] = None
+        null = raw.find(NULL_SPEED, null + 1)
+    return speeds
+
+
+def speed_columns(entries: list) -> tuple:
+    """(speeds, refs) of a snapshot's "s" list of [speed, incident refs]."""
+    return ([entry[0] for entry in entries],
+            {idx: entry[1] for idx, entry in enumerate(entries) if len(entry) > 1 and entry[1]})
+
+
+def encode_snapshot(data: dict) -> bytes:
+    """Binary encoding of a snapshot dict (raises ValueError if it doesn't fit this version)."""
+    strings = {}
+
+    def intern(value, optional=False) -> int:
+        if value is None and optional:
+            return ABSENT
+        if type(value) is not str:
+            raise ValueError(f"{value!r} is not a string")
+        return strings.setdefault(value, len(strings))
+
+    meta = {"members": list(data)}
+    meta.update((k, v) for k, v in data.items() if k not in ("s", "i", "chp", "waze"))
+
+    speeds = bytearray()
+    refs = ([], [], [])
+    for idx, entry in enumerate(data.get("s", ())):
+        if len(entry) != 2:
+            raise ValueError(f"Speed entry {entry!r} is not [speed, incidents]")
+        speed, entry_refs = entry
+        if speed is not None and (type(speed) is not int or not 0 <= speed < NULL_SPEED):
+            raise ValueError(f"Speed {speed!r} of sensor {idx} doesn't fit in a byte")
+        speeds.append(NULL_SPEED if speed is None else speed)
+        for ref in entry_refs:
+            if len(ref) != 2:
+                raise ValueError(f"Incident ref {ref!r} is not [kind, id]")
+            refs[0].append(idx)
+            refs[1].append(_int(ref[0]))
+            refs[2].append(_int(ref[1]))
+
+    incidents = ([], [], [], [])
+    for row in data.get("i", ()):
+        if len(row) != 4:
+            raise ValueError(f"Incident {row!r} is not [id, location, description, start_time]")
+        incidents[0].append(_int(row[0]))
+        for column, value in zip(incidents[1:], row[1:]):
+            column.append(intern(value, optional=True))
+
+    centers = list(data.get("chp", {}))
+    chp = tuple([] for _ in range(len(CHP_FIELDS) + 1))
+    for center_idx, center in enumerate(centers):
+        for record in data["chp"][center]:
+            if tuple(record) != CHP_FIELDS:
+                raise ValueError(f"CHP record with fields {tuple(record)}")
+            chp[0].append(center_idx)
+            for column, name in zip(chp[1:], CHP_FIELDS):
+                column.append(intern(record[name]))
+    meta["chp"] = centers
+
+    waze = {name: [] for name in WAZE_FIELDS + WAZE_OPTIONAL}
+    for alert in data.get("waze", ()):
+        if tuple(alert) != WAZE_FIELDS + tuple(k for k in WAZE_OPTIONAL if k in alert):
+            raise ValueError(f"Waze alert with fields {tuple(alert)}")
+        for name, column in waze.items():
+            value = alert.get(name)
+            if name in WAZE_OPTIONAL and name not in alert:
+                column.append(ABSENT)
+            elif name in WAZE_STRINGS:
+                column.append(intern(value))
+            elif name in WAZE_COORDS:
+                scaled = round(value * COORD_SCALE)
+                if scaled / COORD_SCALE != value:
+                    raise ValueError(f"Waze {name} {value!r} has more than 5 decimals")
+                column.append(_int(scaled))
+            elif name in WAZE_OPTIONAL and value == ABSENT:
+                raise ValueError(f"Waze {name} {value!r} can't be told from a missing one")
+            else:
+                column.append(_int(value))
+
+    sections = (
+        json.dumps(meta, separators=(",", ":")).encode("utf-8"),
+        json.dumps(list(strings), separators=(",", ":")).encode("utf-8"),
+        bytes(speeds),
+        _pack(refs),
+        _pack(incidents),
+        _pack(chp),
+        _pack(waze.values()),
+    )
+    body = b"".join(_LENGTH.pack(len(section)) + section for section in sections)
+    return MAGIC + bytes([VERSION]) + zlib.compress(body, COMPRESSION_LEVEL)
+
+
+def decode_snapshot(blob: bytes, columns: bool = False) -> dict:
+    """
+    Snapshot dict of a binary (MAGIC) or JSON snapshot, either possibly
+    gzip or zstd compressed; with columns, "speeds" and "refs" replace "s".
+    """
+    blob = decompress(blob)
+    if blob[:len(MAGIC)] != MAGIC:
+        data = json.loads(blob.decode("utf-8"))
+        if columns and "s" in data:
+            data["speeds"], data["refs"] = speed_columns(data.pop("s"))
+        return data
+    if blob[len(MAGIC)] != VERSION:
+        raise ValueError(f"Unsupported snapshot version {blob[len(MAGIC)]}")
+    body = zlib.decompress(blob[len(MAGIC) + 1:])
+    sections, pos = {}, 0
+    for name in SECTIONS:
+        length = _LENGTH.unpack_from(body, pos)[0]
+        sections[name] = body[pos + _LENGTH.size:pos + _LENGTH.size + length]
+        pos += _LENGTH.size + length
+    meta = json.loads(sections["meta"].decode("utf-8"))
+    strings = json.loads(sections["strings"].decode("utf-8"))
+
+    def string(i):
+        return None if i == ABSENT else strings[i]
+
+    data = {}
+    for member in meta["members"]:
+        if member == "s":
+            refs = {}
+            for idx, kind, ref_id in zip(*_unpack(sections["refs"], 3)):
+                refs.setdefault(idx, []).append([kind, ref_id])
+            speeds = speed_values(sections["speeds"])
+            if columns:
+                data["speeds"], data["refs"] = speeds, refs
+            else:
+                data["s"] = [[speed, refs.get(idx) or []] for idx, speed in enumerate(speeds)]
+        elif member == "i":
+            data["i"] = [[incident_id, string(loc), string(desc), string(start)]
+                         for incident_id, loc, desc, start in zip(*_unpack(sections["incidents"], 4))]
+        elif member == "chp":
+            data["chp"] = {center: [] for center in meta["chp"]}
+            for center, *fields in zip(*_unpack(sections["chp"], len(CHP_FIELDS) + 1)):
+                data["chp"][meta["chp"][center]].append(dict(zip(CHP_FIELDS, map(strings.__getitem__, fields))))
+        elif member == "waze":
+            names = WAZE_FIELDS + WAZE_OPTIONAL
+            data["waze"] = []
+            for row in zip(*_unpack(sections["waze"], len(names))):
+                alert = {}
+                for name, value in zip(names, row):
+                    if name in WAZE_COORDS:
+                        alert[name] = value / COORD_SCALE
+                    elif name in WAZE_OPTIONAL and value == ABSENT:
+                        continue
+                    else:
+                        alert[name] = strings[value] if name in WAZE_STRINGS else value
+                data["waze"].append(alert)
+        else:
+            data[member] = meta[member]
+    return data
@@ -8,14 +8,24 @@ Routes analyzed:
 3. 110 Route: 10 E → 110 S → 710 S (downtown adjacent)
 
 Reverse directions for evening commute.
+
+Historical patterns come from the rollups; with `--storage matrix` (data
+collected by scraper.py --storage matrix) they are read from the speed matrix.
+Current speeds are read from the storage mode given with --storage (rows,
+packed, delta or matrix).
 """
 
-import sqlite3
-from datetime import datetime, timedelta, timezone
+import time
+from datetime import datetime, timezone
 from pathlib import Path
 from collections import defaultdict
 import json
 
+from rollups import PENDING_AGE, local_dow_hour, pending_scrapes
+from shards import open_router
+from snapshots import NULL_SPEED, get_sensor_range_history
+from speed_matrix import open_matrix
+
 DB_PATH = Path(__file__).parent / "traffic.db"
 
 # Approximate distances in miles between sensor segments (avg ~0.5 mi per sensor)
@@ -60,33 +70,73 @@ ROUTES_EVENING = {
 }
 
 
-def get_connection():
-    return sqlite3.connect(DB_PATH)
+def get_connection(hours_back: float = 24):
+    """
+    Open the database with the time shards covering the last hours_back hours
+    attached (current speeds; historical patterns come from the rollups).
+    """
+    since = int(time.time() - hours_back * 3600)
+    return open_router(since, db_path=DB_PATH)
+
+
+def _speed_history(conn, start_idx: int, end_idx: int, since: int = None, until: int = None,
+                   storage: str = "packed") -> list:
+    """[(epoch_s, [speed, ...]), ...] for sensors start_idx..end_idx from packed/delta snapshots or the matrix."""
+    if storage == "matrix":
+        epochs, rows = open_matrix().slice(start_idx, end_idx, since, until)
+        return [(epoch_s, [None if speed == NULL_SPEED else speed for speed in bytes(row)])
+                for epoch_s, row in zip(epochs, rows)]
+    return get_sensor_range_history(conn, start_idx, end_idx, since, until)
+
+
+def _stored_segment_speeds(conn, route: str, direction: str, start_idx: int, end_idx: int,
+                           epoch_s: int = None, hours_back: float = 0.5, storage: str = "packed") -> list:
+    """get_segment_speeds for packed, delta or matrix storage."""
+    sensors = {idx for (idx,) in conn.execute(
+        "SELECT idx FROM sensors WHERE idx BETWEEN ? AND ? AND route = ? AND direction = ?",
+        (start_idx, end_idx, route, direction))}
+    until = epoch_s or int(time.time())
+    history = _speed_history(conn, start_idx, end_idx, until - int(hours_back * 3600), until, storage)
+    if epoch_s:
+        # The snapshot closest to epoch_s
+        speeds = history[-1][1] if history else []
+        return [(idx, speed) for idx, speed in enumerate(speeds, start_idx)]
+
+    totals = defaultdict(list)
+    for _, speeds in history:
+        for idx, speed in enumerate(speeds, start_idx):
+            if speed is not None and idx in sensors:
+                totals[idx].append(speed)
+    return [(idx, sum(values) / len(values)) for idx, values in sorted(totals.items())]
 
 
 def get_segment_speeds(conn, route: str, direction: str, start_idx: int, end_idx: int,
-                       timestamp: str = None, hours_back: float = 0.5) -> list:
-    """Get speeds for a route segment, optionally at a specific time."""
-    if timestamp:
-        # Get reading closest to timestamp
+                       epoch_s: int = None, hours_back: float = 0.5, storage: str = "rows") -> list:
+    """Get speeds for a route segment, optionally at a specific time (epoch seconds)."""
+    if storage != "rows":
+        return _stored_segment_speeds(conn, route, direction, start_idx, end_idx, epoch_s, hours_back, storage)
+    if epoch_s:
+        # Get reading closest to epoch_s
         cursor = conn.execute("""
-            SELECT sensor_idx, speed_mph
-            FROM speed_readings
-            WHERE sensor_idx BETWEEN ? AND ?
-            AND timestamp <= ?
-            ORDER BY timestamp DESC
+            SELECT r.sensor_idx, r.speed_mph
+            FROM speed_readings r
+            JOIN scrapes sc ON sc.id = r.scrape_id
+            WHERE r.sensor_idx BETWEEN ? AND ?
+            AND sc.epoch_s <= ?
+            ORDER BY sc.epoch_s DESC
             LIMIT ?
-        """, (start_idx, end_idx, timestamp, end_idx - start_idx + 1))
+        """, (start_idx, end_idx, epoch_s, end_idx - start_idx + 1))
     else:
         # Get most recent readings
-        cutoff = (datetime.now(timezone.utc) - timedelta(hours=hours_back)).isoformat()
+        cutoff = int(time.time() - hours_back * 3600)
         cursor = conn.execute("""
             SELECT r.sensor_idx, AVG(r.speed_mph) as avg_speed
             FROM speed_readings r
             JOIN sensors s ON r.sensor_idx = s.idx
+            JOIN scrapes sc ON sc.id = r.scrape_id
             WHERE s.route = ? AND s.direction = ?
             AND r.sensor_idx BETWEEN ? AND ?
-            AND r.timestamp > ?
+            AND sc.epoch_s > ?
             AND r.speed_mph IS NOT NULL
             GROUP BY r.sensor_idx
             ORDER BY r.sensor_idx
@@ -120,7 +170,7 @@ def estimate_travel_time(speeds: list, miles_per_segment: float = MILES_PER_SENS
     return (total_time, avg_speed, min_speed, len(valid_speeds))
 
 
-def analyze_route(conn, route_name: str, segments: list) -> dict:
+def analyze_route(conn, route_name: str, segments: list, storage: str = "rows") -> dict:
     """Analyze a complete route with multiple segments."""
     total_time = 0
     total_segments = 0
@@ -129,7 +179,7 @@ def analyze_route(conn, route_name: str, segments: list) -> dict:
     segment_details = []
 
     for route, direction, start_idx, end_idx in segments:
-        speeds = get_segment_speeds(conn, route, direction, start_idx, end_idx)
+        speeds = get_segment_speeds(conn, route, direction, start_idx, end_idx, storage=storage)
         time_mins, avg_spd, min_spd, count = estimate_travel_time(speeds)
 
         if time_mins:
@@ -156,13 +206,13 @@ def analyze_route(conn, route_name: str, segments: list) -> dict:
     }
 
 
-def current_commute_status(conn, direction: str = "morning"):
+def current_commute_status(conn, direction: str = "morning", storage: str = "rows"):
     """Get current estimated commute times for all routes."""
     routes = ROUTES_MORNING if direction == "morning" else ROUTES_EVENING
 
     results = []
     for route_name, segments in routes.items():
-        result = analyze_route(conn, route_name, segments)
+        result = analyze_route(conn, route_name, segments, storage)
         results.append(result)
 
     # Sort by travel time
@@ -171,48 +221,86 @@ def current_commute_status(conn, direction: str = "morning"):
 
 
 def get_historical_pattern(conn, route: str, direction: str, start_idx: int, end_idx: int,
-                           day_of_week: int = None, hour: int = None, weeks_back: int = 4):
+                           day_of_week: int = None, hour: int = None, weeks_back: int = 4,
+                           storage: str = "rows"):
     """
-    Analyze historical patterns for a route segment.
+    Analyze historical patterns for a route segment from the rollup tables
+    (from the speed matrix with storage="matrix").
     day_of_week: 0=Monday, 1=Tuesday, etc.
-    hour: 0-23
-    """
-    cutoff = (datetime.now(timezone.utc) - timedelta(weeks=weeks_back)).isoformat() + "Z"
-
-    query = """
-        SELECT
-            strftime('%w', timestamp) as dow,
-            strftime('%H', timestamp) as hour,
-            AVG(speed_mph) as avg_speed,
-            MIN(speed_mph) as min_speed,
-            COUNT(*) as readings
-        FROM speed_readings r
-        JOIN sensors s ON r.sensor_idx = s.idx
-        WHERE s.route = ? AND s.direction = ?
-        AND r.sensor_idx BETWEEN ? AND ?
-        AND r.timestamp > ?
-        AND r.speed_mph IS NOT NULL
+    hour: 0-23 local time
+    weeks_back: None reads the all-time profile
+    Returns [(dow, hour, avg_speed, min_speed, readings), ...] with dow as
+    SQLite strftime %w (0=Sunday) and hour zero-padded, like strftime.
     """
-    params = [route, direction, start_idx, end_idx, cutoff]
+    if storage == "matrix":
+        return _matrix_pattern(conn, route, direction, start_idx, end_idx, day_of_week, hour, weeks_back)
+    if weeks_back is None:
+        query = """
+            SELECT CAST(local_dow AS TEXT) AS dow, printf('%02d', local_hour) AS hour,
+                   1.0 * SUM(speed_sum) / SUM(readings), MIN(speed_min), SUM(readings)
+            FROM speed_profile
+            WHERE sensor_idx BETWEEN ? AND ?
+        """
+        params = [start_idx, end_idx]
+    else:
+        query = """
+            SELECT CAST(local_dow AS TEXT) AS dow, printf('%02d', local_hour) AS hour,
+                   1.0 * SUM(speed_sum) / SUM(readings), MIN(speed_min), SUM(readings)
+            FROM speed_rollup_hourly
+            WHERE sensor_idx BETWEEN ? AND ?
+            AND bucket_s > ?
+        """
+        params = [start_idx, end_idx, int(time.time()) - weeks_back * 7 * 86400]
+
+    query += " AND sensor_idx IN (SELECT idx FROM sensors WHERE idx BETWEEN ? AND ? AND route = ? AND direction = ?)"
+    params += [start_idx, end_idx, route, direction]
 
     if day_of_week is not None:
-        # SQLite strftime %w: 0=Sunday, so Monday=1
-        sqlite_dow = (day_of_week + 1) % 7
-        query += " AND strftime('%w', timestamp) = ?"
-        params.append(str(sqlite_dow))
+        # %w: 0=Sunday, so Monday=1
+        query += " AND local_dow = ?"
+        params.append((day_of_week + 1) % 7)
 
     if hour is not None:
-        query += " AND strftime('%H', timestamp) = ?"
-        params.append(f"{hour:02d}")
+        query += " AND local_hour = ?"
+        params.append(hour)
 
-    query += " GROUP BY dow, hour ORDER BY dow, hour"
+    query += " GROUP BY local_dow, local_hour ORDER BY local_dow, local_hour"
 
     cursor = conn.execute(query, params)
     return cursor.fetchall()
 
 
+def _matrix_pattern(conn, route: str, direction: str, start_idx: int, end_idx: int,
+                    day_of_week: int = None, hour: int = None, weeks_back: int = 4) -> list:
+    """get_historical_pattern over the speed matrix rows of the window."""
+    sensors = {idx for (idx,) in conn.execute(
+        "SELECT idx FROM sensors WHERE idx BETWEEN ? AND ? AND route = ? AND direction = ?",
+        (start_idx, end_idx, route, direction))}
+    since = int(time.time()) - weeks_back * 7 * 86400 if weeks_back is not None else None
+    epochs, rows = open_matrix().slice(start_idx, end_idx, since)
+
+    local_hours = {}  # UTC hour -> (dow, hour); offsets are whole hours
+    buckets = {}  # (dow, hour) -> [speed_sum, speed_min, readings]
+    for epoch_s, row in zip(epochs, rows):
+        utc_hour = epoch_s - epoch_s % 3600
+        if utc_hour not in local_hours:
+            local_hours[utc_hour] = local_dow_hour(utc_hour)
+        key = local_hours[utc_hour]
+        if (day_of_week is not None and key[0] != (day_of_week + 1) % 7) or (hour is not None and key[1] != hour):
+            continue
+        speeds = [speed for i, speed in enumerate(bytes(row)) if speed != NULL_SPEED and start_idx + i in sensors]
+        if speeds:
+            bucket = buckets.setdefault(key, [0, speeds[0], 0])
+            bucket[0] += sum(speeds)
+            bucket[1] = min(bucket[1], min(speeds))
+            bucket[2] += len(speeds)
+
+    return [(str(dow), f"{local_hour:02d}", total / readings, low, readings)
+            for (dow, local_hour), (total, low, readings) in sorted(buckets.items())]
+
+
 def analyze_best_departure_times(conn, direction: str = "morning",
-                                  day_of_week: int = None, weeks_back: int = 4):
+                                  day_of_week: int = None, weeks_back: int = 4, storage: str = "rows"):
     """
     Find best departure times based on historical data.
     Returns hourly averages for each route.
@@ -229,7 +317,7 @@ def analyze_best_departure_times(conn, direction: str = "morning",
             for hour in hours:
                 data = get_historical_pattern(conn, route, dir_, start_idx, end_idx,
                                              day_of_week=day_of_week, hour=hour,
-                                             weeks_back=weeks_back)
+                                             weeks_back=weeks_back, storage=storage)
                 if data:
                     avg_speed = sum(d[2] for d in data) / len(data)
                     results[route_name][hour].append(avg_speed)
@@ -253,7 +341,7 @@ def analyze_best_departure_times(conn, direction: str = "morning",
     return summary
 
 
-def print_commute_report(conn):
+def print_commute_report(conn, storage: str = "rows"):
     """Print a comprehensive commute report."""
     print("=" * 70)
     print("COMMUTE REPORT: Culver City <-> Port of Long Beach")
@@ -275,7 +363,7 @@ def print_commute_report(conn):
         direction = "morning"  # Default to morning for off-hours
         print("\n>>> SHOWING MORNING ROUTES (off-peak hours)\n")
 
-    results = current_commute_status(conn, direction)
+    results = current_commute_status(conn, direction, storage)
 
     print("Current Route Estimates (ranked by travel time):\n")
     for i, r in enumerate(results, 1):
@@ -290,7 +378,7 @@ def print_commute_report(conn):
             print(f"       └─ {seg['segment']}: {seg_time} (avg {seg['avg_speed']} mph)")
 
     # Check data availability for historical analysis
-    cursor = conn.execute("SELECT COUNT(DISTINCT date(timestamp)) FROM speed_readings")
+    cursor = conn.execute("SELECT COUNT(DISTINCT date(epoch_s, 'unixepoch')) FROM scrapes")
     days_of_data = cursor.fetchone()[0]
 
     print(f"\n{'=' * 70}")
@@ -308,15 +396,19 @@ def main():
     import sys
 
     conn = get_connection()
+    storage = sys.argv[sys.argv.index("--storage") + 1] if "--storage" in sys.argv else "rows"
 
     if "--analyze" in sys.argv:
         # Detailed historical analysis
         print("Historical pattern analysis (requires sufficient data)...")
+        pending = pending_scrapes(conn, int(time.time()) - PENDING_AGE)
+        if pending:
+            print(f"  {pending:,} older scrapes aren't in the rollups yet; run `python rollups.py --fold`")
         for dow, day_name in [(0, "Monday"), (1, "Tuesday"), (2, "Wednesday")]:
             print(f"\n{day_name}:")
             for direction in ["morning", "evening"]:
                 print(f"  {direction.title()} commute:")
-                summary = analyze_best_departure_times(conn, direction, day_of_week=dow)
+                summary = analyze_best_departure_times(conn, direction, day_of_week=dow, storage=storage)
                 for route, hours in summary.items():
                     if hours:
                         best_hour = min(hours.items(), key=lambda x: x[1].get("est_time_mins", 999))
@@ -324,12 +416,12 @@ def main():
     elif "--json" in sys.argv:
         import json
         results = {
-            "morning": current_commute_status(conn, "morning"),
-            "evening": current_commute_status(conn, "evening"),
+            "morning": current_commute_status(conn, "morning", storage),
+            "evening": current_commute_status(conn, "evening", storage),
         }
         print(json.dumps(results, indent=2))
     else:
-        print_commute_report(conn)
+        print_commute_report(conn, storage)
 
     conn.close()
 
@@ -12,42 +12,47 @@ Run as a background service or cron job.
 
 import sqlite3
 import time
-import requests
 import argparse
-from datetime import datetime, timezone
+from datetime import datetime, time as dtime, timedelta
 from pathlib import Path
 import sys
 
 # Import from main scraper
 sys.path.insert(0, str(Path(__file__).parent))
 from scraper import (
-    STATIC_URL, DATA_URL, HEADERS, DB_PATH,
+    STATIC_URL, DATA_URL, HEADERS, DB_PATH, STORAGE_MODES, READINGS_LAYOUTS,
     init_db, load_static_data, populate_sensors, fetch_live_data,
-    record_speeds, record_incidents
+    store_snapshot, open_shard_writer, SnapshotWriter, poll_feed
 )
+import metrics
+from rollups import LOCAL_TZ
+from scheduler import FeedScheduler
+from shards import ShardWriter, GRANULARITIES
+from http_client import RequestError
 
 # Scrape intervals
 PEAK_INTERVAL = 120      # 2 minutes during commute hours
 OFF_PEAK_INTERVAL = 900  # 15 minutes during off-peak
 
-# Commute windows (PST hours, will convert to UTC internally)
-MORNING_WINDOW = (5, 10)   # 5 AM - 10 AM PST
-EVENING_WINDOW = (15, 20)  # 3 PM - 8 PM PST
+# Commute windows (Pacific local hours, DST-aware)
+MORNING_WINDOW = (5, 10)   # 5 AM - 10 AM
+EVENING_WINDOW = (15, 20)  # 3 PM - 8 PM
 
 # Commute days (0=Monday, 1=Tuesday, 2=Wednesday)
 COMMUTE_DAYS = {0, 1, 2}
 
 
 def get_pst_hour() -> tuple[int, int]:
-    """Get current hour and day of week in PST."""
-    utc_now = datetime.now(timezone.utc)
-    # PST = UTC - 8 (simplified, ignoring DST for now)
-    pst_hour = (utc_now.hour - 8) % 24
-    # Adjust day of week if we crossed midnight
-    pst_day = utc_now.weekday()
-    if utc_now.hour < 8:
-        pst_day = (pst_day - 1) % 7
-    return pst_hour, pst_day
+    """Get current hour and day of week in Pacific time (PST/PDT)."""
+    now = datetime.now(LOCAL_TZ)
+    return now.hour, now.weekday()
+
+
+def seconds_until_midnight() -> float:
+    """Seconds until the next Pacific-time midnight."""
+    now = datetime.now(LOCAL_TZ)
+    midnight = datetime.combine(now.date() + timedelta(days=1), dtime(0), tzinfo=LOCAL_TZ)
+    return midnight.timestamp() - time.time()
 
 
 def is_commute_window() -> tuple[bool, str]:
@@ -65,40 +70,60 @@ def is_commute_window() -> tuple[bool, str]:
         return False, "off-peak"
 
 
-def scrape_with_timing(conn: sqlite3.Connection) -> dict:
-    """Perform scrape and return results with timing info."""
-    timestamp = datetime.now(timezone.utc).isoformat()
-
+def fetch_with_timing() -> tuple:
+    """Fetch the live feed. Returns (epoch_s, data or None if unchanged, fetch_time_ms)."""
+    epoch_s = int(time.time())
     start = time.time()
-    data = fetch_live_data()
-    fetch_time = time.time() - start
-
-    total, valid = record_speeds(conn, data, timestamp)
-    incident_count = record_incidents(conn, data, timestamp)
+    data = fetch_live_data(skip_unchanged=True)
+    return epoch_s, data, int((time.time() - start) * 1000)
 
-    return {
-        "timestamp": timestamp,
-        "total_sensors": total,
-        "valid_readings": valid,
-        "incidents": incident_count,
-        "fetch_time_ms": int(fetch_time * 1000),
-    }
 
-
-def run_scraper(all_days: bool = False, verbose: bool = True):
+def scrape_with_timing(conn: sqlite3.Connection, storage: str = "rows", shards: ShardWriter = None) -> dict:
+    """Perform scrape and return results with timing info."""
+    epoch_s, data, fetch_time_ms = fetch_with_timing()
+    result = store_snapshot(conn, data, epoch_s, "commute_scraper", storage, shards)
+    return {**result, "fetch_time_ms": fetch_time_ms}
+
+
+def report_result(result: dict, verbose: bool = True):
+    """Log a stored scrape (changed ones always during peak windows)."""
+    if result.get("unchanged"):
+        if verbose:
+            print(f"[{result['timestamp'][11:19]}] ⚪ Feed unchanged, heartbeat only "
+                  f"({result['fetch_time_ms']}ms)")
+    elif verbose or result.get("is_peak"):
+        status = "🟢" if result["valid_readings"] > 6000 else "🟡"
+        print(f"[{result['timestamp'][11:19]}] {status} "
+              f"{result['valid_readings']}/{result['total_sensors']} speeds, "
+              f"{result['incidents']} incidents "
+              f"({result['fetch_time_ms']}ms)")
+
+
+def run_scraper(all_days: bool = False, verbose: bool = True, storage: str = "rows",
+                shard_granularity: str = None, layout: str = None, metrics_port: int = None):
     """Main scraper loop with adaptive timing."""
     print("Commute-Focused Traffic Scraper")
     print(f"Database: {DB_PATH}")
     print(f"Mode: {'All days' if all_days else 'Mon-Wed only'}")
     print(f"Peak interval: {PEAK_INTERVAL}s, Off-peak: {OFF_PEAK_INTERVAL}s")
+    print(f"Storage: {storage}")
+    print(f"Shards: {shard_granularity or 'off'}")
+    if metrics_port:
+        metrics.start_server(metrics_port)
     print()
 
     conn = sqlite3.connect(DB_PATH)
-    init_db(conn)
+    init_db(conn, layout)
 
     # Load static data
     static = load_static_data()
     populate_sensors(conn, static)
+    conn.close()
+
+    # Fetch on this thread, store on the writer thread
+    writer = SnapshotWriter("commute_scraper", storage, shard_granularity, layout,
+                            report=lambda result: report_result(result, verbose))
+    scheduler = FeedScheduler(PEAK_INTERVAL)
 
     print("\nStarting adaptive scrape loop (Ctrl+C to stop)...\n")
 
@@ -115,8 +140,7 @@ def run_scraper(all_days: bool = False, verbose: bool = True):
                 if window != last_window:
                     print(f"[{day_names[day]}] Non-commute day, sleeping until midnight...")
                     last_window = window
-                # Sleep until next day (roughly)
-                time.sleep(3600)  # Check every hour
+                time.sleep(seconds_until_midnight() + 1)
                 continue
 
             # Determine interval
@@ -129,24 +153,19 @@ def run_scraper(all_days: bool = False, verbose: bool = True):
                 last_window = window
 
             try:
-                result = scrape_with_timing(conn)
-                if verbose or is_peak:
-                    status = "🟢" if result["valid_readings"] > 6000 else "🟡"
-                    print(f"[{result['timestamp'][11:19]}] {status} "
-                          f"{result['valid_readings']}/{result['total_sensors']} speeds, "
-                          f"{result['incidents']} incidents "
-                          f"({result['fetch_time_ms']}ms)")
-            except requests.RequestException as e:
+                poll_feed(scheduler, writer, is_peak=is_peak)
+            except RequestError as e:
                 print(f"[ERROR] Request failed: {e}")
             except Exception as e:
                 print(f"[ERROR] {type(e).__name__}: {e}")
 
-            time.sleep(interval)
+            # Next wall-clock tick of this window's interval, just after a feed refresh
+            scheduler.sleep_until_next_poll(interval)
 
     except KeyboardInterrupt:
         print("\nStopping...")
     finally:
-        conn.close()
+        writer.close()
 
 
 def main():
@@ -157,19 +176,32 @@ def main():
                        help="Only log during peak hours")
     parser.add_argument("--once", action="store_true",
                        help="Scrape once and exit")
+    # The matrix holds one row per scrape time from one collector: scraper.py --storage matrix
+    parser.add_argument("--storage", choices=[mode for mode in STORAGE_MODES if mode != "matrix"], default="rows",
+                       help="Speed storage mode (default: rows; matrix storage is scraper.py only)")
+    parser.add_argument("--shards", choices=GRANULARITIES,
+                       help="Write speed data to per-month or per-day shard files")
+    parser.add_argument("--layout", choices=READINGS_LAYOUTS,
+                       help="speed_readings layout; migrates an existing table (default: keep)")
+    parser.add_argument("--metrics-port", type=int,
+                       help="Serve Prometheus metrics (see metrics.py) on this local port")
 
     args = parser.parse_args()
 
     if args.once:
         conn = sqlite3.connect(DB_PATH)
-        init_db(conn)
+        init_db(conn, args.layout)
         static = load_static_data()
         populate_sensors(conn, static)
-        result = scrape_with_timing(conn)
+        shards = open_shard_writer(conn, args.shards, args.layout)
+        result = scrape_with_timing(conn, args.storage, shards)
         print(f"Scraped: {result}")
+        if shards:
+            shards.close()
         conn.close()
     else:
-        run_scraper(all_days=args.all_days, verbose=not args.quiet)
+        run_scraper(all_days=args.all_days, verbose=not args.quiet, storage=args.storage,
+                    shard_granularity=args.shards, layout=args.layout, metrics_port=args.metrics_port)
 
 
 if __name__ == "__main__":
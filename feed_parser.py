@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Partial Live Feed Parser
+
+SoCalData.json is mostly the cameras array, which nothing here stores.
+Instead of json.loads on the whole payload, the wanted top-level members
+are located with a regex and only they are decoded:
+- cameras (and any other member) are never decoded, so no Python objects
+  are built for them
+- speeds are compacted into (speed, None, incident_refs) tuples; entries
+  without incident refs (nearly all) share one empty tuple, and camera ids
+  are dropped
+- the change-detection digest is taken over the raw bytes of the members,
+  so nothing is re-encoded to compare feeds
+
+    data, digest = parse_live_feed(resp.data)
+
+Speed tuples index like the feed's lists (entry[0] speed, entry[2] refs)
+and serialize to the same JSON. The feed's members are arrays of arrays,
+so a member name can't appear as a key anywhere but the top level.
+"""
+
+import hashlib
+import json
+import re
+
+LIVE_FIELDS = ("speeds", "incidents")
+
+_MEMBER = re.compile(r'[{,]\s*"(\w+)"\s*:\s*')
+_decoder = json.JSONDecoder()
+_NO_REFS = ()
+
+
+def compact_speeds(speeds: list) -> list:
+    """Live-feed speed entries as (speed, None, refs) tuples."""
+    return [(entry[0], None, entry[2] if len(entry) > 2 and entry[2] else _NO_REFS) for entry in speeds]
+
+
+def parse_live_feed(body: bytes, fields: tuple = LIVE_FIELDS) -> tuple:
+    """
+    Decode only the wanted top-level members of a live feed payload.
+    Returns (data, digest): data has a key per member found, digest is a
+    SHA-256 of their raw text.
+    """
+    text = body.decode("utf-8") if isinstance(body, (bytes, bytearray)) else body
+    data = {}
+    h = hashlib.sha256()
+    pos = 0
+    while len(data) < len(fields):
+        match = _MEMBER.search(text, pos)
+        if match is None:
+            break
+        name = match.group(1)
+        if name not in fields or name in data:
+            pos = match.end()
+            continue
+        value, pos = _decoder.raw_decode(text, match.end())
+        data[name] = compact_speeds(value) if name == "speeds" else value
+        h.update(f"{name}\0{text[match.end():pos]}\0".encode("utf-8"))
+    return data, h.hexdigest()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Shared HTTP Client
+
+One process-wide urllib3 PoolManager used by every fetcher, so repeated
+requests to the same host (Waze tiles, the CHP GET + POST, Sigalert every
+cycle) reuse kept-alive TLS connections instead of handshaking each time.
+
+- At most POOL_MAXSIZE connections per host (set_pool_maxsize changes it);
+  extra concurrent requests wait for a free connection instead of opening more
+- gzip/deflate always negotiated, brotli/zstd when the brotli/zstandard
+  packages are installed; responses are decoded transparently
+- Thread-safe, so concurrent fetchers can share it
+- With TRAFFIC_UPSTREAM set (e.g. http://127.0.0.1:8800), every request is
+  sent there instead, as {TRAFFIC_UPSTREAM}/{original host}/{path}; used to
+  point the collectors at bench/replay_server.py
+
+Requires urllib3 (installed with requests or boto3).
+"""
+
+import json
+import os
+import urllib.parse
+
+import urllib3
+
+POOL_MAXSIZE = 4  # Connections kept (and allowed at once) per host
+NUM_POOLS = 16    # Hosts kept in the pool manager
+DEFAULT_TIMEOUT = 30
+
+# Base URL that stands in for every upstream host (load tests), or None
+UPSTREAM = os.environ.get("TRAFFIC_UPSTREAM")
+
+# Base class of every error raised by this module
+RequestError = urllib3.exceptions.HTTPError
+
+ACCEPT_ENCODING = urllib3.util.make_headers(accept_encoding=True)["accept-encoding"]
+
+_pool = None
+_maxsize = POOL_MAXSIZE
+
+
+class HTTPStatusError(RequestError):
+    """Non-success HTTP status."""
+
+    def __init__(self, status: int, url: str):
+        super().__init__(f"HTTP {status} for {url}")
+        self.status = status
+        self.url = url
+
+
+def set_pool_maxsize(maxsize: int):
+    """
+    Allow maxsize connections per host instead of POOL_MAXSIZE (for a
+    process that deliberately runs many requests to one host at once, like
+    build.py's stream checks). Takes effect on the next get_pool.
+    """
+    global _pool, _maxsize
+    _maxsize = maxsize
+    if _pool is not None:
+        _pool.clear()
+        _pool = None
+
+
+def get_pool() -> urllib3.PoolManager:
+    """Return the shared pool manager, creating it on first use."""
+    global _pool
+    if _pool is None:
+        _pool = urllib3.PoolManager(
+            num_pools=NUM_POOLS,
+            maxsize=_maxsize,
+            block=True,
+            retries=urllib3.Retry(total=2, connect=2, read=0, status=0, redirect=5, backoff_factor=0.2),
+        )
+    return _pool
+
+
+def upstream_url(url: str) -> str:
+    """url as sent: rewritten onto UPSTREAM when it is set."""
+    if not UPSTREAM:
+        return url
+    parts = urllib.parse.urlsplit(url)
+    rewritten = f"{UPSTREAM.rstrip('/')}/{parts.netloc}{parts.path}"
+    return f"{rewritten}?{parts.query}" if parts.query else rewritten
+
+
+def request(method: str, url: str, headers: dict = None, timeout: float = DEFAULT_TIMEOUT,
+            ok=(304,), **kwargs) -> urllib3.BaseHTTPResponse:
+    """
+    Send a request on the shared pool and return the fully read response.
+    Raises HTTPStatusError for any status that is neither 2xx nor in ok.
+    """
+    merged = {"Accept-Encoding": ACCEPT_ENCODING}
+    merged.update(headers or {})
+    resp = get_pool().request(method, upstream_url(url), headers=merged, timeout=timeout, **kwargs)
+    if not (200 <= resp.status < 300 or resp.status in ok):
+        raise HTTPStatusError(resp.status, url)
+    return resp
+
+
+def get(url: str, headers: dict = None, timeout: float = DEFAULT_TIMEOUT, **kwargs) -> urllib3.BaseHTTPResponse:
+    """GET url (a 304 is returned, not raised)."""
+    return request("GET", url, headers, timeout, **kwargs)
+
+
+def get_json(url: str, headers: dict = None, timeout: float = DEFAULT_TIMEOUT, **kwargs):
+    """GET url and parse the body as JSON."""
+    return json.loads(get(url, headers, timeout, **kwargs).data)
+
+
+def get_text(url: str, headers: dict = None, timeout: float = DEFAULT_TIMEOUT, **kwargs) -> str:
+    """GET url and decode the body as UTF-8."""
+    return get(url, headers, timeout, **kwargs).data.decode("utf-8", errors="replace")
+
+
+def post_form(url: str, fields: dict, headers: dict = None, timeout: float = DEFAULT_TIMEOUT) -> str:
+    """POST urlencoded form fields and return the body as text."""
+    resp = request("POST", url, headers, timeout, fields=fields, encode_multipart=False)
+    return resp.data.decode("utf-8", errors="replace")
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Collector Metrics
+
+Counters, gauges and histograms for the long-running scrapers, served in
+the Prometheus text format on a local HTTP port:
+
+    python scraper.py --metrics-port 9108
+    curl localhost:9108/metrics
+
+Ingest metrics are labelled by region:
+- traffic_fetch_seconds, traffic_parse_seconds: live feed request and decode time
+- traffic_insert_seconds, traffic_commit_seconds: writing one payload, committing a group
+- traffic_payload_bytes: decoded live feed size
+- traffic_data_age_seconds: poll time minus the feed's Last-Modified
+- traffic_valid_ratio, traffic_incidents: share of sensors with a speed / incidents in the last scrape
+- traffic_last_scrape_timestamp_seconds: epoch of the last committed scrape
+- traffic_db_size_bytes{file="main"|"shards"}, traffic_write_queue_depth
+- traffic_errors_total{stage, error}: fetch, write, rollups and retention failures
+
+Standard library only; metrics are thread-safe.
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BYTES_BUCKETS = (16384, 65536, 131072, 262144, 524288, 1048576, 2097152, 4194304)
+AGE_BUCKETS = (5, 10, 15, 30, 60, 120, 300, 600, 1800)
+
+_registry = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(labels: tuple, extra: str = "") -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.values = {}  # Sorted label tuple -> value
+        self.lock = threading.Lock()
+        _registry.append(self)
+
+    def samples(self):
+        """(suffix, labels, extra_label, value) tuples for rendering."""
+        with self.lock:
+            return [("", labels, "", value) for labels, value in self.values.items()]
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_label_text(labels, extra)} {_number(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text)
+        self.functions = {}
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+    def set_function(self, fn, **labels):
+        """Report fn() at each scrape of the endpoint."""
+        with self.lock:
+            self.functions[tuple(sorted(labels.items()))] = fn
+
+    def samples(self):
+        samples = super().samples()
+        with self.lock:
+            functions = list(self.functions.items())
+        for labels, fn in functions:
+            try:
+                samples.append(("", labels, "", fn()))
+            except Exception:
+                pass  # e.g. a database file that doesn't exist yet
+        return samples
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += 1
+            state[2] += value
+
+    def samples(self):
+        with self.lock:
+            values = [(labels, list(counts), count, total) for labels, (counts, count, total) in self.values.items()]
+        samples = []
+        for labels, counts, count, total in values:
+            for bound, n in zip(self.buckets, counts):
+                samples.append(("_bucket", labels, f'le="{_number(bound)}"', n))
+            samples.append(("_bucket", labels, 'le="+Inf"', count))
+            samples.append(("_sum", labels, "", total))
+            samples.append(("_count", labels, "", count))
+        return samples
+
+
+FETCH_SECONDS = Histogram("traffic_fetch_seconds", "Live feed HTTP request time")
+PARSE_SECONDS = Histogram("traffic_parse_seconds", "Live feed decode time")
+INSERT_SECONDS = Histogram("traffic_insert_seconds", "Time to write one payload (before commit)")
+COMMIT_SECONDS = Histogram("traffic_commit_seconds", "Time to commit one write group")
+PAYLOAD_BYTES = Histogram("traffic_payload_bytes", "Decoded live feed size", BYTES_BUCKETS)
+DATA_AGE = Histogram("traffic_data_age_seconds", "Poll time minus the feed's Last-Modified", AGE_BUCKETS)
+VALID_RATIO = Gauge("traffic_valid_ratio", "Share of sensors with a speed in the last stored scrape")
+INCIDENTS = Gauge("traffic_incidents", "Incidents in the last stored scrape")
+LAST_SCRAPE = Gauge("traffic_last_scrape_timestamp_seconds", "Epoch of the last committed scrape")
+DB_SIZE = Gauge("traffic_db_size_bytes", "Database size on disk (main file + WAL, or all shards)")
+QUEUE_DEPTH = Gauge("traffic_write_queue_depth", "Payloads waiting for the writer")
+ERRORS = Counter("traffic_errors_total", "Failures by stage (fetch, write, rollups, retention) and exception type")
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep scrapes of the endpoint out of the collector log
+
+
+def start_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve /metrics on host:port from a daemon thread."""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Metrics: http://{host}:{port}/metrics")
+    return server
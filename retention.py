@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Retention and Downsampling
+
+Keeps the database at a stable size by expiring data per resolution:
+- raw:    speed_readings / speed_snapshots / snapshot_incident_refs / speed_deltas
+- 15m:    speed_rollup_15m
+- hourly: speed_rollup_hourly
+Rolled-up scrapes with no raw data left and heartbeats expire with the raw data.
+Default policy: raw 14 days, 15-minute rollups 1 year, hourly forever.
+The all-time speed_profile is never expired.
+
+Each run first folds raw scrapes older than rollups.PENDING_AGE that aren't
+in the rollups yet (scrapes.rolled_up = 0, e.g. data collected before
+rollups existed) in the main database and every shard; only rolled-up
+scrapes are deleted.
+All work happens in small transactions so a running scraper is never
+blocked for long, and freed pages are returned to the filesystem with
+incremental vacuum. Shards that end up empty are deleted.
+
+Run as a maintenance command:
+    python retention.py
+    python retention.py --raw-days 30 --rollup-15m-days 0   # keep 15-min forever
+or on its own thread inside the collector with `scraper.py --retention`.
+"""
+
+import argparse
+import sqlite3
+import time
+from pathlib import Path
+
+from rollups import PENDING_AGE, fold_all_pending
+from shards import SHARD_DIR, overlapping_shards, shard_key
+
+DB_PATH = Path(__file__).parent / "traffic.db"
+
+# Days kept per resolution (None = forever)
+DEFAULT_POLICY = {"raw": 14, "15m": 365, "hourly": None}
+
+BATCH_SCRAPES = 24    # Scrapes deleted per transaction (~150k readings)
+BATCH_SENSORS = 500   # Sensors per rollup expiry transaction
+BATCH_EMPTY = 500     # Scrape rows without raw data deleted per transaction
+VACUUM_PAGES = 2048   # Pages released per incremental vacuum step
+
+RAW_TABLES = ("speed_snapshots", "snapshot_incident_refs", "speed_deltas")
+
+
+def _out_of_time(deadline: float) -> bool:
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def expire_raw(conn: sqlite3.Connection, cutoff: int, schema: str = "main",
+               deadline: float = None) -> tuple:
+    """
+    Delete rolled-up raw data in schema older than cutoff.
+    Keyframes and deltas still needed by newer deltas are kept. Returns (rows, finished).
+    """
+    readings_ids = [sid for (sid,) in conn.execute(f"""
+        SELECT sc.id FROM scrapes sc
+        WHERE sc.epoch_s < ? AND sc.rolled_up = 1
+        AND EXISTS (SELECT 1 FROM {schema}.speed_readings r WHERE r.scrape_id = sc.id)
+        ORDER BY sc.id
+    """, (cutoff,))]
+
+    # Delta chains with any delta still inside the window are kept whole
+    snapshot_ids = [sid for (sid,) in conn.execute(f"""
+        WITH live_chains AS (
+            SELECT d.keyframe_id FROM {schema}.speed_deltas d
+            JOIN scrapes sc ON sc.id = d.scrape_id WHERE sc.epoch_s >= ?
+        )
+        SELECT sc.id FROM scrapes sc
+        WHERE sc.epoch_s < ? AND sc.rolled_up = 1
+        AND (EXISTS (SELECT 1 FROM {schema}.speed_snapshots s
+                     WHERE s.scrape_id = sc.id AND s.scrape_id NOT IN live_chains)
+             OR EXISTS (SELECT 1 FROM {schema}.speed_deltas d
+                        WHERE d.scrape_id = sc.id AND d.keyframe_id NOT IN live_chains))
+        ORDER BY sc.id
+    """, (cutoff, cutoff))]
+
+    rows = 0
+    for tables, ids in ((("speed_readings",), readings_ids), (RAW_TABLES, snapshot_ids)):
+        for start in range(0, len(ids), BATCH_SCRAPES):
+            chunk = ids[start:start + BATCH_SCRAPES]
+            marks = ",".join("?" * len(chunk))
+            for table in tables:
+                rows += conn.execute(f"DELETE FROM {schema}.{table} WHERE scrape_id IN ({marks})",
+                                     chunk).rowcount
+            conn.commit()
+            if _out_of_time(deadline):
+                return rows, False
+    return rows, True
+
+
+def referenced_scrapes(conn: sqlite3.Connection, cutoff: int, schema: str = "main") -> set:
+    """Ids of scrapes older than cutoff that still have raw data in schema."""
+    return {sid for (sid,) in conn.execute(f"""
+        SELECT sc.id FROM scrapes sc WHERE sc.epoch_s < ? AND ({" OR ".join(
+            f"EXISTS (SELECT 1 FROM {schema}.{table} t WHERE t.scrape_id = sc.id)"
+            for table in ("speed_readings",) + RAW_TABLES)})
+    """, (cutoff,))}
+
+
+def expire_scrapes(conn: sqlite3.Connection, cutoff: int, referenced: set, deadline: float = None) -> tuple:
+    """
+    Delete rolled-up scrapes older than cutoff whose raw data is gone
+    (referenced: ids with raw data left in the main database or any shard).
+    Returns (rows, finished).
+    """
+    ids = [sid for (sid,) in conn.execute(
+        "SELECT id FROM scrapes WHERE epoch_s < ? AND rolled_up = 1 ORDER BY id", (cutoff,))
+        if sid not in referenced]
+    rows = 0
+    for start in range(0, len(ids), BATCH_EMPTY):
+        chunk = ids[start:start + BATCH_EMPTY]
+        rows += conn.execute(f"DELETE FROM scrapes WHERE id IN ({','.join('?' * len(chunk))})", chunk).rowcount
+        conn.commit()
+        if _out_of_time(deadline):
+            return rows, False
+    return rows, True
+
+
+def expire_rollup(conn: sqlite3.Connection, table: str, cutoff: int, deadline: float = None) -> tuple:
+    """Delete rollup buckets older than cutoff, a range of sensors per transaction."""
+    max_idx = conn.execute(f"SELECT MAX(sensor_idx) FROM {table}").fetchone()[0]
+    rows = 0
+    if max_idx is None:
+        return rows, True
+    for start in range(0, max_idx + 1, BATCH_SENSORS):
+        for sensor_idx in range(start, min(start + BATCH_SENSORS, max_idx + 1)):
+            rows += conn.execute(f"DELETE FROM {table} WHERE sensor_idx = ? AND bucket_s < ?",
+                                 (sensor_idx, cutoff)).rowcount
+        conn.commit()
+        if _out_of_time(deadline):
+            return rows, False
+    return rows, True
+
+
+def incremental_vacuum(conn: sqlite3.Connection, schema: str = "main", deadline: float = None) -> int:
+    """Release free pages in steps of VACUUM_PAGES. Returns pages released."""
+    if conn.execute(f"PRAGMA {schema}.auto_vacuum").fetchone()[0] != 2:
+        return 0
+    released = 0
+    while True:
+        free = conn.execute(f"PRAGMA {schema}.freelist_count").fetchone()[0]
+        if not free or _out_of_time(deadline):
+            return released
+        conn.execute(f"PRAGMA {schema}.incremental_vacuum({VACUUM_PAGES})").fetchall()
+        released += free - conn.execute(f"PRAGMA {schema}.freelist_count").fetchone()[0]
+
+
+def _is_empty(conn: sqlite3.Connection, schema: str) -> bool:
+    return not any(
+        conn.execute(f"SELECT 1 FROM {schema}.{table} LIMIT 1").fetchone()
+        for table in ("speed_readings",) + RAW_TABLES
+    )
+
+
+def apply_retention(conn: sqlite3.Connection, policy: dict = None, now: int = None,
+                    budget_s: float = None, shard_dir: Path = SHARD_DIR) -> dict:
+    """
+    Apply a retention policy to the main database and its shards.
+    With budget_s, stops starting new batches after that many seconds;
+    the next run picks up where this one left off.
+    Returns counts plus "finished" (False if the budget ran out).
+    """
+    policy = {**DEFAULT_POLICY, **(policy or {})}
+    now = now if now is not None else int(time.time())
+    deadline = time.monotonic() + budget_s if budget_s is not None else None
+    stats = {"folded": 0, "raw_rows": 0, "scrapes": 0, "heartbeats": 0, "rollup_rows": 0, "pages": 0,
+             "shards_removed": 0, "finished": True}
+
+    def done(finished: bool) -> bool:
+        stats["finished"] = stats["finished"] and finished
+        return finished
+
+    folded, finished = fold_all_pending(conn, now - PENDING_AGE, shard_dir, deadline)
+    stats["folded"] += folded
+    done(finished)
+
+    if policy["raw"] is not None:
+        cutoff = now - policy["raw"] * 86400
+        schemas = [("main", None)] + [
+            (f"retain{i}", path) for i, (key, path) in enumerate(overlapping_shards(until=cutoff, shard_dir=shard_dir))
+        ]
+        referenced = set()
+        for schema, path in schemas:
+            if _out_of_time(deadline):
+                done(False)
+                break
+            if path is not None:
+                conn.execute(f"ATTACH DATABASE ? AS {schema}", (str(path),))
+            try:
+                rows, finished = expire_raw(conn, cutoff, schema, deadline)
+                stats["raw_rows"] += rows
+                done(finished)
+                referenced |= referenced_scrapes(conn, cutoff, schema)
+                stats["pages"] += incremental_vacuum(conn, schema, deadline)
+                empty = path is not None and _is_empty(conn, schema)
+            finally:
+                if path is not None:
+                    conn.execute(f"DETACH DATABASE {schema}")
+
+            # A shard whose whole period is past the cutoff won't be written again
+            key = path and path.stem.removeprefix("traffic-")
+            if empty and key < shard_key(cutoff, "day")[:len(key)]:
+                path.unlink()
+                stats["shards_removed"] += 1
+        else:
+            # Every schema has been checked for raw data still using old scrapes
+            rows, finished = expire_scrapes(conn, cutoff, referenced, deadline)
+            stats["scrapes"] += rows
+            done(finished)
+            stats["heartbeats"] += conn.execute("DELETE FROM heartbeats WHERE epoch_s < ?", (cutoff,)).rowcount
+            conn.commit()
+
+    for resolution, table in (("15m", "speed_rollup_15m"), ("hourly", "speed_rollup_hourly")):
+        if policy[resolution] is not None and not _out_of_time(deadline):
+            rows, finished = expire_rollup(conn, table, now - policy[resolution] * 86400, deadline)
+            stats["rollup_rows"] += rows
+            done(finished)
+    if policy["15m"] is not None or policy["hourly"] is not None:
+        stats["pages"] += incremental_vacuum(conn, "main", deadline)
+
+    if _out_of_time(deadline):
+        done(False)
+    return stats
+
+
+def enable_incremental_vacuum(conn: sqlite3.Connection):
+    """Switch an existing database to incremental auto-vacuum (rewrites the file once)."""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+
+
+def _days(value: str):
+    """argparse type: days, 0 = keep forever."""
+    days = int(value)
+    return days if days > 0 else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Expire old speed data and reclaim disk space")
+    parser.add_argument("--raw-days", type=_days, default=DEFAULT_POLICY["raw"],
+                        help="Days of full-resolution data to keep (0 = forever)")
+    parser.add_argument("--rollup-15m-days", type=_days, default=DEFAULT_POLICY["15m"],
+                        help="Days of 15-minute rollups to keep (0 = forever)")
+    parser.add_argument("--rollup-hourly-days", type=_days, default=DEFAULT_POLICY["hourly"],
+                        help="Days of hourly rollups to keep (default: forever)")
+    parser.add_argument("--budget", type=float, help="Stop after this many seconds (resume on next run)")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="Convert the main database and shards to incremental vacuum (one full VACUUM each)")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    if args.enable_incremental_vacuum:
+        print("Enabling incremental vacuum...")
+        enable_incremental_vacuum(conn)
+        for key, path in overlapping_shards():
+            shard = sqlite3.connect(path, timeout=30)
+            enable_incremental_vacuum(shard)
+            shard.close()
+
+    policy = {"raw": args.raw_days, "15m": args.rollup_15m_days, "hourly": args.rollup_hourly_days}
+    print(f"Database: {DB_PATH}")
+    print("Policy: " + ", ".join(f"{k} {v or 'forever'}{' days' if v else ''}" for k, v in policy.items()))
+    before = DB_PATH.stat().st_size
+    stats = apply_retention(conn, policy, budget_s=args.budget)
+    conn.close()
+
+    print(f"  Folded {stats['folded']:,} scrapes into rollups")
+    print(f"  Deleted {stats['raw_rows']:,} raw rows, {stats['rollup_rows']:,} rollup rows, "
+          f"{stats['scrapes']:,} empty scrapes, {stats['heartbeats']:,} heartbeats")
+    print(f"  Released {stats['pages']:,} pages, removed {stats['shards_removed']} empty shards")
+    print(f"  Main database: {before:,} -> {DB_PATH.stat().st_size:,} bytes")
+    if not stats["finished"]:
+        print("  Budget exhausted; run again to continue")
+
+
+if __name__ == "__main__":
+    main()
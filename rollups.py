@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+Incremental Speed Rollups
+
+Per-sensor aggregates (readings, sum, min, max) maintained at ingest time so
+historical queries never scan raw readings:
+- speed_rollup_15m:    15-minute UTC buckets
+- speed_rollup_hourly: hourly UTC buckets, tagged with local day-of-week/hour
+- speed_profile:       all-time local day-of-week x hour profile
+
+Rollups live in the main database (also when speed data is sharded).
+Day-of-week follows SQLite strftime('%w'): 0 = Sunday.
+
+The collectors and download_data.py keep the scrapes of the current hour
+in a RollupBuffer and write them with one upsert per sensor and bucket
+when the hour is over, instead of three upserts per sensor per scrape.
+A scrape is marked rolled up (scrapes.rolled_up = 1) in the transaction
+that folds it, and folding claims the mark first, so a scrape is never
+counted twice. Scrapes that were never folded (a database from before
+rollups, or a buffer lost in a crash) are folded from raw storage by
+fold_pending, which retention.py runs on each pass.
+
+Fold pending scrapes, or rebuild everything, from stored rows/packed/delta
+speed data:
+    python rollups.py --fold
+    python rollups.py --rebuild
+"""
+
+import argparse
+import sqlite3
+import time
+from datetime import datetime
+from itertools import zip_longest
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+from shards import SHARD_DIR, iter_routers, overlapping_shards
+from snapshots import NULL_SPEED, apply_changes
+
+DB_PATH = Path(__file__).parent / "traffic.db"
+LOCAL_TZ = ZoneInfo("America/Los_Angeles")
+PENDING_AGE = 7200  # Younger unfolded scrapes may still be in a collector's RollupBuffer
+
+ROLLUP_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS speed_rollup_15m (
+        sensor_idx INTEGER NOT NULL,
+        bucket_s INTEGER NOT NULL,
+        readings INTEGER NOT NULL,
+        speed_sum INTEGER NOT NULL,
+        speed_min INTEGER NOT NULL,
+        speed_max INTEGER NOT NULL,
+        PRIMARY KEY (sensor_idx, bucket_s)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS speed_rollup_hourly (
+        sensor_idx INTEGER NOT NULL,
+        bucket_s INTEGER NOT NULL,
+        local_dow INTEGER NOT NULL,
+        local_hour INTEGER NOT NULL,
+        readings INTEGER NOT NULL,
+        speed_sum INTEGER NOT NULL,
+        speed_min INTEGER NOT NULL,
+        speed_max INTEGER NOT NULL,
+        PRIMARY KEY (sensor_idx, bucket_s)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS speed_profile (
+        sensor_idx INTEGER NOT NULL,
+        local_dow INTEGER NOT NULL,
+        local_hour INTEGER NOT NULL,
+        readings INTEGER NOT NULL,
+        speed_sum INTEGER NOT NULL,
+        speed_min INTEGER NOT NULL,
+        speed_max INTEGER NOT NULL,
+        PRIMARY KEY (sensor_idx, local_dow, local_hour)
+    ) WITHOUT ROWID;
+
+    CREATE INDEX IF NOT EXISTS idx_rollup_hourly_local
+        ON speed_rollup_hourly(local_dow, local_hour, sensor_idx, bucket_s)
+"""
+
+# Merge one reading into an existing aggregate row
+_MERGE = """
+    ON CONFLICT DO UPDATE SET
+        readings = readings + excluded.readings,
+        speed_sum = speed_sum + excluded.speed_sum,
+        speed_min = MIN(speed_min, excluded.speed_min),
+        speed_max = MAX(speed_max, excluded.speed_max)
+"""
+
+
+def create_rollup_tables(conn: sqlite3.Connection):
+    """Create the rollup tables (no implicit commit)."""
+    for statement in ROLLUP_SCHEMA.split(";"):
+        conn.execute(statement)
+
+
+def local_dow_hour(epoch_s: int) -> tuple:
+    """Local (day_of_week, hour) for epoch seconds, day_of_week 0 = Sunday."""
+    local = datetime.fromtimestamp(epoch_s, LOCAL_TZ)
+    return (local.weekday() + 1) % 7, local.hour
+
+
+class RollupBuffer:
+    """
+    Scrapes of one UTC hour waiting to be folded into the rollups. add()
+    writes the buffered hour first when a scrape from another hour arrives;
+    flush() writes what is buffered. Writes happen on the connection passed
+    in, and the caller commits.
+    """
+
+    def __init__(self):
+        self.hour = None
+        self.scrapes = []  # (scrape_id, epoch_s, speeds)
+
+    def add(self, conn: sqlite3.Connection, epoch_s: int, speeds: list, scrape_id: int = None) -> int:
+        """Buffer one scrape's speeds (mph or None per sensor index); returns scrapes folded by it."""
+        hour = epoch_s - epoch_s % 3600
+        folded = self.flush(conn) if self.scrapes and hour != self.hour else 0
+        self.hour = hour
+        self.scrapes.append((scrape_id, epoch_s, speeds))
+        return folded
+
+    def flush(self, conn: sqlite3.Connection) -> int:
+        """
+        Fold the buffered scrapes that aren't rolled up yet and mark them
+        rolled up. Returns the number folded.
+        """
+        scrapes, self.scrapes = self.scrapes, []
+        claimed = [(epoch_s, speeds) for scrape_id, epoch_s, speeds in scrapes
+                   if scrape_id is None or conn.execute(
+                       "UPDATE scrapes SET rolled_up = 1 WHERE id = ? AND rolled_up = 0", (scrape_id,)).rowcount]
+        if not claimed:
+            return 0
+
+        quarters = {}
+        for epoch_s, speeds in claimed:
+            quarters.setdefault(epoch_s - epoch_s % 900, []).append(speeds)
+        rows_15m, hourly = [], {}
+        for quarter, rows in quarters.items():
+            for idx, values in enumerate(zip_longest(*rows)):
+                valid = [speed for speed in values if speed is not None]
+                if not valid:
+                    continue
+                count, total, low, high = len(valid), sum(valid), min(valid), max(valid)
+                rows_15m.append((idx, quarter, count, total, low, high))
+                if idx in hourly:
+                    agg = hourly[idx]
+                    hourly[idx] = (agg[0] + count, agg[1] + total, min(agg[2], low), max(agg[3], high))
+                else:
+                    hourly[idx] = (count, total, low, high)
+
+        dow, hour = local_dow_hour(self.hour)
+        conn.executemany(f"""
+            INSERT INTO speed_rollup_15m (sensor_idx, bucket_s, readings, speed_sum, speed_min, speed_max)
+            VALUES (?, ?, ?, ?, ?, ?) {_MERGE}
+        """, rows_15m)
+        conn.executemany(f"""
+            INSERT INTO speed_rollup_hourly
+            (sensor_idx, bucket_s, local_dow, local_hour, readings, speed_sum, speed_min, speed_max)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?) {_MERGE}
+        """, [(idx, self.hour, dow, hour) + agg for idx, agg in hourly.items()])
+        conn.executemany(f"""
+            INSERT INTO speed_profile (sensor_idx, local_dow, local_hour, readings, speed_sum, speed_min, speed_max)
+            VALUES (?, ?, ?, ?, ?, ?, ?) {_MERGE}
+        """, [(idx, dow, hour) + agg for idx, agg in hourly.items()])
+        return len(claimed)
+
+    def discard(self):
+        """Drop the buffered scrapes (after a rollback); fold_pending picks them up later."""
+        self.scrapes = []
+
+
+def update_rollups(conn: sqlite3.Connection, epoch_s: int, speeds: list, scrape_id: int = None) -> bool:
+    """
+    Fold one scrape's speeds (mph or None per sensor index) into the rollups
+    right away and mark the scrape as rolled up (caller commits). Returns
+    False if the scrape was already rolled up.
+    """
+    buffer = RollupBuffer()
+    buffer.add(conn, epoch_s, speeds, scrape_id)
+    return buffer.flush(conn) > 0
+
+
+def remove_from_rollups(conn: sqlite3.Connection, epoch_s: int, speeds: list):
+    """
+    Take one scrape's speeds back out of the rollups, for a scrape that was
+    folded in twice (caller commits). Min/max are left as they are.
+    """
+    valid = [(speed, idx) for idx, speed in enumerate(speeds) if speed is not None]
+    if not valid:
+        return
+    dow, hour = local_dow_hour(epoch_s)
+    quarter = epoch_s - epoch_s % 900
+    hourly = epoch_s - epoch_s % 3600
+    subtract = "SET readings = readings - 1, speed_sum = speed_sum - ?"
+
+    conn.executemany(f"UPDATE speed_rollup_15m {subtract} WHERE sensor_idx = ? AND bucket_s = ?",
+                     [(speed, idx, quarter) for speed, idx in valid])
+    conn.executemany(f"UPDATE speed_rollup_hourly {subtract} WHERE sensor_idx = ? AND bucket_s = ?",
+                     [(speed, idx, hourly) for speed, idx in valid])
+    conn.executemany(f"UPDATE speed_profile {subtract} WHERE sensor_idx = ? AND local_dow = ? AND local_hour = ?",
+                     [(speed, idx, dow, hour) for speed, idx in valid])
+
+
+def iter_stored_scrapes(conn: sqlite3.Connection, schema: str = None, until: int = None, since: int = None):
+    """
+    Yield (scrape_id, epoch_s, [speed, ...]) for every scrape in speed_readings,
+    speed_snapshots and speed_deltas (in schema, if given) in epoch range [since, until).
+    """
+    prefix = f"{schema}." if schema else ""
+    since = since if since is not None else 0
+    until = until if until is not None else 2 ** 62
+
+    current_id, current_epoch, current = None, None, []
+    for scrape_id, epoch_s, sensor_idx, speed in conn.execute(f"""
+        SELECT r.scrape_id, sc.epoch_s, r.sensor_idx, r.speed_mph
+        FROM {prefix}speed_readings r JOIN scrapes sc ON sc.id = r.scrape_id
+        WHERE sc.epoch_s >= ? AND sc.epoch_s < ?
+        ORDER BY r.scrape_id, r.sensor_idx
+    """, (since, until)):
+        if scrape_id != current_id:
+            if current_id is not None:
+                yield current_id, current_epoch, current
+            current_id, current_epoch, current = scrape_id, epoch_s, []
+        current.extend([None] * (sensor_idx - len(current)))
+        current.append(speed)
+    if current_id is not None:
+        yield current_id, current_epoch, current
+
+    # Keyframes precede their deltas in scrape order, so one ordered walk from
+    # the keyframe at or before since rebuilds every state
+    start_id = conn.execute(f"""
+        SELECT MAX(s.scrape_id) FROM {prefix}speed_snapshots s
+        JOIN scrapes sc ON sc.id = s.scrape_id WHERE sc.epoch_s <= ?
+    """, (since,)).fetchone()[0] or 0
+    blob = None
+    for scrape_id, epoch_s, is_delta, payload in conn.execute(f"""
+        SELECT s.scrape_id, sc.epoch_s, 0, s.speeds
+        FROM {prefix}speed_snapshots s JOIN scrapes sc ON sc.id = s.scrape_id
+        WHERE s.scrape_id >= ? AND sc.epoch_s < ?
+        UNION ALL
+        SELECT d.scrape_id, sc.epoch_s, 1, d.changes
+        FROM {prefix}speed_deltas d JOIN scrapes sc ON sc.id = d.scrape_id
+        WHERE d.scrape_id >= ? AND sc.epoch_s < ?
+        ORDER BY 1
+    """, (start_id, until, start_id, until)):
+        if is_delta and blob is None:
+            continue  # Keyframe already expired
+        blob = apply_changes(blob, payload) if is_delta else payload
+        if epoch_s >= since:
+            yield scrape_id, epoch_s, [None if b == NULL_SPEED else b for b in blob]
+
+
+def pending_scrapes(conn: sqlite3.Connection, until: int = None) -> int:
+    """Number of scrapes before until (default: all) that aren't in the rollups."""
+    until = until if until is not None else 2 ** 62
+    return conn.execute("SELECT COUNT(*) FROM scrapes WHERE rolled_up = 0 AND epoch_s < ?",
+                        (until,)).fetchone()[0]
+
+
+def fold_pending(conn: sqlite3.Connection, until: int, schema: str = "main", deadline: float = None) -> tuple:
+    """
+    Fold the scrapes stored in schema before until that aren't in the
+    rollups yet, an hour per transaction. Each hour is read in full before
+    it is written, so no read is held open while waiting for another
+    connection's write lock. With deadline (a time.monotonic() value),
+    stops after the first commit past it. Returns (folded, finished).
+    """
+    pending = dict(conn.execute("SELECT id, epoch_s FROM scrapes WHERE rolled_up = 0 AND epoch_s < ?", (until,)))
+    hours = sorted({epoch_s - epoch_s % 3600 for epoch_s in pending.values()})
+    folded = 0
+    for n, hour in enumerate(hours):
+        scrapes = [scrape for scrape in iter_stored_scrapes(conn, schema, min(hour + 3600, until), hour)
+                   if scrape[0] in pending]
+        buffer = RollupBuffer()
+        for scrape_id, epoch_s, speeds in scrapes:
+            buffer.add(conn, epoch_s, speeds, scrape_id)
+        folded += buffer.flush(conn)
+        conn.commit()
+        if n + 1 < len(hours) and deadline is not None and time.monotonic() >= deadline:
+            return folded, False
+    return folded, True
+
+
+def fold_all_pending(conn: sqlite3.Connection, until: int, shard_dir: Path = SHARD_DIR,
+                     deadline: float = None) -> tuple:
+    """
+    fold_pending in the main database, then in each shard (attached one at a
+    time). Matrix storage isn't read: its unfolded scrapes stay pending.
+    Returns (folded, finished).
+    """
+    folded, finished = fold_pending(conn, until, "main", deadline)
+    since = conn.execute("SELECT MIN(epoch_s) FROM scrapes WHERE rolled_up = 0").fetchone()[0]
+    for _, path in overlapping_shards(since, until, shard_dir) if since is not None else []:
+        if not finished or not pending_scrapes(conn, until):
+            break
+        conn.execute("ATTACH DATABASE ? AS fold_shard", (str(path),))
+        try:
+            count, finished = fold_pending(conn, until, "fold_shard", deadline)
+            folded += count
+        finally:
+            conn.execute("DETACH DATABASE fold_shard")
+    return folded, finished
+
+
+def rebuild_rollups(conns) -> int:
+    """
+    Recompute all rollups from the speed data visible through conns, router
+    connections to one database that together see every scrape once (see
+    shards.iter_routers). Rollups of raw data already removed by
+    retention.py are lost.
+    """
+    count = 0
+    for n, conn in enumerate(conns):
+        if n == 0:
+            create_rollup_tables(conn)
+            for table in ("speed_rollup_15m", "speed_rollup_hourly", "speed_profile"):
+                conn.execute(f"DELETE FROM {table}")
+            conn.execute("UPDATE scrapes SET rolled_up = 0")
+        buffer = RollupBuffer()
+        for scrape_id, epoch_s, speeds in iter_stored_scrapes(conn):
+            buffer.add(conn, epoch_s, speeds, scrape_id)
+            count += 1
+        buffer.flush(conn)
+        conn.commit()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain speed rollup tables")
+    parser.add_argument("--fold", action="store_true",
+                        help="Fold stored scrapes that aren't in the rollups yet (e.g. after an upgrade)")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Recompute rollups from stored speed data (matrix storage is not read; "
+                             "rollups of raw data removed by retention are lost)")
+    args = parser.parse_args()
+
+    if args.fold:
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        print(f"Folding pending scrapes in {DB_PATH}...")
+        folded, _ = fold_all_pending(conn, int(time.time()))
+        print(f"  Folded {folded:,} scrapes ({pending_scrapes(conn):,} still pending)")
+        conn.close()
+    elif args.rebuild:
+        print(f"Rebuilding rollups in {DB_PATH}...")
+        count = rebuild_rollups(iter_routers(db_path=DB_PATH))
+        print(f"  Folded {count:,} scrapes")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Poll Scheduler
+
+Drift-free poll times for a feed that the upstream regenerates every
+UPSTREAM_PERIOD seconds (SoCalData.json: about every 2 minutes).
+
+- Polls fall on wall-clock multiples of the interval (:00, :05, :10, ...
+  for 300 s) computed from absolute time, so fetch and storage time never
+  accumulate into drift and missed ticks are skipped, not bunched up
+- Once the upstream refresh phase is known, each tick is delayed to
+  POLL_MARGIN seconds after the next refresh, so every poll gets data that
+  is seconds old instead of up to a full period old
+- The phase is learned from the Last-Modified header when the feed sends a
+  plausible one, otherwise from content changes: after an unchanged poll
+  the feed is probed every PROBE_DELAY seconds, and the first probe that
+  sees new content brackets the refresh
+- The phase is re-checked every RELEARN_AFTER seconds by polling a little
+  early, so a drifting upstream is followed
+
+    scheduler = FeedScheduler(300)
+    while True:
+        scheduler.sleep_until_next_poll()
+        data = fetch_live_data(skip_unchanged=True)
+        scheduler.observe(data is not None, last_modified)
+"""
+
+import math
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+UPSTREAM_PERIOD = 120  # Seconds between upstream feed refreshes
+POLL_MARGIN = 5        # Poll this long after the learned refresh
+PROBE_DELAY = 10       # Re-poll delay while waiting for a refresh
+RELEARN_AFTER = 3600   # Re-check the phase after this long without a new sample
+RELEARN_LEAD = 20      # How much earlier than expected to poll when re-checking
+PHASE_SAMPLES = 3      # Recent refresh observations averaged into the phase
+
+
+def next_tick(now: float, interval: float, offset: float = 0.0) -> float:
+    """First time after now that is offset seconds past a wall-clock multiple of interval."""
+    return now - (now - offset) % interval + interval
+
+
+def http_date(value: str):
+    """Epoch seconds of an HTTP date header, or None."""
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class FeedScheduler:
+    """Chooses poll times aligned to the interval and to the feed's refresh phase."""
+
+    def __init__(self, interval: float, period: float = UPSTREAM_PERIOD, margin: float = POLL_MARGIN):
+        self.interval = interval
+        self.period = period
+        self.margin = margin
+        self.samples = deque(maxlen=PHASE_SAMPLES)  # Refresh times modulo period
+        self.learned_at = None  # When the newest sample was taken
+        self.last_poll = None
+        self.probe_until = None  # Probing for a refresh until this time
+        self.stalled = False  # Last probe sweep saw no refresh; don't sweep again until new content
+        self.relearning = False  # The scheduled poll is an early one to re-check the phase
+
+    @property
+    def probing(self) -> bool:
+        """The next poll is a probe for a refresh rather than a regular tick."""
+        return self.probe_until is not None
+
+    def phase(self):
+        """Learned refresh phase in [0, period) seconds, or None (circular mean of samples)."""
+        if not self.samples:
+            return None
+        angles = [2 * math.pi * s / self.period for s in self.samples]
+        angle = math.atan2(sum(map(math.sin, angles)), sum(map(math.cos, angles)))
+        return (angle / (2 * math.pi) * self.period) % self.period
+
+    def next_poll(self, now: float = None, interval: float = None) -> float:
+        """Epoch time of the next poll (interval overrides the default for this tick)."""
+        now = time.time() if now is None else now
+        if self.probing and self.last_poll is not None:
+            return max(self.last_poll + PROBE_DELAY, now)
+        tick = next_tick(now, interval or self.interval)
+        phase = self.phase()
+        if phase is None:
+            return tick
+        self.relearning = now - self.learned_at >= RELEARN_AFTER
+        offset = self.margin - (RELEARN_LEAD if self.relearning else 0)
+        return tick + (phase + offset - tick) % self.period
+
+    def sleep_until_next_poll(self, interval: float = None):
+        """Sleep until next_poll()."""
+        time.sleep(max(self.next_poll(interval=interval) - time.time(), 0))
+
+    def observe(self, changed: bool, last_modified=None, poll_time: float = None):
+        """
+        Record the outcome of a poll started at poll_time (default now).
+        changed: the poll returned new content
+        last_modified: Last-Modified header (string or epoch), used when it
+        falls within the last period
+        """
+        poll_time = time.time() if poll_time is None else poll_time
+        if isinstance(last_modified, str):
+            last_modified = http_date(last_modified)
+        sweep_until = poll_time + self.period + PROBE_DELAY
+
+        if changed and last_modified is not None and 0 <= poll_time - last_modified < self.period:
+            self._sample(last_modified % self.period, poll_time)
+            self.probe_until = None
+        elif changed and self.probe_until is not None:
+            # New content since the previous probe: the refresh lies between them,
+            # take the later bound so polls land after it
+            self._sample(poll_time % self.period, poll_time)
+            self.probe_until = None
+        elif changed:
+            if self.learned_at is None or self.relearning:
+                self.probe_until = sweep_until  # Probe until the next refresh to learn the phase
+        elif self.probe_until is None:
+            if not self.stalled:
+                self.probe_until = sweep_until  # Polled before the refresh: probe for it
+        elif poll_time >= self.probe_until:
+            self.probe_until = None  # No refresh for a whole period: back to regular ticks
+            self.stalled = True
+        self.stalled = self.stalled and not changed
+        self.relearning = False
+        self.last_poll = poll_time
+
+    def _sample(self, phase: float, now: float):
+        self.samples.append(phase)
+        self.learned_at = now
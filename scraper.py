@@ -16,17 +16,50 @@ Incident format: [road_section_id, incident_id, time_str, location, description,
 """
 
 import json
+import hashlib
+import queue
 import sqlite3
+import threading
 import time
-import requests
-from datetime import datetime
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from datetime import datetime, timezone
 from pathlib import Path
 
+import http_client
+import metrics
+from http_client import RequestError
+from feed_parser import parse_live_feed
+from scheduler import FeedScheduler, http_date
+from snapshots import record_snapshot, record_delta, unpack_speeds
+from speed_matrix import record_matrix
+from rollups import (PENDING_AGE, RollupBuffer, create_rollup_tables, pending_scrapes, remove_from_rollups,
+                     update_rollups)
+from retention import apply_retention
+from shards import ShardWriter, GRANULARITIES, SHARD_DIR, list_shards, shard_key
+
 # Configuration
-STATIC_URL = "https://cdn-static.sigalert.com/240/Zip/RegionInfo/SoCalStatic.json"
-DATA_URL = "https://www.sigalert.com/Data/SoCal/4~j/SoCalData.json"
+DEFAULT_REGION = "SoCal"
+STATIC_URL_TEMPLATE = "https://cdn-static.sigalert.com/240/Zip/RegionInfo/{region}Static.json"
+DATA_URL_TEMPLATE = "https://www.sigalert.com/Data/{region}/4~j/{region}Data.json"
+STATIC_URL = STATIC_URL_TEMPLATE.format(region=DEFAULT_REGION)
+DATA_URL = DATA_URL_TEMPLATE.format(region=DEFAULT_REGION)
 DB_PATH = Path(__file__).parent / "traffic.db"
+REGION_DIR = Path(__file__).parent / "regions"  # Databases and shards of other regions
+STATIC_CACHE = Path(__file__).parent / "cache" / "SoCalStatic.json"
+STATIC_MAX_AGE = 86400  # Use the cached static file without revalidating for a day
 SCRAPE_INTERVAL = 300  # 5 minutes
+RETENTION_INTERVAL = 3600  # Run retention hourly with --retention
+RETENTION_BUDGET = 60  # Seconds of retention work per run
+WRITE_QUEUE_SIZE = 8  # Fetched payloads waiting for the writer before fetching blocks
+GROUP_COMMIT_MAX = 16  # Most payloads committed in one transaction
+
+# Speed storage modes: "rows" = one speed_readings row per sensor per scrape,
+# "packed" = one speed_snapshots row per scrape (see snapshots.py),
+# "delta" = periodic packed keyframes plus per-scrape change lists,
+# "matrix" = memory-mapped time x sensor matrix file (see speed_matrix.py)
+STORAGE_MODES = ("rows", "packed", "delta", "matrix")
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:146.0) Gecko/20100101 Firefox/146.0",
@@ -35,9 +68,275 @@ HEADERS = {
     "Referer": "https://www.sigalert.com/",
 }
 
+# Validators and content digest of the last live payload per region (see fetch_live_data)
+_feed_state = {}
+
+
+# speed_readings layouts (both unique on (scrape_id, sensor_idx)):
+# - "rowid": clustered by insertion order, with a unique (scrape_id, sensor_idx)
+#   index and a sensor index
+# - "clustered": WITHOUT ROWID keyed on (sensor_idx, scrape_id), so each sensor's
+#   history is contiguous; one secondary index on scrape_id for time-only queries
+READINGS_SCHEMA = {
+    "rowid": """
+        CREATE TABLE IF NOT EXISTS {schema}.speed_readings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            scrape_id INTEGER NOT NULL,
+            sensor_idx INTEGER NOT NULL,
+            speed_mph INTEGER,
+            has_incident INTEGER DEFAULT 0,
+            incident_ids TEXT,
+            FOREIGN KEY (scrape_id) REFERENCES scrapes(id),
+            FOREIGN KEY (sensor_idx) REFERENCES sensors(idx)
+        );
+
+        CREATE INDEX IF NOT EXISTS {schema}.idx_readings_sensor ON speed_readings(sensor_idx);
+        CREATE UNIQUE INDEX IF NOT EXISTS {schema}.idx_readings_key ON speed_readings(scrape_id, sensor_idx)
+    """,
+    "clustered": """
+        CREATE TABLE IF NOT EXISTS {schema}.speed_readings (
+            sensor_idx INTEGER NOT NULL,
+            scrape_id INTEGER NOT NULL,
+            speed_mph INTEGER,
+            has_incident INTEGER DEFAULT 0,
+            incident_ids TEXT,
+            PRIMARY KEY (sensor_idx, scrape_id),
+            FOREIGN KEY (scrape_id) REFERENCES scrapes(id),
+            FOREIGN KEY (sensor_idx) REFERENCES sensors(idx)
+        ) WITHOUT ROWID;
+
+        CREATE INDEX IF NOT EXISTS {schema}.idx_readings_by_scrape ON speed_readings(scrape_id)
+    """,
+}
+READINGS_LAYOUTS = tuple(READINGS_SCHEMA)
+
+# Other time-series tables keyed by scrape id. Created in the main database and
+# in each shard ({schema} is the database schema name, e.g. "main").
+SPEED_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS {schema}.speed_snapshots (
+        scrape_id INTEGER PRIMARY KEY,
+        sensor_count INTEGER NOT NULL,
+        speeds BLOB NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS {schema}.snapshot_incident_refs (
+        scrape_id INTEGER NOT NULL,
+        sensor_idx INTEGER NOT NULL,
+        incident_ids TEXT NOT NULL,
+        PRIMARY KEY (scrape_id, sensor_idx)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS {schema}.speed_deltas (
+        scrape_id INTEGER PRIMARY KEY,
+        keyframe_id INTEGER NOT NULL,
+        changes BLOB NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS {schema}.idx_deltas_keyframe ON speed_deltas(keyframe_id, scrape_id)
+"""
+
+# Tables that stored an ISO "timestamp" column before the scrapes table existed
+LEGACY_TIMESTAMP_TABLES = ("speed_readings", "speed_snapshots", "snapshot_incident_refs", "speed_deltas")
+
+
+def _execute_schema(conn: sqlite3.Connection, script: str, schema: str):
+    """Run a schema script statement by statement (executescript would commit)."""
+    for statement in script.format(schema=schema).split(";"):
+        conn.execute(statement)
+
+
+def readings_layout(conn: sqlite3.Connection, schema: str = "main") -> str:
+    """Layout of an existing speed_readings table (None if it doesn't exist)."""
+    row = conn.execute(f"SELECT sql FROM {schema}.sqlite_master WHERE type = 'table' AND name = 'speed_readings'").fetchone()
+    if not row:
+        return None
+    return "clustered" if "WITHOUT ROWID" in row[0].upper() else "rowid"
+
+
+def create_speed_tables(conn: sqlite3.Connection, schema: str = "main", layout: str = None):
+    """
+    Create the time-series tables in schema (no implicit commit).
+    An existing speed_readings keeps its layout unless a different layout is requested.
+    """
+    current = readings_layout(conn, schema)
+    if current and layout and layout != current:
+        migrate_readings_layout(conn, layout, schema)
+    elif current == "rowid" and not _has_index(conn, schema, "idx_readings_key"):
+        migrate_readings_key(conn, schema)
+    _execute_schema(conn, READINGS_SCHEMA[layout or current or "rowid"], schema)
+    _execute_schema(conn, SPEED_SCHEMA, schema)
+
+
+def migrate_readings_layout(conn: sqlite3.Connection, layout: str, schema: str = "main"):
+    """
+    Rebuild speed_readings in another layout, dropping duplicate
+    (sensor_idx, scrape_id) rows and the old layout's indexes.
+    """
+    print(f"Migrating {schema}.speed_readings to {layout} layout...")
+    for (index,) in conn.execute(f"""
+        SELECT name FROM {schema}.sqlite_master
+        WHERE type = 'index' AND tbl_name = 'speed_readings' AND sql IS NOT NULL
+    """).fetchall():
+        conn.execute(f"DROP INDEX {schema}.{index}")
+    conn.execute(f"ALTER TABLE {schema}.speed_readings RENAME TO speed_readings_old")
+    _execute_schema(conn, READINGS_SCHEMA[layout], schema)
+
+    order = "sensor_idx, scrape_id" if layout == "clustered" else "scrape_id, sensor_idx"
+    cursor = conn.execute(f"""
+        INSERT OR IGNORE INTO {schema}.speed_readings (scrape_id, sensor_idx, speed_mph, has_incident, incident_ids)
+        SELECT scrape_id, sensor_idx, speed_mph, has_incident, incident_ids
+        FROM {schema}.speed_readings_old ORDER BY {order}
+    """)
+    old_count = conn.execute(f"SELECT COUNT(*) FROM {schema}.speed_readings_old").fetchone()[0]
+    conn.execute(f"DROP TABLE {schema}.speed_readings_old")
+    conn.commit()
+    print(f"  Copied {cursor.rowcount:,} readings ({old_count - cursor.rowcount:,} duplicates dropped); "
+          f"run VACUUM to reclaim space")
+
+
+def _has_index(conn: sqlite3.Connection, schema: str, name: str) -> bool:
+    return conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'index' AND name = ?",
+                        (name,)).fetchone() is not None
+
+
+def migrate_readings_key(conn: sqlite3.Connection, schema: str = "main"):
+    """
+    Give a rowid-layout speed_readings its unique (scrape_id, sensor_idx) key:
+    keep the first of any duplicate rows and replace the two non-unique
+    scrape indexes (the unique index is created by the schema).
+    """
+    print(f"Adding unique (scrape_id, sensor_idx) key to {schema}.speed_readings...")
+    cursor = conn.execute(f"""
+        DELETE FROM {schema}.speed_readings WHERE id NOT IN (
+            SELECT MIN(id) FROM {schema}.speed_readings GROUP BY scrape_id, sensor_idx)
+    """)
+    conn.execute(f"DROP INDEX IF EXISTS {schema}.idx_readings_scrape")
+    conn.execute(f"DROP INDEX IF EXISTS {schema}.idx_readings_scrape_sensor")
+    print(f"  {cursor.rowcount:,} duplicate readings removed")
+
+
+def migrate_scrape_keys(conn: sqlite3.Connection, shard_dir: Path = SHARD_DIR):
+    """
+    Make (epoch_s, source) unique in scrapes. Repeated imports of the same
+    snapshot are merged into the oldest scrape: the copies' speed data is
+    deleted from the main database and every shard, and their readings are
+    taken back out of the rollups. Runs once, before the unique index exists.
+    """
+    if _has_index(conn, "main", "idx_scrapes_key"):
+        return
+    conn.execute("""
+        CREATE TEMP TABLE scrape_copies AS
+        SELECT s.id, s.epoch_s, s.rolled_up FROM scrapes s
+        JOIN (SELECT epoch_s, source, MIN(id) AS keep_id FROM scrapes
+              GROUP BY epoch_s, source HAVING COUNT(*) > 1) k
+          ON s.epoch_s = k.epoch_s AND s.source IS k.source AND s.id <> k.keep_id
+    """)
+    copies = conn.execute("SELECT COUNT(*) FROM temp.scrape_copies").fetchone()[0]
+    if copies:
+        print(f"Removing {copies:,} duplicate scrapes...")
+        conn.commit()  # ATTACH can't run inside a transaction
+        # One shard at a time (SQLite attaches at most 10); the copies stay in
+        # scrapes until the end, so an interrupted run starts over cleanly
+        for _, path in list_shards(shard_dir):
+            conn.execute("ATTACH DATABASE ? AS dedupe_shard", (str(path),))
+            _remove_scrape_copies(conn, "dedupe_shard")
+            conn.commit()
+            conn.execute("DETACH DATABASE dedupe_shard")
+        _remove_scrape_copies(conn, "main")
+        conn.execute("DELETE FROM scrapes WHERE id IN (SELECT id FROM temp.scrape_copies)")
+        conn.commit()
+    conn.execute("DROP TABLE temp.scrape_copies")
+    conn.execute("DROP INDEX IF EXISTS idx_scrapes_epoch")  # Covered by the unique key
+    conn.execute("CREATE UNIQUE INDEX idx_scrapes_key ON scrapes(epoch_s, source)")
+
 
-def init_db(conn: sqlite3.Connection):
-    """Initialize database schema."""
+def _remove_scrape_copies(conn: sqlite3.Connection, schema: str):
+    """Delete the speed data of temp.scrape_copies in schema, unfolding rolled-up readings."""
+    tables = [t for t in ("speed_readings", "speed_snapshots", "snapshot_incident_refs", "speed_deltas")
+              if _columns(conn, schema, t)]
+    if "speed_readings" in tables:
+        current_id, current_epoch, speeds = None, None, []
+        for scrape_id, epoch_s, sensor_idx, speed in conn.execute(f"""
+            SELECT c.id, c.epoch_s, r.sensor_idx, r.speed_mph
+            FROM temp.scrape_copies c JOIN {schema}.speed_readings r ON r.scrape_id = c.id
+            WHERE c.rolled_up = 1 ORDER BY c.id, r.sensor_idx
+        """).fetchall():
+            if scrape_id != current_id:
+                if current_id is not None:
+                    remove_from_rollups(conn, current_epoch, speeds)
+                current_id, current_epoch, speeds = scrape_id, epoch_s, []
+            speeds.extend([None] * (sensor_idx - len(speeds)))
+            speeds.append(speed)
+        if current_id is not None:
+            remove_from_rollups(conn, current_epoch, speeds)
+    if "speed_snapshots" in tables:
+        for epoch_s, blob in conn.execute(f"""
+            SELECT c.epoch_s, s.speeds FROM temp.scrape_copies c
+            JOIN {schema}.speed_snapshots s ON s.scrape_id = c.id WHERE c.rolled_up = 1
+        """).fetchall():
+            remove_from_rollups(conn, epoch_s, unpack_speeds(blob))
+    for table in tables:
+        conn.execute(f"DELETE FROM {schema}.{table} WHERE scrape_id IN (SELECT id FROM temp.scrape_copies)")
+
+
+def migrate_event_times(conn: sqlite3.Connection):
+    """
+    Convert incidents.first_seen/last_seen/closed_at and heartbeats.timestamp
+    from ISO text to epoch seconds (heartbeats become keyed by epoch_s).
+    Timestamps written with different ISO suffixes for one second merge.
+    """
+    if "timestamp" in _columns(conn, "main", "heartbeats"):
+        print("Migrating heartbeats to epoch seconds...")
+        conn.execute("ALTER TABLE heartbeats RENAME TO heartbeats_legacy")
+        conn.execute("CREATE TABLE heartbeats (epoch_s INTEGER PRIMARY KEY, status TEXT NOT NULL)")
+        conn.execute("""
+            INSERT OR REPLACE INTO heartbeats (epoch_s, status)
+            SELECT CAST(strftime('%s', timestamp) AS INTEGER), status FROM heartbeats_legacy ORDER BY timestamp
+        """)
+        conn.execute("DROP TABLE heartbeats_legacy")
+        conn.commit()
+
+    types = {row[1]: row[2] for row in conn.execute("PRAGMA main.table_info(incidents)")}
+    if types.get("first_seen") != "TEXT":
+        return
+    print("Migrating incident times to epoch seconds...")
+    conn.execute("DROP INDEX IF EXISTS idx_incidents_open")
+    conn.execute("ALTER TABLE incidents RENAME TO incidents_legacy")
+    conn.execute("""
+        CREATE TABLE incidents (
+            id INTEGER PRIMARY KEY,
+            road_section_id INTEGER,
+            time_str TEXT,
+            location TEXT,
+            description TEXT,
+            severity INTEGER,
+            x INTEGER,
+            y INTEGER,
+            start_time TEXT,
+            update_time TEXT,
+            first_seen INTEGER,
+            last_seen INTEGER,
+            closed_at INTEGER
+        )
+    """)
+    conn.execute("""
+        INSERT INTO incidents
+        SELECT id, road_section_id, time_str, location, description, severity, x, y, start_time, update_time,
+               CAST(strftime('%s', first_seen) AS INTEGER), CAST(strftime('%s', last_seen) AS INTEGER),
+               CAST(strftime('%s', closed_at) AS INTEGER)
+        FROM incidents_legacy
+    """)
+    conn.execute("DROP TABLE incidents_legacy")
+    conn.commit()
+
+
+def init_db(conn: sqlite3.Connection, layout: str = None, shard_dir: Path = SHARD_DIR):
+    """
+    Initialize database schema (layout: speed_readings layout, see
+    READINGS_SCHEMA; shard_dir: shards to clean up when migrating scrape keys).
+    """
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")  # Only takes effect on a new database
+    migrate_timestamps(conn)
     conn.executescript("""
         CREATE TABLE IF NOT EXISTS sensors (
             idx INTEGER PRIMARY KEY,
@@ -55,14 +354,36 @@ def init_db(conn: sqlite3.Connection):
             end_idx INTEGER
         );
 
-        CREATE TABLE IF NOT EXISTS speed_readings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT NOT NULL,
-            sensor_idx INTEGER NOT NULL,
-            speed_mph INTEGER,
-            has_incident INTEGER DEFAULT 0,
-            incident_ids TEXT,
-            FOREIGN KEY (sensor_idx) REFERENCES sensors(idx)
+        CREATE TABLE IF NOT EXISTS static_versions (
+            id INTEGER PRIMARY KEY,
+            digest TEXT NOT NULL,
+            first_seen INTEGER NOT NULL,
+            sensor_count INTEGER,
+            section_count INTEGER
+        );
+
+        CREATE TABLE IF NOT EXISTS sensor_versions (
+            version_id INTEGER NOT NULL REFERENCES static_versions(id),
+            idx INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            PRIMARY KEY (version_id, idx)
+        ) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS road_section_versions (
+            version_id INTEGER NOT NULL REFERENCES static_versions(id),
+            id INTEGER NOT NULL,
+            direction TEXT,
+            route TEXT,
+            start_idx INTEGER,
+            end_idx INTEGER,
+            PRIMARY KEY (version_id, id)
+        ) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS scrapes (
+            id INTEGER PRIMARY KEY,
+            epoch_s INTEGER NOT NULL,
+            source TEXT,
+            rolled_up INTEGER NOT NULL DEFAULT 0
         );
 
         CREATE TABLE IF NOT EXISTS incidents (
@@ -76,75 +397,432 @@ def init_db(conn: sqlite3.Connection):
             y INTEGER,
             start_time TEXT,
             update_time TEXT,
-            first_seen TEXT,
-            last_seen TEXT
+            first_seen INTEGER,
+            last_seen INTEGER,
+            closed_at INTEGER
+        );
+
+        CREATE TABLE IF NOT EXISTS heartbeats (
+            epoch_s INTEGER PRIMARY KEY,
+            status TEXT NOT NULL
         );
 
-        CREATE INDEX IF NOT EXISTS idx_readings_timestamp ON speed_readings(timestamp);
-        CREATE INDEX IF NOT EXISTS idx_readings_sensor ON speed_readings(sensor_idx);
-        CREATE INDEX IF NOT EXISTS idx_readings_ts_sensor ON speed_readings(timestamp, sensor_idx);
     """)
+    if "rolled_up" not in _columns(conn, "main", "scrapes"):
+        conn.execute("ALTER TABLE scrapes ADD COLUMN rolled_up INTEGER NOT NULL DEFAULT 0")
+    if "closed_at" not in _columns(conn, "main", "incidents"):
+        conn.execute("ALTER TABLE incidents ADD COLUMN closed_at TEXT")
+    migrate_event_times(conn)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_incidents_open ON incidents(last_seen) WHERE closed_at IS NULL")
+    create_rollup_tables(conn)
+    create_speed_tables(conn, layout=layout)
+    migrate_scrape_keys(conn, shard_dir)
     conn.commit()
 
+    pending = pending_scrapes(conn, int(time.time()) - PENDING_AGE)
+    if pending:
+        print(f"{pending:,} stored scrapes aren't in the rollups yet (commute.py --analyze won't see them); "
+              f"fold them with `python rollups.py --fold` or run the collector with --retention")
+
 
-def load_static_data() -> dict:
-    """Fetch and return static metadata."""
-    print("Fetching static data...")
-    resp = requests.get(STATIC_URL, headers=HEADERS, timeout=30)
-    resp.raise_for_status()
-    return resp.json()
+def init_shard_db(conn: sqlite3.Connection, layout: str = None):
+    """Initialize a shard: time-series tables only (scrapes live in the main database)."""
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")  # Only takes effect on a new shard
+    create_speed_tables(conn, layout=layout)
+    conn.commit()
 
 
-def populate_sensors(conn: sqlite3.Connection, static_data: dict):
-    """Populate sensors table from static data."""
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM sensors")
-    if cursor.fetchone()[0] > 0:
-        print("Sensors already populated, skipping...")
+def _columns(conn: sqlite3.Connection, schema: str, table: str) -> list:
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def migrate_timestamps(conn: sqlite3.Connection, schema: str = "main"):
+    """
+    Migrate time-series tables in schema from ISO "timestamp" text to scrape ids.
+    Each distinct scrape second becomes one main.scrapes row (source "legacy"),
+    so timestamps written with different ISO suffixes are unified.
+    """
+    legacy = [t for t in LEGACY_TIMESTAMP_TABLES if "timestamp" in _columns(conn, schema, t)]
+    if not legacy:
         return
 
-    print("Populating sensors...")
+    print(f"Migrating {', '.join(legacy)} to scrape ids...")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS main.scrapes (
+            id INTEGER PRIMARY KEY,
+            epoch_s INTEGER NOT NULL,
+            source TEXT,
+            rolled_up INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("CREATE TEMP TABLE legacy_ids (timestamp TEXT PRIMARY KEY, epoch_s INTEGER, scrape_id INTEGER)")
+    for table in legacy:
+        conn.execute(f"""
+            INSERT OR IGNORE INTO temp.legacy_ids (timestamp, epoch_s)
+            SELECT DISTINCT timestamp, CAST(strftime('%s', timestamp) AS INTEGER)
+            FROM {schema}.{table}
+        """)
+    conn.execute("""
+        INSERT INTO main.scrapes (epoch_s, source)
+        SELECT DISTINCT epoch_s, 'legacy' FROM temp.legacy_ids
+        WHERE epoch_s NOT IN (SELECT epoch_s FROM main.scrapes WHERE source = 'legacy')
+        ORDER BY epoch_s
+    """)
+    conn.execute("""
+        UPDATE temp.legacy_ids SET scrape_id = (
+            SELECT id FROM main.scrapes s WHERE s.epoch_s = legacy_ids.epoch_s AND s.source = 'legacy'
+        )
+    """)
+
+    # Move legacy tables aside (dropping their indexes so the names can be reused)
+    for table in legacy:
+        for (index,) in conn.execute(f"""
+            SELECT name FROM {schema}.sqlite_master
+            WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL
+        """, (table,)).fetchall():
+            conn.execute(f"DROP INDEX {schema}.{index}")
+        conn.execute(f"ALTER TABLE {schema}.{table} RENAME TO {table}_legacy")
+    create_speed_tables(conn, schema)
+
+    copies = {
+        # Keep the first of readings repeated by a re-run backfill or by two ISO suffixes of one second
+        "speed_readings": """
+            INSERT OR IGNORE INTO {schema}.speed_readings (id, scrape_id, sensor_idx, speed_mph, has_incident, incident_ids)
+            SELECT r.id, m.scrape_id, r.sensor_idx, r.speed_mph, r.has_incident, r.incident_ids
+            FROM {schema}.speed_readings_legacy r JOIN temp.legacy_ids m ON m.timestamp = r.timestamp
+            ORDER BY r.id
+        """,
+        "speed_snapshots": """
+            INSERT OR REPLACE INTO {schema}.speed_snapshots (scrape_id, sensor_count, speeds)
+            SELECT m.scrape_id, s.sensor_count, s.speeds
+            FROM {schema}.speed_snapshots_legacy s JOIN temp.legacy_ids m ON m.timestamp = s.timestamp
+        """,
+        "snapshot_incident_refs": """
+            INSERT OR REPLACE INTO {schema}.snapshot_incident_refs (scrape_id, sensor_idx, incident_ids)
+            SELECT m.scrape_id, r.sensor_idx, r.incident_ids
+            FROM {schema}.snapshot_incident_refs_legacy r JOIN temp.legacy_ids m ON m.timestamp = r.timestamp
+        """,
+        "speed_deltas": """
+            INSERT OR REPLACE INTO {schema}.speed_deltas (scrape_id, keyframe_id, changes)
+            SELECT m.scrape_id, k.scrape_id, d.changes
+            FROM {schema}.speed_deltas_legacy d
+            JOIN temp.legacy_ids m ON m.timestamp = d.timestamp
+            JOIN temp.legacy_ids k ON k.timestamp = d.keyframe
+        """,
+    }
+    for table in legacy:
+        cursor = conn.execute(copies[table].format(schema=schema))
+        if table == "speed_readings":
+            old_count = conn.execute(f"SELECT COUNT(*) FROM {schema}.speed_readings_legacy").fetchone()[0]
+            print(f"  Copied {cursor.rowcount:,} readings ({old_count - cursor.rowcount:,} duplicates dropped)")
+        conn.execute(f"DROP TABLE {schema}.{table}_legacy")
+
+    conn.execute("DROP TABLE temp.legacy_ids")
+    conn.commit()
+
+
+def migrate_shards(conn: sqlite3.Connection, shard_dir: Path = SHARD_DIR):
+    """Migrate legacy shards, registering their scrapes in the main database."""
+    for key, path in list_shards(shard_dir):
+        conn.execute("ATTACH DATABASE ? AS legacy_shard", (str(path),))
+        migrate_timestamps(conn, "legacy_shard")
+        conn.execute("DETACH DATABASE legacy_shard")
+
+
+def open_shard_writer(conn: sqlite3.Connection, granularity: str = None, layout: str = None,
+                      shard_dir: Path = SHARD_DIR) -> ShardWriter:
+    """Migrate legacy shards and return a ShardWriter (None if sharding is off)."""
+    if not granularity:
+        return None
+    migrate_shards(conn, shard_dir)
+    return ShardWriter(partial(init_shard_db, layout=layout), shard_dir, granularity)
+
+
+def to_epoch(timestamp: str) -> int:
+    """Convert an ISO timestamp (Z, +00:00 or naive UTC) to epoch seconds."""
+    dt = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def format_epoch(epoch_s: int) -> str:
+    """Format epoch seconds as an ISO UTC timestamp (YYYY-MM-DDTHH:MM:SSZ)."""
+    return datetime.fromtimestamp(epoch_s, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def register_scrape(conn: sqlite3.Connection, epoch_s: int, source: str) -> int:
+    """Return the id of the (epoch_s, source) scrape, adding it if new (caller commits)."""
+    cursor = conn.execute("INSERT OR IGNORE INTO scrapes (epoch_s, source) VALUES (?, ?)", (epoch_s, source))
+    if cursor.rowcount:
+        return cursor.lastrowid
+    return conn.execute("SELECT id FROM scrapes WHERE epoch_s = ? AND source = ?", (epoch_s, source)).fetchone()[0]
+
+
+def region_storage(region: str) -> tuple:
+    """
+    (db_path, shard_dir) of a region. The default region keeps traffic.db
+    and shards/; others get regions/<region>/traffic.db and .../shards/.
+    """
+    if region == DEFAULT_REGION:
+        return DB_PATH, SHARD_DIR
+    return REGION_DIR / region / "traffic.db", REGION_DIR / region / "shards"
+
+
+def _static_cache_path(region: str) -> Path:
+    return STATIC_CACHE.with_name(f"{region}Static.json")
+
+
+def _read_static_cache(path: Path) -> tuple:
+    """(static_data, meta) from a cached static file, or (None, {}) if there is no usable cache."""
+    meta_path = path.with_suffix(".meta.json")
+    try:
+        body = path.read_bytes()
+        meta = json.loads(meta_path.read_text())
+    except (OSError, ValueError):
+        return None, {}
+    if hashlib.sha256(body).hexdigest() != meta.get("sha256"):
+        return None, {}
+    return json.loads(body), meta
+
+
+def _write_static_cache(path: Path, body: bytes, meta: dict):
+    """Atomically replace a cached static file and/or its metadata."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    meta_path = path.with_suffix(".meta.json")
+    if body is not None:
+        tmp = path.with_suffix(".tmp")
+        tmp.write_bytes(body)
+        tmp.replace(path)
+    tmp = meta_path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(meta))
+    tmp.replace(meta_path)
+
+
+def load_static_data(max_age: float = STATIC_MAX_AGE, region: str = DEFAULT_REGION) -> dict:
+    """
+    Return a region's static metadata from the on-disk cache (cache/<region>Static.json).
+    A cache checked within max_age seconds is used without any request;
+    an older one is revalidated with If-None-Match/If-Modified-Since.
+    The cache is also used when the server can't be reached.
+    """
+    cache_path = _static_cache_path(region)
+    static_data, meta = _read_static_cache(cache_path)
+    now = time.time()
+    if static_data is not None and now - meta.get("checked", 0) < max_age:
+        print(f"Using cached {region} static data")
+        return static_data
+
+    print(f"Fetching {region} static data...")
+    headers = dict(HEADERS)
+    if static_data is not None:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+    try:
+        resp = http_client.get(STATIC_URL_TEMPLATE.format(region=region), headers, timeout=30)
+    except RequestError as e:
+        if static_data is None:
+            raise
+        print(f"Static fetch failed ({e}), using cached copy")
+        return static_data
+
+    if resp.status == 304:
+        _write_static_cache(cache_path, None, {**meta, "checked": now})
+        return static_data
+
+    body = resp.data
+    digest = hashlib.sha256(body).hexdigest()
+    if digest == meta.get("sha256"):
+        print("  Static data unchanged")
+    _write_static_cache(cache_path, body if digest != meta.get("sha256") else None, {
+        "etag": resp.headers.get("ETag"),
+        "last_modified": resp.headers.get("Last-Modified"),
+        "sha256": digest,
+        "checked": now,
+    })
+    return json.loads(body)
+
+
+def static_digest(sensor_names: list, road_sections: list) -> str:
+    """Content hash of a sensor mapping (section order doesn't matter)."""
+    body = json.dumps([list(sensor_names), sorted(list(s) for s in road_sections)], separators=(",", ":"))
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+
+def _record_static_version(conn: sqlite3.Connection, digest: str, first_seen: int,
+                           sensor_names: list, road_sections: list) -> int:
+    """Store a sensor mapping as a new static_versions row and return its id (caller commits)."""
+    version_id = conn.execute("""
+        INSERT INTO static_versions (digest, first_seen, sensor_count, section_count)
+        VALUES (?, ?, ?, ?)
+    """, (digest, first_seen, len(sensor_names), len(road_sections))).lastrowid
+    conn.executemany("""
+        INSERT INTO road_section_versions (version_id, id, direction, route, start_idx, end_idx)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, [(version_id, *section) for section in road_sections])
+    conn.executemany("""
+        INSERT INTO sensor_versions (version_id, idx, name) VALUES (?, ?, ?)
+    """, [(version_id, idx, name) for idx, name in enumerate(sensor_names)])
+    return version_id
+
+
+def populate_sensors(conn: sqlite3.Connection, static_data: dict):
+    """
+    Populate sensors and road_sections from static data.
+    If the mapping differs from the current one, the old and new mappings are
+    kept in static_versions (see static_version_at) and the current tables
+    are replaced.
+    """
     sensor_names = static_data["sensorNames"]
-    road_sections = static_data["roadSections"]
+    road_sections = [list(section) for section in static_data["roadSections"]]
+    digest = static_digest(sensor_names, road_sections)
+
+    current = conn.execute("SELECT id, digest FROM static_versions ORDER BY id DESC LIMIT 1").fetchone()
+    if current is None and conn.execute("SELECT 1 FROM sensors LIMIT 1").fetchone():
+        # Sensors populated before versioning: keep them as the first version
+        old_names = [name for (name,) in conn.execute("SELECT name FROM sensors ORDER BY idx")]
+        old_sections = [list(row) for row in conn.execute(
+            "SELECT id, direction, route, start_idx, end_idx FROM road_sections")]
+        first_scrape = conn.execute("SELECT MIN(epoch_s) FROM scrapes").fetchone()[0] or 0
+        old_digest = static_digest(old_names, old_sections)
+        current = (_record_static_version(conn, old_digest, first_scrape, old_names, old_sections), old_digest)
+        conn.commit()
+
+    if current is not None and current[1] == digest:
+        print(f"Sensors up to date (static version {current[0]})")
+        return
+
+    print("Populating sensors..." if current is None else "Static data changed, storing new sensor mapping...")
+    version_id = _record_static_version(conn, digest, int(time.time()), sensor_names, road_sections)
 
     # Build index -> road section mapping
     idx_to_section = {}
-    for section in road_sections:
-        section_id, direction, route, start_idx, end_idx = section
+    for section_id, direction, route, start_idx, end_idx in road_sections:
         for idx in range(start_idx, end_idx + 1):
             idx_to_section[idx] = (section_id, direction, route)
 
-    # Populate road_sections table
-    for section in road_sections:
-        section_id, direction, route, start_idx, end_idx = section
-        cursor.execute("""
-            INSERT OR REPLACE INTO road_sections (id, direction, route, start_idx, end_idx)
-            VALUES (?, ?, ?, ?, ?)
-        """, (section_id, direction, route, start_idx, end_idx))
-
-    # Populate sensors table
-    for idx, name in enumerate(sensor_names):
-        section_info = idx_to_section.get(idx, (None, None, None))
-        cursor.execute("""
-            INSERT OR REPLACE INTO sensors (idx, name, road_section_id, direction, route)
-            VALUES (?, ?, ?, ?, ?)
-        """, (idx, name, section_info[0], section_info[1], section_info[2]))
+    conn.execute("DELETE FROM road_sections")
+    conn.executemany("""
+        INSERT INTO road_sections (id, direction, route, start_idx, end_idx)
+        VALUES (?, ?, ?, ?, ?)
+    """, road_sections)
+    conn.execute("DELETE FROM sensors")
+    conn.executemany("""
+        INSERT INTO sensors (idx, name, road_section_id, direction, route)
+        VALUES (?, ?, ?, ?, ?)
+    """, [(idx, name, *idx_to_section.get(idx, (None, None, None))) for idx, name in enumerate(sensor_names)])
 
     conn.commit()
-    print(f"Populated {len(sensor_names)} sensors and {len(road_sections)} road sections")
+    print(f"Populated {len(sensor_names)} sensors and {len(road_sections)} road sections (static version {version_id})")
+
+
+def static_version_at(conn: sqlite3.Connection, epoch_s: int):
+    """Id of the static version (sensor mapping) in effect at epoch_s, or None."""
+    row = conn.execute("""
+        SELECT COALESCE(
+            (SELECT id FROM static_versions WHERE first_seen <= ? ORDER BY first_seen DESC, id DESC LIMIT 1),
+            (SELECT MIN(id) FROM static_versions))
+    """, (epoch_s,)).fetchone()
+    return row[0]
 
 
-def fetch_live_data() -> dict:
-    """Fetch current traffic data."""
+def fetch_live_data(skip_unchanged: bool = False, region: str = DEFAULT_REGION) -> dict:
+    """
+    Fetch current traffic data for a region.
+    With skip_unchanged, returns None if the feed has not changed since the
+    last fetch: a 304 on a conditional request (ETag / Last-Modified), or
+    else an identical content digest.
+    """
+    state = _feed_state.setdefault(region, {})
     cb = int(time.time() * 1000) % 100000000
-    url = f"{DATA_URL}?cb={cb}"
-    resp = requests.get(url, headers=HEADERS, timeout=30)
-    resp.raise_for_status()
-    return resp.json()
+    url = f"{DATA_URL_TEMPLATE.format(region=region)}?cb={cb}"
+    headers = dict(HEADERS)
+    if skip_unchanged:
+        if state.get("etag"):
+            headers["If-None-Match"] = state["etag"]
+        if state.get("last_modified"):
+            headers["If-Modified-Since"] = state["last_modified"]
 
+    start = time.monotonic()
+    resp = http_client.get(url, headers, timeout=30)
+    fetched = time.monotonic()
+    metrics.FETCH_SECONDS.observe(fetched - start, region=region)
+    if resp.status == 304:
+        return None
+    data, digest = parse_live_feed(resp.data)  # speeds + incidents only, cameras skipped
+    metrics.PARSE_SECONDS.observe(time.monotonic() - fetched, region=region)
+    metrics.PAYLOAD_BYTES.observe(len(resp.data), region=region)
+    last_modified = http_date(resp.headers.get("Last-Modified"))
+    if last_modified is not None:
+        metrics.DATA_AGE.observe(max(time.time() - last_modified, 0), region=region)
+    if "speeds" not in data:
+        raise ValueError("Live feed has no speeds")
+
+    unchanged = digest == state.get("digest")
+    state.update(
+        etag=resp.headers.get("ETag"),
+        last_modified=resp.headers.get("Last-Modified"),
+        digest=digest,
+    )
+    if skip_unchanged and unchanged:
+        return None
+    return data
+
+
+def feed_last_modified(region: str = DEFAULT_REGION) -> str:
+    """Last-Modified header of the region's last live payload, if the feed sent one."""
+    return _feed_state.get(region, {}).get("last_modified")
+
+
+def poll_feed(scheduler: FeedScheduler, writer: "SnapshotWriter", region: str = DEFAULT_REGION,
+              **extra) -> bool:
+    """
+    Fetch a region's live feed, tell the scheduler whether it changed and
+    queue the result for writing. Unchanged probes don't record heartbeats.
+    Returns True if the feed changed.
+    """
+    probe = scheduler.probing
+    poll_time = time.time()
+    try:
+        data = fetch_live_data(skip_unchanged=True, region=region)
+    except Exception as e:
+        metrics.ERRORS.inc(region=region, stage="fetch", error=type(e).__name__)
+        raise
+    fetch_time_ms = int((time.time() - poll_time) * 1000)
+    scheduler.observe(data is not None, feed_last_modified(region), poll_time)
+    if data is not None or not probe:
+        writer.submit(int(poll_time), data, fetch_time_ms=fetch_time_ms, **extra)
+    return data is not None
+
+
+def record_speeds(conn: sqlite3.Connection, data: dict, scrape_id: int, storage: str = "rows",
+                  epoch_s: int = None, rollup_conn: sqlite3.Connection = None, commit: bool = True,
+                  rollup_buffer: RollupBuffer = None):
+    """
+    Record speed readings to database (epoch_s is required for matrix storage).
+    With epoch_s, the rollups in rollup_conn (default conn) are updated too:
+    through rollup_buffer when given (written once the hour is over), else
+    right away. With commit=False neither connection is committed (caller commits).
+    """
+    if epoch_s is not None:
+        rollups = rollup_conn or conn
+        speeds = [entry[0] for entry in data["speeds"]]
+        if rollup_buffer is not None:
+            rollup_buffer.add(rollups, epoch_s, speeds, scrape_id)
+        else:
+            update_rollups(rollups, epoch_s, speeds, scrape_id)
+        if commit and (rollups is not conn or storage == "matrix"):
+            rollups.commit()
+
+    if storage == "packed":
+        return record_snapshot(conn, data, scrape_id, commit)
+    if storage == "delta":
+        return record_delta(conn, data, scrape_id, commit)
+    if storage == "matrix":
+        return record_matrix(data, epoch_s)
 
-def record_speeds(conn: sqlite3.Connection, data: dict, timestamp: str):
-    """Record speed readings to database."""
     cursor = conn.cursor()
     speeds = data["speeds"]
 
@@ -155,59 +833,90 @@ def record_speeds(conn: sqlite3.Connection, data: dict, timestamp: str):
         has_incident = 1 if incidents else 0
         incident_ids = json.dumps([i[1] for i in incidents]) if incidents else None
 
-        batch.append((timestamp, idx, speed, has_incident, incident_ids))
+        batch.append((scrape_id, idx, speed, has_incident, incident_ids))
 
     cursor.executemany("""
-        INSERT INTO speed_readings (timestamp, sensor_idx, speed_mph, has_incident, incident_ids)
+        INSERT INTO speed_readings (scrape_id, sensor_idx, speed_mph, has_incident, incident_ids)
         VALUES (?, ?, ?, ?, ?)
     """, batch)
-    conn.commit()
+    if commit:
+        conn.commit()
 
     # Count non-null speeds
     valid_speeds = sum(1 for s in speeds if s[0] is not None)
     return len(speeds), valid_speeds
 
 
-def record_incidents(conn: sqlite3.Connection, data: dict, timestamp: str):
-    """Record/update incidents."""
-    cursor = conn.cursor()
+def record_incidents(conn: sqlite3.Connection, data: dict, epoch_s: int, commit: bool = True):
+    """
+    Upsert incidents in one pass: new incidents get first_seen, known ones
+    advance last_seen (and reopen if closed). Open incidents missing from
+    the feed are marked closed as of epoch_s.
+    """
     incidents = data.get("incidents", [])
+    rows = [
+        tuple(inc[:10]) + (epoch_s, epoch_s)
+        for inc in incidents if len(inc) >= 10
+    ]
 
-    for inc in incidents:
-        if len(inc) < 10:
-            continue
-        road_section_id, incident_id, time_str, location, desc, severity, x, y, start_time, update_time = inc[:10]
-
-        # Check if incident exists
-        cursor.execute("SELECT first_seen FROM incidents WHERE id = ?", (incident_id,))
-        row = cursor.fetchone()
-
-        if row:
-            # Update existing
-            cursor.execute("""
-                UPDATE incidents SET
-                    description = ?, update_time = ?, last_seen = ?
-                WHERE id = ?
-            """, (desc, update_time, timestamp, incident_id))
-        else:
-            # Insert new
-            cursor.execute("""
-                INSERT INTO incidents
-                (id, road_section_id, time_str, location, description, severity, x, y, start_time, update_time, first_seen, last_seen)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (incident_id, road_section_id, time_str, location, desc, severity, x, y, start_time, update_time, timestamp, timestamp))
+    conn.executemany("""
+        INSERT INTO incidents
+        (road_section_id, id, time_str, location, description, severity, x, y, start_time, update_time, first_seen, last_seen)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (id) DO UPDATE SET
+            description = excluded.description,
+            update_time = excluded.update_time,
+            last_seen = MAX(last_seen, excluded.last_seen),
+            closed_at = CASE WHEN excluded.last_seen >= last_seen THEN NULL ELSE closed_at END
+    """, rows)
 
-    conn.commit()
+    if "incidents" in data:
+        conn.execute("""
+            UPDATE incidents SET closed_at = ?
+            WHERE closed_at IS NULL AND last_seen < ?
+        """, (epoch_s, epoch_s))
+
+    if commit:
+        conn.commit()
     return len(incidents)
 
 
-def scrape_once(conn: sqlite3.Connection) -> dict:
-    """Perform a single scrape cycle."""
-    timestamp = datetime.utcnow().isoformat() + "Z"
+def record_heartbeat(conn: sqlite3.Connection, epoch_s: int, status: str = "unchanged",
+                     commit: bool = True):
+    """Record that a scrape ran without storing a snapshot."""
+    conn.execute("INSERT OR REPLACE INTO heartbeats (epoch_s, status) VALUES (?, ?)",
+                 (epoch_s, status))
+    if commit:
+        conn.commit()
+
+
+def record_scrape(conn: sqlite3.Connection, data: dict, epoch_s: int, source: str,
+                  storage: str = "rows", shards: ShardWriter = None, commit: bool = True,
+                  rollup_buffer: RollupBuffer = None):
+    """
+    Register a scrape and record its speeds.
+    With shards, speed data goes to the time shard instead of conn.
+    With commit=False the caller commits conn before the shard.
+    """
+    scrape_id = register_scrape(conn, epoch_s, source)
+    if shards and commit:
+        conn.commit()  # Shard rows reference the scrape, so it must be durable first
+    readings_conn = shards.connection(epoch_s) if shards else conn
+    return record_speeds(readings_conn, data, scrape_id, storage, epoch_s, rollup_conn=conn, commit=commit,
+                         rollup_buffer=rollup_buffer)
+
 
-    data = fetch_live_data()
-    total, valid = record_speeds(conn, data, timestamp)
-    incident_count = record_incidents(conn, data, timestamp)
+def store_snapshot(conn: sqlite3.Connection, data: dict, epoch_s: int, source: str,
+                   storage: str = "rows", shards: ShardWriter = None, commit: bool = True,
+                   rollup_buffer: RollupBuffer = None) -> dict:
+    """Record a fetched payload (None = unchanged feed, heartbeat only) and return a result summary."""
+    timestamp = format_epoch(epoch_s)
+    if data is None:
+        record_heartbeat(conn, epoch_s, commit=commit)
+        return {"timestamp": timestamp, "unchanged": True}
+
+    total, valid = record_scrape(conn, data, epoch_s, source, storage, shards, commit, rollup_buffer)
+    incident_count = record_incidents(conn, data, epoch_s, commit)
 
     return {
         "timestamp": timestamp,
@@ -217,37 +926,264 @@ def scrape_once(conn: sqlite3.Connection) -> dict:
     }
 
 
+def scrape_once(conn: sqlite3.Connection, storage: str = "rows", shards: ShardWriter = None) -> dict:
+    """Perform a single scrape cycle. Unchanged payloads only record a heartbeat."""
+    epoch_s = int(time.time())
+    data = fetch_live_data(skip_unchanged=True)
+    return store_snapshot(conn, data, epoch_s, "scraper", storage, shards)
+
+
+def _file_size(path) -> int:
+    try:
+        return Path(path).stat().st_size
+    except OSError:
+        return 0
+
+
+class SnapshotWriter:
+    """
+    Writer stage of the collector. Fetched payloads are queued with submit()
+    and recorded by a background thread on its own connection; whatever is
+    queued when the writer gets to it is committed as one group. A slow
+    commit or a reader holding a lock delays storage, not the next fetch,
+    until WRITE_QUEUE_SIZE payloads are waiting and submit() blocks.
+    report(result) is called for each payload once it is committed.
+    Rollups are buffered for the current hour (see rollups.RollupBuffer)
+    and written when the hour is over or the writer closes. With retention,
+    a second thread applies the retention policy on its own connection in
+    small transactions, so expiring old data doesn't hold up writes.
+    """
+
+    def __init__(self, source: str, storage: str = "rows", shard_granularity: str = None,
+                 layout: str = None, report=None, retention: bool = False, db_path: Path = DB_PATH,
+                 shard_dir: Path = SHARD_DIR, queue_size: int = WRITE_QUEUE_SIZE,
+                 region: str = DEFAULT_REGION):
+        self.source = source
+        self.region = region
+        self.storage = storage
+        self.report = report
+        self.shard_dir = shard_dir
+        self.rollup_buffer = RollupBuffer()
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.shards = open_shard_writer(self.conn, shard_granularity, layout, shard_dir)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="snapshot-writer")
+        self.thread.start()
+        if retention:
+            # Daemon: a batch cut short at exit is rolled back by SQLite
+            threading.Thread(target=self._run_retention, args=(db_path,), name="retention", daemon=True).start()
+        metrics.QUEUE_DEPTH.set_function(self.depth, region=region)
+        metrics.DB_SIZE.set_function(lambda: _file_size(db_path) + _file_size(f"{db_path}-wal"),
+                                     region=region, file="main")
+        metrics.DB_SIZE.set_function(lambda: sum(_file_size(path) for _, path in list_shards(shard_dir)),
+                                     region=region, file="shards")
+
+    def submit(self, epoch_s: int, data: dict, **extra):
+        """Queue a payload (None = unchanged feed) scraped at epoch_s; extra is added to its result."""
+        self.queue.put((epoch_s, data, extra, time.monotonic()))
+
+    def depth(self) -> int:
+        """Payloads waiting to be written."""
+        return self.queue.qsize()
+
+    def close(self):
+        """Write everything still queued, then stop the threads and close the database."""
+        self.stopping.set()
+        self.queue.put(None)
+        self.thread.join()
+        self.conn.close()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            group = [self.queue.get()]
+            while group[-1] is not None and len(group) < GROUP_COMMIT_MAX:
+                try:
+                    group.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if group[-1] is None:
+                stopping = True
+                group.pop()
+            if group:
+                self._write_group(group)
+        self._flush_rollups()
+        if self.shards:
+            self.shards.close()  # Shard connections belong to this thread
+
+    def _write_group(self, group: list):
+        results = []
+        try:
+            for epoch_s, data, extra, queued in group:
+                # Commit before a shard rollover closes the current shard connection
+                if (self.shards and data is not None and self.shards.key is not None
+                        and self.shards.key != shard_key(epoch_s, self.shards.granularity)):
+                    self._commit(results)
+                    results = []
+                start = time.monotonic()
+                result = store_snapshot(self.conn, data, epoch_s, self.source, self.storage,
+                                        self.shards, commit=False, rollup_buffer=self.rollup_buffer)
+                metrics.INSERT_SECONDS.observe(time.monotonic() - start, region=self.region)
+                results.append((queued, {**result, **extra, "epoch_s": epoch_s}))
+            self._commit(results)
+        except Exception as e:  # Keep the writer alive; the fetcher would block on a dead one
+            metrics.ERRORS.inc(region=self.region, stage="write", error=type(e).__name__)
+            print(f"[ERROR] Write failed, uncommitted payloads dropped: {type(e).__name__}: {e}")
+            self.conn.rollback()
+            self.rollup_buffer.discard()  # Left pending; retention folds what was stored
+            if self.shards and self.shards.conn:
+                self.shards.conn.rollback()
+
+    def _flush_rollups(self):
+        try:
+            self.rollup_buffer.flush(self.conn)
+            self.conn.commit()
+        except sqlite3.Error as e:
+            metrics.ERRORS.inc(region=self.region, stage="rollups", error=type(e).__name__)
+            print(f"[ERROR] Rollup flush failed, scrapes left pending: {e}")
+            self.conn.rollback()
+
+    def _commit(self, results: list):
+        """Commit the main database, then the shard (shard rows reference main scrapes)."""
+        start = time.monotonic()
+        self.conn.commit()
+        if self.shards and self.shards.conn:
+            self.shards.conn.commit()
+        end = time.monotonic()
+        metrics.COMMIT_SECONDS.observe(end - start, region=self.region)
+        for queued, result in results:
+            result["commit_ms"] = int((end - start) * 1000)
+            result["write_delay_ms"] = int((end - queued) * 1000)
+            result["group"] = len(results)
+            self._observe(result)
+            if self.report:
+                self.report(result)
+
+    def _observe(self, result: dict):
+        metrics.LAST_SCRAPE.set(result["epoch_s"], region=self.region)
+        if result.get("total_sensors"):
+            metrics.VALID_RATIO.set(result["valid_readings"] / result["total_sensors"], region=self.region)
+            metrics.INCIDENTS.set(result["incidents"], region=self.region)
+
+    def _run_retention(self, db_path: Path):
+        """Apply retention hourly, in RETENTION_BUDGET runs back to back until one finishes."""
+        conn = sqlite3.connect(db_path, timeout=30)
+        try:
+            while not self.stopping.is_set():
+                finished = self._apply_retention(conn)
+                self.stopping.wait(RETENTION_INTERVAL if finished else 0)
+        finally:
+            conn.close()
+
+    def _apply_retention(self, conn: sqlite3.Connection) -> bool:
+        """One budgeted retention run; returns False if it stopped before finishing."""
+        try:
+            stats = apply_retention(conn, budget_s=RETENTION_BUDGET, shard_dir=self.shard_dir)
+            print(f"  Retention: {stats['raw_rows']:,} raw rows, {stats['scrapes']:,} scrapes, "
+                  f"{stats['rollup_rows']:,} rollup rows, "
+                  f"{stats['pages']:,} pages freed{'' if stats['finished'] else ' (continuing)'}")
+            return stats["finished"]
+        except sqlite3.Error as e:
+            conn.rollback()
+            metrics.ERRORS.inc(region=self.region, stage="retention", error=type(e).__name__)
+            print(f"[ERROR] Retention failed, retrying next hour: {e}")
+            return True
+
+
+def print_result(result: dict, label: str = None):
+    """Log a stored scrape (label: region name when collecting several)."""
+    prefix = f"[{result['timestamp']}] {label + ': ' if label else ''}"
+    if result.get("unchanged"):
+        print(f"{prefix}Feed unchanged, heartbeat only")
+    else:
+        print(f"{prefix}{result['valid_readings']}/{result['total_sensors']} speeds, "
+              f"{result['incidents']} incidents")
+
+
 def main():
-    """Main scraper loop."""
+    """
+    Main scraper loop: each region is polled on its own FeedScheduler ticks
+    (regions due together are fetched concurrently) and stored by its own
+    SnapshotWriter thread.
+    """
+    parser = argparse.ArgumentParser(description="Sigalert traffic scraper")
+    parser.add_argument("--regions", default=DEFAULT_REGION,
+                        help=f"Comma-separated Sigalert regions, e.g. SoCal,NorCal (default: {DEFAULT_REGION})")
+    parser.add_argument("--storage", choices=STORAGE_MODES, default="rows",
+                        help="Speed storage mode (default: rows)")
+    parser.add_argument("--shards", choices=GRANULARITIES,
+                        help="Write speed data to per-month or per-day shard files")
+    parser.add_argument("--layout", choices=READINGS_LAYOUTS,
+                        help="speed_readings layout; migrates an existing table (default: keep)")
+    parser.add_argument("--retention", action="store_true",
+                        help="Apply the default retention policy (see retention.py) every hour")
+    parser.add_argument("--metrics-port", type=int,
+                        help="Serve Prometheus metrics (see metrics.py) on this local port")
+    args = parser.parse_args()
+
+    regions = list(dict.fromkeys(r.strip() for r in args.regions.split(",") if r.strip()))
+    if args.storage == "matrix" and regions != [DEFAULT_REGION]:
+        parser.error(f"--storage matrix only supports the {DEFAULT_REGION} region")
+    multi = len(regions) > 1
+
     print(f"Sigalert Traffic Scraper")
-    print(f"Database: {DB_PATH}")
+    print(f"Regions: {', '.join(regions)}")
+    print(f"Database: {', '.join(str(region_storage(r)[0]) for r in regions)}")
     print(f"Interval: {SCRAPE_INTERVAL}s")
+    print(f"Storage: {args.storage}")
+    print(f"Shards: {args.shards or 'off'}")
+    if args.metrics_port:
+        metrics.start_server(args.metrics_port)
     print()
 
-    conn = sqlite3.connect(DB_PATH)
-    init_db(conn)
+    writers, schedulers = {}, {}
+    for region in regions:
+        db_path, shard_dir = region_storage(region)
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(db_path)
+        init_db(conn, args.layout, shard_dir)
+
+        # Load and populate static data
+        static_data = load_static_data(region=region)
+        populate_sensors(conn, static_data)
+        conn.close()
 
-    # Load and populate static data
-    static_data = load_static_data()
-    populate_sensors(conn, static_data)
+        writers[region] = SnapshotWriter("scraper", args.storage, args.shards, args.layout,
+                                         report=partial(print_result, label=region if multi else None),
+                                         retention=args.retention, db_path=db_path, shard_dir=shard_dir,
+                                         region=region)
+        schedulers[region] = FeedScheduler(SCRAPE_INTERVAL)
 
+    next_poll = dict.fromkeys(regions, time.time())
+    pool = ThreadPoolExecutor(max_workers=len(regions))  # Requests share http_client's pool
     print("\nStarting scrape loop (Ctrl+C to stop)...\n")
 
     try:
         while True:
-            try:
-                result = scrape_once(conn)
-                print(f"[{result['timestamp']}] {result['valid_readings']}/{result['total_sensors']} speeds, {result['incidents']} incidents")
-            except requests.RequestException as e:
-                print(f"[ERROR] Request failed: {e}")
-            except Exception as e:
-                print(f"[ERROR] {type(e).__name__}: {e}")
-
-            time.sleep(SCRAPE_INTERVAL)
+            now = time.time()
+            futures = {
+                region: pool.submit(poll_feed, schedulers[region], writers[region], region)
+                for region in regions if next_poll[region] <= now
+            }
+            for region, future in futures.items():
+                prefix = f"{region}: " if multi else ""
+                try:
+                    future.result()
+                except RequestError as e:
+                    print(f"[ERROR] {prefix}Request failed: {e}")
+                except Exception as e:
+                    print(f"[ERROR] {prefix}{type(e).__name__}: {e}")
+                # Next wall-clock tick, just after the region's next refresh
+                next_poll[region] = schedulers[region].next_poll()
+
+            time.sleep(max(min(next_poll.values()) - time.time(), 0))
     except KeyboardInterrupt:
         print("\nStopping...")
     finally:
-        conn.close()
+        pool.shutdown(wait=False, cancel_futures=True)
+        for writer in writers.values():
+            writer.close()
 
 
 if __name__ == "__main__":
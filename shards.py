@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Time-Partitioned SQLite Shards
+
+Speed data is written to one SQLite file per period under shards/
+(traffic-YYYY-MM.db by default, traffic-YYYY-MM-DD.db with "day"
+granularity). Metadata (sensors, road sections, scrapes, incidents) stays
+in the main traffic.db; shard rows reference main.scrapes by scrape_id.
+
+The router opens the main database and ATTACHes, read-only, only the shards
+overlapping a query's time range, then shadows the time-series tables with
+TEMP views that UNION ALL the main table and each attached shard. Existing
+queries against speed_readings etc. run unchanged.
+
+SQLite attaches at most 10 databases per connection, so open_router refuses
+a range spanning more shards (about a month of --shards day, or every shard
+of a long history). iter_routers covers any range with one router per batch
+of shards; the caller runs its query on each batch and merges the results.
+
+Shards from past periods are never written again and can be VACUUMed,
+compressed or archived independently:
+    python shards.py --vacuum
+"""
+
+import argparse
+import re
+import sqlite3
+import time
+from pathlib import Path
+
+DB_PATH = Path(__file__).parent / "traffic.db"
+SHARD_DIR = Path(__file__).parent / "shards"
+
+# Shard key format per granularity
+GRANULARITIES = {"month": "%Y-%m", "day": "%Y-%m-%d"}
+
+# Tables that live in shards (everything else stays in the main database)
+SHARDED_TABLES = ("speed_readings", "speed_snapshots", "snapshot_incident_refs", "speed_deltas")
+
+# Columns exposed by the router views. speed_readings is listed explicitly because
+# its layout (rowid or clustered) may differ between the main database and shards.
+VIEW_COLUMNS = {"speed_readings": "scrape_id, sensor_idx, speed_mph, has_incident, incident_ids"}
+
+SHARD_RE = re.compile(r"^traffic-(\d{4}-\d{2}(?:-\d{2})?)\.db$")
+
+
+def shard_key(epoch_s: int, granularity: str = "month") -> str:
+    """Shard key for epoch seconds: YYYY-MM or YYYY-MM-DD (UTC)."""
+    return time.strftime(GRANULARITIES[granularity], time.gmtime(epoch_s))
+
+
+def shard_path(key: str, shard_dir: Path = SHARD_DIR) -> Path:
+    return Path(shard_dir) / f"traffic-{key}.db"
+
+
+def list_shards(shard_dir: Path = SHARD_DIR) -> list:
+    """List (key, path) for all shard files, oldest first."""
+    shard_dir = Path(shard_dir)
+    if not shard_dir.exists():
+        return []
+    shards = []
+    for path in shard_dir.iterdir():
+        m = SHARD_RE.match(path.name)
+        if m:
+            shards.append((m.group(1), path))
+    return sorted(shards)
+
+
+def overlapping_shards(since: int = None, until: int = None, shard_dir: Path = SHARD_DIR) -> list:
+    """List (key, path) for shards whose period overlaps epoch range (since, until]."""
+    since_day = shard_key(since, "day") if since is not None else None
+    until_day = shard_key(until, "day") if until is not None else None
+    return [
+        (key, path) for key, path in list_shards(shard_dir)
+        if (since_day is None or key >= since_day[:len(key)])
+        and (until_day is None or key <= until_day[:len(key)])
+    ]
+
+
+class ShardWriter:
+    """Routes writes to the shard for each scrape time, closing shards as periods roll over."""
+
+    def __init__(self, init_schema, shard_dir: Path = SHARD_DIR, granularity: str = "month"):
+        self.init_schema = init_schema
+        self.shard_dir = Path(shard_dir)
+        self.granularity = granularity
+        self.key = None
+        self.conn = None
+
+    def connection(self, epoch_s: int) -> sqlite3.Connection:
+        """Connection to the shard holding epoch_s."""
+        key = shard_key(epoch_s, self.granularity)
+        if key != self.key:
+            self.close()
+            self.shard_dir.mkdir(parents=True, exist_ok=True)
+            self.conn = sqlite3.connect(shard_path(key, self.shard_dir))
+            self.init_schema(self.conn)
+            self.key = key
+        return self.conn
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+            self.key = None
+
+
+def attach_limit() -> int:
+    """Most databases SQLite lets one connection attach (10 unless compiled otherwise)."""
+    conn = sqlite3.connect(":memory:")
+    try:
+        return conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    finally:
+        conn.close()
+
+
+def _router(db_path: Path, shards: list, include_main: bool = True) -> sqlite3.Connection:
+    """
+    Main database with shards attached behind TEMP views. Without
+    include_main the views leave out the main database's own rows.
+    """
+    conn = sqlite3.connect(f"file:{Path(db_path).resolve()}", uri=True)
+    if not shards and include_main:
+        return conn
+
+    schemas = []
+    for i, (key, path) in enumerate(shards):
+        schema = f"shard{i}"
+        conn.execute(f"ATTACH DATABASE ? AS {schema}", (f"file:{path.resolve()}?mode=ro",))
+        schemas.append(schema)
+
+    for table in SHARDED_TABLES:
+        sources = [
+            schema for schema in (["main"] if include_main else []) + schemas
+            if conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?",
+                            (table,)).fetchone()
+        ]
+        columns = VIEW_COLUMNS.get(table, "*")
+        if sources:
+            union = " UNION ALL ".join(f"SELECT {columns} FROM {schema}.{table}" for schema in sources)
+        elif not include_main and conn.execute(
+                "SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone():
+            union = f"SELECT {columns} FROM main.{table} WHERE 0"  # Hide main's rows
+        else:
+            continue
+        conn.execute(f"CREATE TEMP VIEW {table} AS {union}")
+    return conn
+
+
+def open_router(since: int = None, until: int = None,
+                db_path: Path = DB_PATH, shard_dir: Path = SHARD_DIR) -> sqlite3.Connection:
+    """
+    Open the main database with the shards overlapping epoch range (since, until] attached.
+    Time-series tables are shadowed by TEMP views spanning main + shards.
+    Raises ValueError if the range spans more than attach_limit() shards;
+    use iter_routers for those.
+    """
+    shards = overlapping_shards(since, until, shard_dir)
+    limit = attach_limit()
+    if len(shards) > limit:
+        raise ValueError(f"Time range spans {len(shards)} shards, SQLite can attach at most {limit}; "
+                         f"narrow the range or use shards.iter_routers")
+    return _router(db_path, shards)
+
+
+def iter_routers(since: int = None, until: int = None,
+                 db_path: Path = DB_PATH, shard_dir: Path = SHARD_DIR):
+    """
+    Yield router connections that together cover epoch range (since, until]
+    however many shards it spans: each attaches at most attach_limit() of
+    the overlapping shards, and only the first also includes the main
+    database's own speed rows, so every row is seen exactly once. Callers
+    run their query on each and merge the results. Each connection is
+    closed when the next one is requested.
+    """
+    shards = overlapping_shards(since, until, shard_dir)
+    limit = attach_limit()
+    for start in range(0, max(len(shards), 1), limit):
+        conn = _router(db_path, shards[start:start + limit], include_main=start == 0)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+
+def vacuum_shards(shard_dir: Path = SHARD_DIR, granularity: str = "month", now: int = None):
+    """VACUUM every shard older than the current period."""
+    current = shard_key(now if now is not None else int(time.time()), granularity)
+    for key, path in list_shards(shard_dir):
+        if key >= current[:len(key)]:
+            continue
+        before = path.stat().st_size
+        conn = sqlite3.connect(path)
+        conn.execute("VACUUM")
+        conn.close()
+        print(f"  {path.name}: {before:,} -> {path.stat().st_size:,} bytes")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage time-partitioned SQLite shards")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM all closed shards")
+    parser.add_argument("--granularity", choices=GRANULARITIES, default="month")
+    args = parser.parse_args()
+
+    shards = list_shards()
+    print(f"Shard directory: {SHARD_DIR}")
+    for key, path in shards:
+        print(f"  {key}: {path.stat().st_size:,} bytes")
+
+    if args.vacuum:
+        print("\nVacuuming closed shards...")
+        vacuum_shards(granularity=args.granularity)
+
+
+if __name__ == "__main__":
+    main()
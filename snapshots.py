@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Packed Snapshot Storage
+
+Stores one row per scrape instead of one row per sensor per scrape:
+- speed_snapshots.speeds: fixed-width byte array, one byte per sensor index
+  (NULL_SPEED = no data)
+- snapshot_incident_refs: sparse side table, only sensors with incident refs
+Rows are keyed by scrape_id; read helpers take epoch ranges via scrapes.
+
+Read helpers slice the packed blob in SQL (substr on a BLOB is byte-based),
+so pulling one sensor or a sensor range never unpacks whole snapshots.
+Delta scrapes in the range are rebuilt from the slice of their keyframe.
+
+Delta mode stores a packed snapshot as a keyframe every KEYFRAME_INTERVAL
+scrapes and, in between, only the sensors whose speed changed:
+- speed_deltas.changes: packed 3-byte entries (uint16 LE sensor_idx, speed byte)
+"""
+
+import json
+import sqlite3
+
+NULL_SPEED = 255  # Sentinel for null speed (real speeds are 0-254 mph)
+KEYFRAME_INTERVAL = 24  # Deltas between keyframes (2 hours at 5 min)
+
+
+def pack_speeds(speeds: list) -> bytes:
+    """Pack live-feed speed entries into one byte per sensor."""
+    return bytes(
+        NULL_SPEED if entry[0] is None else min(max(int(entry[0]), 0), NULL_SPEED - 1)
+        for entry in speeds
+    )
+
+
+def unpack_speeds(blob: bytes) -> list:
+    """Unpack a speed blob into a list of speeds (None = no data)."""
+    return [None if b == NULL_SPEED else b for b in blob]
+
+
+def incident_refs(speeds: list) -> list:
+    """Extract sparse (sensor_idx, incident_ids_json) pairs from speed entries."""
+    refs = []
+    for idx, entry in enumerate(speeds):
+        incidents = entry[2] if len(entry) > 2 else []
+        if incidents:
+            refs.append((idx, json.dumps([i[1] for i in incidents])))
+    return refs
+
+
+def pack_changes(previous: bytes, current: bytes) -> bytes:
+    """Pack the (sensor_idx, speed) entries that differ between two speed blobs."""
+    out = bytearray()
+    for idx, (old, new) in enumerate(zip(previous, current)):
+        if old != new:
+            out += idx.to_bytes(2, "little")
+            out.append(new)
+    return bytes(out)
+
+
+def apply_changes(blob: bytes, changes: bytes) -> bytes:
+    """Apply packed changes to a speed blob."""
+    speeds = bytearray(blob)
+    for pos in range(0, len(changes), 3):
+        speeds[int.from_bytes(changes[pos:pos + 2], "little")] = changes[pos + 2]
+    return bytes(speeds)
+
+
+def _write_snapshot_row(conn: sqlite3.Connection, speeds: list, blob: bytes, scrape_id: int):
+    """Insert a packed snapshot and its incident refs (caller commits)."""
+    conn.execute("""
+        INSERT OR REPLACE INTO speed_snapshots (scrape_id, sensor_count, speeds)
+        VALUES (?, ?, ?)
+    """, (scrape_id, len(blob), blob))
+    _write_incident_refs(conn, speeds, scrape_id)
+
+
+def _write_incident_refs(conn: sqlite3.Connection, speeds: list, scrape_id: int):
+    """Insert the sparse incident refs for a scrape (caller commits)."""
+    conn.executemany("""
+        INSERT OR REPLACE INTO snapshot_incident_refs (scrape_id, sensor_idx, incident_ids)
+        VALUES (?, ?, ?)
+    """, [(scrape_id, idx, ids) for idx, ids in incident_refs(speeds)])
+
+
+def record_snapshot(conn: sqlite3.Connection, data: dict, scrape_id: int, commit: bool = True):
+    """Record a scrape as a single packed snapshot row (commit=False: caller commits)."""
+    speeds = data["speeds"]
+    blob = pack_speeds(speeds)
+
+    _write_snapshot_row(conn, speeds, blob, scrape_id)
+    if commit:
+        conn.commit()
+
+    valid_speeds = len(blob) - blob.count(NULL_SPEED)
+    return len(speeds), valid_speeds
+
+
+def _latest_state(conn: sqlite3.Connection):
+    """
+    Return (keyframe_id, delta_count, speeds_blob) for the newest stored state.
+    Deltas chain in ingest order, which is scrape id order.
+    """
+    row = conn.execute("""
+        SELECT scrape_id, speeds FROM speed_snapshots ORDER BY scrape_id DESC LIMIT 1
+    """).fetchone()
+    if not row:
+        return None, 0, None
+
+    keyframe_id, blob = row
+    deltas = conn.execute("""
+        SELECT changes FROM speed_deltas WHERE keyframe_id = ? ORDER BY scrape_id
+    """, (keyframe_id,)).fetchall()
+    for (changes,) in deltas:
+        blob = apply_changes(blob, changes)
+    return keyframe_id, len(deltas), blob
+
+
+def record_delta(conn: sqlite3.Connection, data: dict, scrape_id: int, commit: bool = True):
+    """
+    Record a scrape as a change list against the current keyframe.
+    Writes a new keyframe every KEYFRAME_INTERVAL scrapes or when the
+    sensor count changes. With commit=False the caller commits.
+    """
+    speeds = data["speeds"]
+    blob = pack_speeds(speeds)
+    keyframe_id, delta_count, previous = _latest_state(conn)
+
+    if previous is None or len(previous) != len(blob) or delta_count >= KEYFRAME_INTERVAL:
+        _write_snapshot_row(conn, speeds, blob, scrape_id)
+    else:
+        conn.execute("""
+            INSERT OR REPLACE INTO speed_deltas (scrape_id, keyframe_id, changes)
+            VALUES (?, ?, ?)
+        """, (scrape_id, keyframe_id, pack_changes(previous, blob)))
+        _write_incident_refs(conn, speeds, scrape_id)
+    if commit:
+        conn.commit()
+
+    valid_speeds = len(blob) - blob.count(NULL_SPEED)
+    return len(speeds), valid_speeds
+
+
+def reconstruct_speeds(conn: sqlite3.Connection, epoch_s: int) -> tuple:
+    """
+    Rebuild the full speed state as of epoch_s from keyframes and deltas.
+    Returns (state_epoch_s, [speed, ...]) or (None, None) if nothing is stored.
+    """
+    row = conn.execute("""
+        SELECT s.scrape_id, sc.epoch_s, s.speeds
+        FROM speed_snapshots s JOIN scrapes sc ON sc.id = s.scrape_id
+        WHERE sc.epoch_s <= ? ORDER BY sc.epoch_s DESC LIMIT 1
+    """, (epoch_s,)).fetchone()
+    if not row:
+        return None, None
+
+    keyframe_id, state_epoch, blob = row
+    for delta_epoch, changes in conn.execute("""
+        SELECT sc.epoch_s, d.changes
+        FROM speed_deltas d JOIN scrapes sc ON sc.id = d.scrape_id
+        WHERE d.keyframe_id = ? AND sc.epoch_s <= ? ORDER BY d.scrape_id
+    """, (keyframe_id, epoch_s)):
+        blob = apply_changes(blob, changes)
+        state_epoch = delta_epoch
+    return state_epoch, unpack_speeds(blob)
+
+
+def _range_filter(since: int = None, until: int = None) -> tuple:
+    """SQL conditions on sc.epoch_s for epoch range (since, until] and their params."""
+    query, params = "", []
+    if since is not None:
+        query += " AND sc.epoch_s > ?"
+        params.append(since)
+    if until is not None:
+        query += " AND sc.epoch_s <= ?"
+        params.append(until)
+    return query, params
+
+
+def _delta_range_history(conn: sqlite3.Connection, start_idx: int, end_idx: int,
+                         since: int = None, until: int = None) -> list:
+    """
+    Rebuild sensors start_idx..end_idx for the delta scrapes in epoch range
+    (since, until]: each chain from its keyframe, applying only the changes
+    inside the sensor range. Returns [(epoch_s, blob), ...].
+    """
+    condition, params = _range_filter(since, until)
+    keyframes = [keyframe_id for (keyframe_id,) in conn.execute(f"""
+        SELECT DISTINCT d.keyframe_id FROM speed_deltas d JOIN scrapes sc ON sc.id = d.scrape_id
+        WHERE 1 = 1 {condition}
+    """, params)]
+
+    rows = []
+    for keyframe_id in keyframes:
+        row = conn.execute("SELECT substr(speeds, ?, ?) FROM speed_snapshots WHERE scrape_id = ?",
+                           (start_idx + 1, end_idx - start_idx + 1, keyframe_id)).fetchone()
+        if row is None:
+            continue  # Keyframe already expired
+        state = bytearray(row[0])
+        for epoch_s, changes in conn.execute("""
+            SELECT sc.epoch_s, d.changes FROM speed_deltas d JOIN scrapes sc ON sc.id = d.scrape_id
+            WHERE d.keyframe_id = ? AND sc.epoch_s <= ? ORDER BY d.scrape_id
+        """, (keyframe_id, until if until is not None else 2 ** 62)):
+            for pos in range(0, len(changes), 3):
+                idx = int.from_bytes(changes[pos:pos + 2], "little")
+                if start_idx <= idx <= end_idx:
+                    state[idx - start_idx] = changes[pos + 2]
+            if since is None or epoch_s > since:
+                rows.append((epoch_s, bytes(state)))
+    return rows
+
+
+def get_sensor_range_history(conn: sqlite3.Connection, start_idx: int, end_idx: int,
+                             since: int = None, until: int = None) -> list:
+    """
+    Get speeds for sensors start_idx..end_idx across snapshots in epoch range (since, until].
+    Delta scrapes are rebuilt from their keyframe and the deltas before them.
+    Returns [(epoch_s, [speed, ...]), ...] ordered by time.
+    """
+    condition, params = _range_filter(since, until)
+    rows = conn.execute(f"""
+        SELECT sc.epoch_s, substr(s.speeds, ?, ?)
+        FROM speed_snapshots s JOIN scrapes sc ON sc.id = s.scrape_id
+        WHERE 1 = 1 {condition}
+    """, [start_idx + 1, end_idx - start_idx + 1] + params).fetchall()
+    rows += _delta_range_history(conn, start_idx, end_idx, since, until)
+    rows.sort(key=lambda row: row[0])
+
+    return [(epoch_s, unpack_speeds(blob)) for epoch_s, blob in rows]
+
+
+def get_sensor_history(conn: sqlite3.Connection, sensor_idx: int,
+                       since: int = None, until: int = None) -> list:
+    """
+    Get speed history for one sensor from packed or delta snapshots in epoch range (since, until].
+    Returns [(epoch_s, speed_mph, has_incident), ...] like analyze.get_sensor_speeds.
+    """
+    condition, params = _range_filter(since, until)
+    incidents = {epoch_s for (epoch_s,) in conn.execute(f"""
+        SELECT sc.epoch_s FROM snapshot_incident_refs r JOIN scrapes sc ON sc.id = r.scrape_id
+        WHERE r.sensor_idx = ? {condition}
+    """, [sensor_idx] + params)}
+
+    return [
+        (epoch_s, speeds[0] if speeds else None, int(epoch_s in incidents))
+        for epoch_s, speeds in get_sensor_range_history(conn, sensor_idx, sensor_idx, since, until)
+    ]
+
+
+def get_snapshot(conn: sqlite3.Connection, scrape_id: int) -> list:
+    """Get the full speed list for one snapshot (None if not stored)."""
+    row = conn.execute(
+        "SELECT speeds FROM speed_snapshots WHERE scrape_id = ?", (scrape_id,)
+    ).fetchone()
+    return unpack_speeds(row[0]) if row else None
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Memory-Mapped Speed Matrix
+
+Append-only time × sensor matrix stored next to the SQLite database:
+- speeds.matrix: one fixed-width uint8 row per scrape (NULL_SPEED = no data)
+- speeds.times:  sidecar index of int64 epoch seconds, one per row
+- speeds.meta:   JSON header with the row width (sensor count)
+
+Reading a sensor range over a time window is a binary search on the time
+index plus a strided slice of the mapping. With numpy installed the slice is
+a zero-copy 2-D view; without it, one zero-copy memoryview per row.
+
+Appends and the startup repair hold an exclusive flock on speeds.lock, so a
+second writer process can't interleave a row with the first. Readers don't
+lock: a row is written before its time, and slice() picks up times appended
+by other processes since the last read.
+"""
+
+import bisect
+import fcntl
+import json
+import mmap
+import os
+from contextlib import contextmanager
+from array import array
+from pathlib import Path
+
+from snapshots import NULL_SPEED, pack_speeds
+
+MATRIX_DIR = Path(__file__).parent / "matrix"
+SENSOR_COUNT = 6308
+
+
+class SpeedMatrix:
+    """Append-only uint8 speed matrix backed by a memory-mapped file."""
+
+    def __init__(self, path: Path = MATRIX_DIR, width: int = SENSOR_COUNT):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.matrix_path = self.path / "speeds.matrix"
+        self.times_path = self.path / "speeds.times"
+        self.lock_path = self.path / "speeds.lock"
+        meta_path = self.path / "speeds.meta"
+
+        if meta_path.exists():
+            self.width = json.loads(meta_path.read_text())["width"]
+        else:
+            self.width = width
+            meta_path.write_text(json.dumps({"version": 1, "width": width}))
+
+        self.times = array("q")
+        with self._locked():
+            self.refresh()
+            self._repair()
+
+        self._map = None
+        self._mapped_rows = 0
+
+    def _repair(self):
+        """Drop a partially written trailing row left by an interrupted append."""
+        matrix_rows = self.matrix_path.stat().st_size // self.width if self.matrix_path.exists() else 0
+        rows = min(matrix_rows, len(self.times))
+        if self.matrix_path.exists() and self.matrix_path.stat().st_size != rows * self.width:
+            os.truncate(self.matrix_path, rows * self.width)
+        if len(self.times) != rows:
+            del self.times[rows:]
+            self.times_path.write_bytes(self.times.tobytes())
+
+    @contextmanager
+    def _locked(self):
+        """Hold the exclusive write lock (released when the lock file closes)."""
+        with open(self.lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def refresh(self):
+        """Read times appended (or dropped by a repair) in other processes."""
+        rows = (self.times_path.stat().st_size if self.times_path.exists() else 0) // self.times.itemsize
+        if rows < len(self.times):
+            del self.times[rows:]
+        elif rows > len(self.times):
+            with open(self.times_path, "rb") as f:
+                f.seek(len(self.times) * self.times.itemsize)
+                self.times.frombytes(f.read((rows - len(self.times)) * self.times.itemsize))
+
+    def __len__(self):
+        return len(self.times)
+
+    def append(self, epoch: int, speeds: list):
+        """Append one scrape (live-feed speed entries) as a matrix row."""
+        if len(speeds) > self.width:
+            raise ValueError(f"Feed has {len(speeds)} sensors, matrix width is {self.width}")
+
+        row = pack_speeds(speeds).ljust(self.width, bytes([NULL_SPEED]))
+        with self._locked():
+            self.refresh()
+            if self.times and epoch <= self.times[-1]:
+                raise ValueError(f"Epoch {epoch} is not after the last row")
+            with open(self.matrix_path, "ab") as f:
+                f.write(row)
+            with open(self.times_path, "ab") as f:
+                f.write(array("q", [epoch]).tobytes())
+            self.times.append(epoch)
+
+    def _mapping(self):
+        """Return a read-only mapping covering all appended rows."""
+        if self._map is None or self._mapped_rows != len(self.times):
+            if self._map is not None:
+                self._map.close()
+            with open(self.matrix_path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), len(self.times) * self.width, access=mmap.ACCESS_READ)
+            self._mapped_rows = len(self.times)
+        return self._map
+
+    def row_range(self, since: int = None, until: int = None) -> tuple:
+        """Row bounds [start, stop) for epoch range (since, until]."""
+        start = bisect.bisect_right(self.times, since) if since is not None else 0
+        stop = bisect.bisect_right(self.times, until) if until is not None else len(self.times)
+        return start, stop
+
+    def slice(self, start_idx: int, end_idx: int, since: int = None, until: int = None):
+        """
+        Get speeds for sensors start_idx..end_idx over epoch range (since, until].
+        Returns (epochs, rows). rows is a numpy uint8 view of shape
+        (len(epochs), end_idx - start_idx + 1) if numpy is available,
+        otherwise a list of memoryviews. NULL_SPEED marks missing data.
+        """
+        self.refresh()
+        start, stop = self.row_range(since, until)
+        epochs = self.times[start:stop].tolist()
+        if start >= stop:
+            return epochs, []
+
+        buf = self._mapping()
+        try:
+            import numpy as np
+        except ImportError:
+            view = memoryview(buf)
+            return epochs, [
+                view[r * self.width + start_idx:r * self.width + end_idx + 1]
+                for r in range(start, stop)
+            ]
+
+        matrix = np.frombuffer(buf, dtype=np.uint8).reshape(-1, self.width)
+        return epochs, matrix[start:stop, start_idx:end_idx + 1]
+
+    def average_speeds(self, start_idx: int, end_idx: int, since: int = None, until: int = None) -> list:
+        """Average speed per sensor over a window: [(sensor_idx, avg_speed, readings), ...]."""
+        _, rows = self.slice(start_idx, end_idx, since, until)
+        totals = [0] * (end_idx - start_idx + 1)
+        counts = [0] * (end_idx - start_idx + 1)
+        for row in rows:
+            for i, speed in enumerate(bytes(row)):
+                if speed != NULL_SPEED:
+                    totals[i] += speed
+                    counts[i] += 1
+
+        return [
+            (start_idx + i, totals[i] / counts[i], counts[i])
+            for i in range(len(totals)) if counts[i]
+        ]
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+
+_open_matrices = {}
+
+
+def open_matrix(path: Path = MATRIX_DIR) -> SpeedMatrix:
+    """The SpeedMatrix at path, opened once per process."""
+    matrix = _open_matrices.get(path)
+    if matrix is None:
+        matrix = _open_matrices[path] = SpeedMatrix(path)
+    return matrix
+
+
+def record_matrix(data: dict, epoch_s: int, path: Path = MATRIX_DIR):
+    """Append a scrape to the speed matrix at path."""
+    speeds = data["speeds"]
+    open_matrix(path).append(epoch_s, speeds)
+    valid_speeds = sum(1 for s in speeds if s[0] is not None)
+    return len(speeds), valid_speeds
@@ -1,12 +1,9 @@
 #!/usr/bin/env python3
 """Scrape Waze live map for police reports and other alerts near LA."""
 
-import urllib.request
-import ssl
-import json
 from datetime import datetime, timezone
 
-ssl_ctx = ssl.create_default_context()
+import http_client
 
 # LA metro bounding boxes - split to stay under 200 alert cap per request
 LA_TILES = {
@@ -37,9 +34,7 @@ def fetch_waze(bounds):
         f"&env=na&types=alerts,traffic"
     )
     url = f"{WAZE_URL}?{params}"
-    req = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0"})
-    with urllib.request.urlopen(req, timeout=15, context=ssl_ctx) as resp:
-        return json.loads(resp.read().decode("utf-8"))
+    return http_client.get_json(url, {"User-Agent": "Mozilla/5.0"}, timeout=15)
 
 
 def fetch_all_la():